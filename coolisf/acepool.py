@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pools of long-lived ACE workers
+"""
+
+# This code is a part of coolisf library: https://github.com/letuananh/intsem.fx
+# :copyright: (c) 2014 Le Tuan Anh <tuananh.ke@gmail.com>
+# :license: MIT, see LICENSE for more details.
+
+import io
+import queue
+import asyncio
+import logging
+import threading
+from asyncio.subprocess import PIPE, STDOUT
+from concurrent.futures import ThreadPoolExecutor
+
+from delphin.interfaces import ace
+
+
+# ----------------------------------------------------------------------
+# Configuration
+# ----------------------------------------------------------------------
+
+ASYNC_POOL_SIZE = 2  # default number of asyncio ACE workers per grammar
+# AsyncAceParser reuses these private helpers of delphin.interfaces.ace (pydelphin 0.6.x)
+ACE_HELPERS = ('_ace_version', '_tsdb_stdout_parse', '_stdout_parse', '_readlines')
+
+
+def getLogger():
+    return logging.getLogger(__name__)
+
+
+########################################################################
+
+class AceParserPool(object):
+    """ Keep up to `size` ACE parser processes alive and spread sentences across them.
+    Processes are created lazily and reused until the pool is closed.
+    A process which fails while parsing is discarded and replaced on demand.
+    """
+
+    def __init__(self, gram_file, cmdargs=None, executable=None, size=2):
+        if size < 1:
+            raise ValueError("Pool size must be a positive number (provided: {})".format(size))
+        self.gram_file = gram_file
+        self.cmdargs = list(cmdargs) if cmdargs else []
+        self.executable = executable
+        self.size = size
+        self._idle = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=size)
+        self._closed = False
+
+    def _new_parser(self):
+        getLogger().debug("Starting ACE worker #{} with cmdargs: {}".format(len(self._workers) + 1, self.cmdargs))
+        # AceProcess extends cmdargs in place, always give it a copy
+        return ace.AceParser(self.gram_file, executable=self.executable, cmdargs=list(self.cmdargs))
+
+    def _acquire(self):
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise Exception("ACE parser pool has been closed")
+                if self._idle.empty() and len(self._workers) < self.size:
+                    parser = self._new_parser()
+                    self._workers.append(parser)
+                    return parser
+            parser = self._idle.get()
+            if parser is not None:
+                return parser
+            # a worker was discarded, try to start a replacement
+
+    def _discard(self, parser):
+        with self._lock:
+            if parser in self._workers:
+                self._workers.remove(parser)
+        self._idle.put(None)  # wake up a waiting caller
+        try:
+            parser.close()
+        except Exception:
+            getLogger().exception("Could not close broken ACE worker")
+
+    def interact(self, text):
+        """ Parse text using an idle worker (blocking) """
+        parser = self._acquire()
+        try:
+            result = parser.interact(text)
+        except Exception:
+            self._discard(parser)
+            raise
+        if parser._p.poll() is not None:
+            # ACE died while parsing this sentence, do not reuse it
+            getLogger().warning("ACE worker exited while parsing: {}".format(text))
+            self._discard(parser)
+        else:
+            self._idle.put(parser)
+        return result
+
+    def submit(self, text):
+        """ Schedule text for parsing, return a concurrent.futures.Future """
+        return self._executor.submit(self.interact, text)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            workers, self._workers = self._workers, []
+        self._executor.shutdown(wait=True)
+        for parser in workers:
+            try:
+                parser.close()
+            except Exception:
+                getLogger().exception("Could not close ACE worker")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def check_ace_helpers():
+    missing = [name for name in ACE_HELPERS if not hasattr(ace, name)]
+    if missing:
+        raise Exception("AsyncAceParser requires pydelphin 0.6.x (delphin.interfaces.ace does not provide: {})".format(', '.join(missing)))
+
+
+class AsyncAceParser(object):
+    """ An ACE parser process driven with non-blocking pipes (asyncio) """
+
+    __versions = {}  # executable => ACE version
+    __versions_lock = threading.Lock()
+
+    def __init__(self, gram_file, cmdargs=None, executable=None):
+        check_ace_helpers()
+        self.gram_file = gram_file
+        self.cmdargs = list(cmdargs) if cmdargs else []
+        self.executable = executable or 'ace'
+        self._p = None
+
+    @staticmethod
+    def ace_version(executable):
+        """ Run `ace -V` once per executable (blocking) """
+        with AsyncAceParser.__versions_lock:
+            if executable not in AsyncAceParser.__versions:
+                AsyncAceParser.__versions[executable] = ace._ace_version(executable)
+            return AsyncAceParser.__versions[executable]
+
+    async def start(self):
+        version = await asyncio.get_event_loop().run_in_executor(None, AsyncAceParser.ace_version, self.executable)
+        if version >= (0, 9, 24):
+            self.cmdargs.extend(['--tsdb-stdout', '--report-labels'])
+        self._p = await asyncio.create_subprocess_exec(self.executable, '-g', self.gram_file, *self.cmdargs,
+                                                       stdin=PIPE, stdout=PIPE, stderr=STDOUT)
+        return self
+
+    @property
+    def alive(self):
+        return self._p is not None and self._p.returncode is None
+
+    async def _read_response(self):
+        """ Read raw output lines until the end of a response (two consecutive blank lines) """
+        lines = []
+        blank = 0
+        while blank < 2:
+            line = await self._p.stdout.readline()
+            if not line:
+                raise EOFError("ACE process terminated unexpectedly")
+            blank = blank + 1 if not line.strip() else 0
+            lines.append(line)
+        return lines
+
+    async def interact(self, text):
+        self._p.stdin.write((text.rstrip() + '\n').encode('utf-8'))
+        await self._p.stdin.drain()
+        lines = await self._read_response()
+        if '--tsdb-stdout' in self.cmdargs:
+            receive = ace._tsdb_stdout_parse
+        else:
+            receive = ace._stdout_parse
+        response = receive(ace._readlines(io.BytesIO(b''.join(lines))))
+        response['INPUT'] = text
+        return response
+
+    async def close(self):
+        if self._p is None:
+            return None
+        if self._p.returncode is None:
+            self._p.stdin.close()
+            async for line in self._p.stdout:
+                getLogger().debug('ACE cleanup: {}'.format(line.rstrip()))
+        return await self._p.wait()
+
+
+class AsyncAceParserPool(object):
+    """ asyncio counterpart of AceParserPool.
+    A pool must only be used from the event loop it was created in.
+    """
+
+    def __init__(self, gram_file, cmdargs=None, executable=None, size=ASYNC_POOL_SIZE):
+        if size < 1:
+            raise ValueError("Pool size must be a positive number (provided: {})".format(size))
+        self.gram_file = gram_file
+        self.cmdargs = list(cmdargs) if cmdargs else []
+        self.executable = executable
+        self.size = size
+        self._idle = asyncio.Queue()
+        self._workers = []
+        self._starting = 0
+
+    async def _acquire(self):
+        while True:
+            if self._idle.empty() and len(self._workers) + self._starting < self.size:
+                self._starting += 1
+                try:
+                    getLogger().debug("Starting async ACE worker #{} with cmdargs: {}".format(len(self._workers) + 1, self.cmdargs))
+                    parser = await AsyncAceParser(self.gram_file, self.cmdargs, self.executable).start()
+                finally:
+                    self._starting -= 1
+                self._workers.append(parser)
+                return parser
+            parser = await self._idle.get()
+            if parser is not None:
+                return parser
+
+    async def _discard(self, parser):
+        if parser in self._workers:
+            self._workers.remove(parser)
+        self._idle.put_nowait(None)  # wake up a waiting caller
+        try:
+            if parser.alive:
+                parser._p.kill()
+            await parser.close()
+        except Exception:
+            getLogger().exception("Could not close broken ACE worker")
+
+    async def interact(self, text):
+        """ Parse text using an idle worker without blocking the event loop """
+        parser = await self._acquire()
+        try:
+            result = await parser.interact(text)
+        except BaseException:
+            # a half-read response would corrupt the next one
+            await self._discard(parser)
+            raise
+        self._idle.put_nowait(parser)
+        return result
+
+    async def close(self):
+        workers, self._workers = self._workers, []
+        for parser in workers:
+            try:
+                await parser.close()
+            except Exception:
+                getLogger().exception("Could not close ACE worker")
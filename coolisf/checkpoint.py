@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""
+Checkpoints for long-running batch jobs
+"""
+
+# This code is a part of coolisf library: https://github.com/letuananh/intsem.fx
+# :copyright: (c) 2014 Le Tuan Anh <tuananh.ke@gmail.com>
+# :license: MIT, see LICENSE for more details.
+
+import os
+import json
+import zlib
+import logging
+
+from lxml import etree
+
+from coolisf.model import iter_sentences
+
+
+# ----------------------------------------------------------------------
+# Configuration
+# ----------------------------------------------------------------------
+
+CHECKPOINT_VERSION = 1
+CHECKPOINT_FILE = 'isf_checkpoint.json'  # state file name in an output folder
+CHECKPOINT_SUFFIX = '.checkpoint.json'  # state file name next to an output file
+PARTIAL_SUFFIX = '.partial'
+
+
+def getLogger():
+    return logging.getLogger(__name__)
+
+
+# ----------------------------------------------------------------------
+
+class Checkpoint(object):
+    """ Progress of a batch job (number of finished sentences of each document).
+    A key is a tuple of names, e.g. (corpus, document).
+    The state file is rewritten atomically after each update.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.entries = {}
+        if resume and os.path.isfile(path):
+            self.load()
+
+    @staticmethod
+    def _key(key):
+        return '/'.join(str(k) for k in key)
+
+    def load(self):
+        with open(self.path, 'rt', encoding='utf-8') as infile:
+            content = json.load(infile)
+        if content.get('version') != CHECKPOINT_VERSION:
+            raise Exception("Unsupported checkpoint version (provided: {}, expected: {})".format(content.get('version'), CHECKPOINT_VERSION))
+        self.entries = content['entries']
+        getLogger().debug("Loaded {} checkpoint entries from {}".format(len(self.entries), self.path))
+        return self
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wt', encoding='utf-8') as outfile:
+            json.dump({'version': CHECKPOINT_VERSION, 'entries': self.entries}, outfile)
+        os.replace(tmp_path, self.path)
+
+    def completed(self, *key):
+        """ Number of finished sentences """
+        entry = self.entries.get(self._key(key))
+        return entry['sentences'] if entry else 0
+
+    def is_done(self, *key):
+        entry = self.entries.get(self._key(key))
+        return bool(entry and entry['done'])
+
+    def update(self, *key, sentences, done=False):
+        self.entries[self._key(key)] = {'sentences': sentences, 'done': done}
+        self.save()
+
+
+class UnfinishedGzipFile(object):
+    """ Read everything that was flushed to a gzip file which has not been closed """
+
+    def __init__(self, path, chunk_size=65536):
+        self._file = open(path, 'rb')
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.chunk_size = chunk_size
+
+    def read(self, size=-1):
+        while True:
+            chunk = self._file.read(self.chunk_size)
+            if not chunk:
+                return b''
+            data = self._decompressor.decompress(chunk)
+            if data:
+                return data
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def recover_document(path, writer, count):
+    """ Copy the first count sentences of an unfinished document (path) to writer.
+    writer must write to path and must not have written anything yet.
+    The unfinished file is kept as path.partial until the sentences have been copied.
+    Return the number of sentences that could be recovered.
+    """
+    partial_path = path + PARTIAL_SUFFIX
+    if not os.path.isfile(partial_path):
+        # if the .partial file exists, a previous recovery was interrupted and path is incomplete
+        if not os.path.isfile(path):
+            return 0
+        os.replace(path, partial_path)
+    recovered = 0
+    with (UnfinishedGzipFile(partial_path) if path.endswith('.gz') else open(partial_path, 'rb')) as infile:
+        try:
+            for sent in iter_sentences(infile):
+                if recovered >= count:
+                    break
+                writer.write(sent)
+                recovered += 1
+        except etree.XMLSyntaxError:
+            # the document was not closed properly
+            getLogger().debug("Reached the end of unfinished document {}".format(partial_path))
+    if recovered < count:
+        getLogger().warning("Only {}/{} sentences could be recovered from {}".format(recovered, count, partial_path))
+    os.remove(partial_path)
+    return recovered
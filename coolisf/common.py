@@ -11,6 +11,8 @@ Common functions
 import os
 import gzip
 import logging
+import threading
+from collections import OrderedDict
 
 from texttaglib.chirptext import FileHelper
 from lelesk.util import ptpos_to_wn
@@ -39,6 +41,17 @@ def read_file(file_path, mode='rt'):
         return FileHelper.read(file_path, mode)
 
 
+def open_file(file_path, mode='rb'):
+    """ Open an input file for reading (gzip is supported) """
+    file_path = FileHelper.abspath(file_path)  # normalize path
+    if not os.path.isfile(file_path):
+        raise Exception("Input file not found: {}".format(file_path))
+    if file_path.endswith('.gz'):
+        return gzip.open(file_path, mode)
+    else:
+        return open(file_path, mode)
+
+
 def write_file(content, path=None):
     """ Write content to a file, or to console if no path is provided """
     if isinstance(content, str):
@@ -57,6 +70,18 @@ def write_file(content, path=None):
         print(content)
 
 
+def chunked(iterable, size):
+    """ Split an iterable into lists of at most size items """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
 def overlap(cfrom1, cto1, cfrom2, cto2):
     if cfrom1 is None or cto1 is None or cfrom2 is None or cto2 is None:
         raise ValueError("cfrom:cto must be numbers")
@@ -82,3 +107,74 @@ def get_ep_lemma(ep):
         return ep.pred.lemma[:cutpoint]
     else:
         return ep.pred.lemma
+
+
+# ----------------------------------------------------------------------
+# Classes
+# ----------------------------------------------------------------------
+
+class LRUCache(object):
+    """ A thread-safe in-memory least-recently-used cache.
+    Entries are evicted when there are more than max_entries of them or when the sum
+    of their (estimated) sizes exceeds max_size. None means unbounded.
+    """
+
+    def __init__(self, max_entries=1024, max_size=None):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.data = OrderedDict()  # key => (value, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def from_config(cfg):
+        """ Create an LRUCache from a config dict, e.g. {"max_entries": 1000, "max_size": 50000000} """
+        return LRUCache(max_entries=cfg.get('max_entries', 1024), max_size=cfg.get('max_size', None))
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value, size=1):
+        with self.lock:
+            if key in self.data:
+                self.size -= self.data.pop(key)[1]
+            if self.max_size is not None and size > self.max_size:
+                return False  # too big to be cached
+            self.data[key] = (value, size)
+            self.size += size
+            while self.data and ((self.max_entries is not None and len(self.data) > self.max_entries) or (self.max_size is not None and self.size > self.max_size)):
+                self.size -= self.data.popitem(last=False)[1][1]
+                self.evictions += 1
+            return True
+
+    def discard(self, key):
+        with self.lock:
+            if key in self.data:
+                self.size -= self.data.pop(key)[1]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {'entries': len(self.data), 'size': self.size,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_rate': self.hits / total if total else 0.0}
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
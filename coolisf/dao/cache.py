@@ -12,10 +12,20 @@ import os
 import os.path
 import logging
 import json
+import time
+import zlib
+import threading
+import hashlib
+from collections import OrderedDict
 
 from texttaglib.puchikarui import Schema, with_ctx
 
-from coolisf.model import Sentence
+from lxml import etree
+
+from coolisf.common import chunked
+from coolisf.dao.pool import PooledSchema
+from coolisf.model import Sentence, MRS
+from coolisf.util import sent2json, JSON_FORMATS, PARSE_FORMATS
 
 
 # ----------------------------------------------------------------------
@@ -26,50 +36,175 @@ logger = logging.getLogger(__name__)
 MY_DIR = os.path.dirname(os.path.realpath(__file__))
 PC_INIT_SCRIPT = os.path.join(MY_DIR, 'scripts', 'init_isf_cache.sql')
 AC_INIT_SCRIPT = os.path.join(MY_DIR, 'scripts', 'init_ace_cache.sql')
+MAX_PARAMS = 500  # maximum number of keys in one IN (...) clause
+EVICT_INTERVAL = 100  # check cache size once every n saves
+ACCESS_FLUSH_SIZE = 100  # write last access times to the DB once n entries have been accessed ...
+ACCESS_FLUSH_INTERVAL = 30  # ... or once every n seconds
+
+
+def cache_key(*parts):
+    """ Content-hash key of a cache entry (e.g. text, grammar, parse count, extra args) """
+    parts = [None if p is None else str(p) for p in parts]
+    return hashlib.sha1(json.dumps(parts, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def pack(text, compress=False):
+    """ Prepare a text blob for storage (zlib-compressed bytes when compress is True) """
+    if text is None or not compress:
+        return text
+    return zlib.compress(text.encode('utf-8'))
+
+
+def unpack(value):
+    """ Read back a stored text blob, compressed or not """
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode('utf-8')
+    return value
+
+
+def blob_size(*values):
+    return sum(len(v) for v in values if v)
 
 
-class AceCache(Schema):
+class KeyedCache(PooledSchema, Schema):
+    """ Base class of content-hash keyed caches """
+
+    KEY_FIELDS = ()  # sent columns which make up the cache key
+    CHILD_TABLES = ()  # tables which reference sent(ID) through sid
+    LEGACY_INDEXES = ()  # indexes superseded by sent_key
+
+    def __init__(self, data_source, setup_script=None, setup_file=None):
+        Schema.__init__(self, data_source, setup_script=setup_script, setup_file=setup_file)
+        self.memcaches = {}
+
+    def set_memcache(self, memcache, grm=None):
+        """ Put an in-memory LRUCache in front of this cache for a grammar (or for all grammars if grm is None) """
+        self.memcaches[grm] = memcache
+
+    def get_memcache(self, grm):
+        return self.memcaches.get(grm, self.memcaches.get(None))
+
+    def upgrade_if_needed(self):
+        path = self.ds.path
+        if path and str(path) != ':memory:' and os.path.isfile(path) and os.path.getsize(path) > 0:
+            self.upgrade()
+
+    @with_ctx
+    def upgrade(self, ctx=None):
+        """ Add the key column to a cache DB created by older versions """
+        columns = {row['name'] for row in ctx.select('PRAGMA table_info(sent)')}
+        if 'key' in columns:
+            return False
+        logger.warning("Upgrading cache DB at {} (this may take a while)".format(self.ds.path))
+        ctx.auto_commit = False
+        try:
+            ctx.execute('ALTER TABLE sent ADD COLUMN key TEXT')
+            rows = ctx.select('SELECT ID, {} FROM sent ORDER BY ID'.format(', '.join(self.KEY_FIELDS)))
+            keys = {}
+            for row in rows:
+                # only the latest entry of a key survives
+                keys[cache_key(*(row[f] for f in self.KEY_FIELDS))] = row['ID']
+            survivors = set(keys.values())
+            dupes = [(row['ID'],) for row in rows if row['ID'] not in survivors]
+            if dupes:
+                logger.warning("Removing {} duplicated cache entries".format(len(dupes)))
+                for table in self.CHILD_TABLES:
+                    ctx.cur.executemany('DELETE FROM {} WHERE sid = ?'.format(table), dupes)
+                ctx.cur.executemany('DELETE FROM sent WHERE ID = ?', dupes)
+            ctx.cur.executemany('UPDATE sent SET key = ? WHERE ID = ?', keys.items())
+            for index in self.LEGACY_INDEXES:
+                ctx.execute('DROP INDEX IF EXISTS {}'.format(index))
+            ctx.execute('CREATE UNIQUE INDEX IF NOT EXISTS sent_key ON sent(key)')
+            ctx.commit()
+        except Exception:
+            ctx.rollback()
+            raise
+        finally:
+            ctx.auto_commit = True
+        return True
+
+    def compact(self):
+        """ VACUUM the DB file. Return (size before, size after) in bytes """
+        size_before = os.path.getsize(self.ds.path)
+        with self.ctx() as ctx:
+            ctx.execute('VACUUM')
+        return size_before, os.path.getsize(self.ds.path)
+
+    @with_ctx
+    def clear_key(self, key, ctx=None):
+        for table in self.CHILD_TABLES:
+            ctx.execute('DELETE FROM {} WHERE sid IN (SELECT ID FROM sent WHERE key = ?)'.format(table), (key,))
+        ctx.sent.delete('key = ?', (key,))
+
+
+class AceCache(KeyedCache):
     """ Cache ACE output """
 
+    KEY_FIELDS = ('text', 'grm', 'pc', 'extra_args')
+    CHILD_TABLES = ('mrs',)
+    LEGACY_INDEXES = ('sent_text', 'sent_grm', 'sent_pc', 'sent_extra_args')
+
     def __init__(self, data_source, setup_script=None, setup_file=AC_INIT_SCRIPT):
-        Schema.__init__(self, data_source, setup_script=setup_script, setup_file=setup_file)
-        self.add_table('sent', ['ID', 'text', 'grm', 'pc', 'extra_args'])
+        KeyedCache.__init__(self, data_source, setup_script=setup_script, setup_file=setup_file)
+        self.add_table('sent', ['ID', 'key', 'text', 'grm', 'pc', 'extra_args'])
         self.add_table('mrs', ['ID', 'sid', 'mrs'])
+        self.upgrade_if_needed()
 
-    def build_query(self, text, grm, pc, extra_args):
-        query = ['text = ?', 'grm = ?']
-        params = [text, grm]
-        if pc is None:
-            query.append('pc IS NULL')
-        else:
-            query.append('pc = ?')
-            params.append(pc)
-        if extra_args is None:
-            query.append('extra_args IS NULL')
-        else:
-            query.append('extra_args = ?')
-            params.append(extra_args)
-        return query, params
+    def build_key(self, text, grm, pc, extra_args):
+        return cache_key(text, grm, pc, extra_args)
 
     @with_ctx
     def clear(self, text, grm, pc, extra_args, ctx=None):
-        query, params = self.build_query(text, grm, pc, extra_args)
-        ctx.sent.delete(' AND '.join(query), params)
+        key = self.build_key(text, grm, pc, extra_args)
+        self.clear_key(key, ctx=ctx)
+        memcache = self.get_memcache(grm)
+        if memcache is not None:
+            memcache.discard(key)
 
     @with_ctx
     def save(self, sent, grm, pc, extra_args, ctx=None):
-        self.clear(sent.text, grm, pc, extra_args, ctx=ctx)
-        sid = ctx.sent.insert(sent.text, grm, pc, extra_args)
+        key = self.build_key(sent.text, grm, pc, extra_args)
+        self.clear_key(key, ctx=ctx)
+        sid = ctx.sent.insert(key, sent.text, grm, pc, extra_args)
         # store MRS
         for p in sent:
             ctx.mrs.insert(sid, p.mrs()._raw)
         # store shallow
         # store tags?
+        self.remember(key, grm, sent.text, [p.mrs() for p in sent])
+
+    def remember(self, key, grm, text, mrses):
+        memcache = self.get_memcache(grm)
+        if memcache is not None:
+            # keep detached MRS objects so that parsed pydelphin objects can be shared between hits
+            protos = tuple(MRS(m.raw) for m in mrses)
+            for proto, m in zip(protos, mrses):
+                proto._obj = m._obj
+            memcache.put(key, (text, protos), size=len(text) + sum(len(m.raw) for m in protos))
+
+    def recall(self, key, grm):
+        memcache = self.get_memcache(grm)
+        if memcache is None:
+            return None
+        entry = memcache.get(key)
+        if entry is None:
+            return None
+        text, protos = entry
+        s = Sentence(text)
+        for proto in protos:
+            s.add(proto.raw).mrs()._obj = proto.obj()
+        return s
 
-    @with_ctx
     def load(self, text, grm, pc, extra_args, ctx=None):
-        query, params = self.build_query(text, grm, pc, extra_args)
-        sobj = ctx.sent.select_single(' AND '.join(query), params)
+        key = self.build_key(text, grm, pc, extra_args)
+        s = self.recall(key, grm)
+        if s is not None:
+            return s
+        return self.load_key(key, grm, ctx=ctx)
+
+    @with_ctx
+    def load_key(self, key, grm, ctx=None):
+        sobj = ctx.sent.select_single('key = ?', (key,))
         if not sobj:
             return None
         else:
@@ -77,66 +212,339 @@ class AceCache(Schema):
             parses = ctx.mrs.select('sid=?', (sobj.ID,))
             for p in parses:
                 s.add(p.mrs)
+            self.remember(key, grm, s.text, [p.mrs() for p in s])
             return s
 
+    def load_many(self, texts, grm, pc, extra_args, ctx=None):
+        """ Load cached parses of many texts at once, return a dict of text => Sentence """
+        found = {}
+        missed = {}
+        for text in texts:
+            key = self.build_key(text, grm, pc, extra_args)
+            s = self.recall(key, grm)
+            if s is not None:
+                found[text] = s
+            else:
+                missed[key] = text
+        if missed:
+            found.update(self.load_keys(missed, grm, ctx=ctx))
+        return found
 
-class ISFCache(Schema):
-    """ Cache ISF output """
+    @with_ctx
+    def load_keys(self, keys, grm, ctx=None):
+        """ Load sentences by a dict of key => text, return a dict of text => Sentence """
+        sents = {}
+        for chunk in chunked(keys, MAX_PARAMS):
+            query = 'SELECT sent.key, sent.text, mrs.mrs FROM sent LEFT JOIN mrs ON mrs.sid = sent.ID WHERE sent.key IN ({}) ORDER BY sent.ID, mrs.ID'.format(','.join('?' * len(chunk)))
+            for row in ctx.select(query, chunk):
+                s = sents.get(row['key'])
+                if s is None:
+                    s = sents[row['key']] = Sentence(row['text'])
+                if row['mrs'] is not None:
+                    s.add(row['mrs'])
+        found = {}
+        for key, s in sents.items():
+            self.remember(key, grm, s.text, [p.mrs() for p in s])
+            found[keys[key]] = s
+        return found
 
-    def __init__(self, data_source, setup_script=None, setup_file=PC_INIT_SCRIPT):
-        Schema.__init__(self, data_source, setup_script=setup_script, setup_file=setup_file)
-        self.add_table('sent', ['ID', 'raw', 'grm', 'pc', 'tagger', 'text', 'xml', 'latex', 'shallow'])
+    @with_ctx
+    def save_many(self, entries, grm, pc, extra_args, ctx=None):
+        """ Save (text, MRS objects) entries in a single transaction """
+        records = OrderedDict()
+        for text, mrses in entries:
+            records[self.build_key(text, grm, pc, extra_args)] = (text, mrses)
+        if not records:
+            return
+        auto_commit = ctx.auto_commit
+        ctx.auto_commit = False
+        try:
+            keys = [(key,) for key in records]
+            ctx.cur.executemany('DELETE FROM mrs WHERE sid IN (SELECT ID FROM sent WHERE key = ?)', keys)
+            ctx.cur.executemany('DELETE FROM sent WHERE key = ?', keys)
+            ctx.cur.executemany('INSERT INTO sent (key, text, grm, pc, extra_args) VALUES (?, ?, ?, ?, ?)',
+                                [(key, text, grm, pc, extra_args) for key, (text, _) in records.items()])
+            sids = {}
+            for chunk in chunked(records, MAX_PARAMS):
+                for row in ctx.select('SELECT ID, key FROM sent WHERE key IN ({})'.format(','.join('?' * len(chunk))), chunk):
+                    sids[row['key']] = row['ID']
+            ctx.cur.executemany('INSERT INTO mrs (sid, mrs) VALUES (?, ?)',
+                                [(sids[key], m.raw) for key, (_, mrses) in records.items() for m in mrses])
+            ctx.commit()
+        except Exception:
+            ctx.rollback()
+            raise
+        finally:
+            ctx.auto_commit = auto_commit
+        for key, (text, mrses) in records.items():
+            self.remember(key, grm, text, mrses)
+
+
+def derive_renderings(xml, formats):
+    """ Produce renderings (see coolisf.util.JSON_FORMATS) of a sentence from its canonical XML """
+    sent_node = etree.XML(xml)
+    sent = Sentence.from_xml_node(sent_node)
+    # keep MRS from the grammar instead of the one converted back from DMRS
+    for reading, reading_node in zip(sent, sent_node.findall('reading')):
+        mrs_node = reading_node.find('mrs')
+        if mrs_node is not None:
+            reading.mrs(mrs_node.text)
+    j = sent2json(sent, formats=formats)
+    renderings = {fmt: j[fmt] for fmt in formats if fmt in j}
+    for fmt in formats:
+        if fmt in PARSE_FORMATS:
+            renderings[fmt] = [p[fmt] for p in j['parses']]
+    return renderings
+
+
+class ISFCache(KeyedCache):
+    """ Cache ISF output
+
+    Only the sentence XML is stored when a sentence is saved. Other renderings (LaTeX, MRS/DMRS JSON and
+    strings) are derived from it on first request and then memoized in the rendering table.
+    When compress is True, blobs are stored zlib-compressed (uncompressed rows remain readable).
+    When max_size (in bytes of stored blobs) is set, least recently accessed entries are evicted.
+    """
+
+    KEY_FIELDS = ('raw', 'grm', 'pc', 'tagger')
+    CHILD_TABLES = ('parse', 'rendering')
+    LEGACY_INDEXES = ('sent_text', 'sent_grm')
+
+    def __init__(self, data_source, setup_script=None, setup_file=PC_INIT_SCRIPT, compress=False, max_size=None):
+        KeyedCache.__init__(self, data_source, setup_script=setup_script, setup_file=setup_file)
+        self.add_table('sent', ['ID', 'key', 'raw', 'grm', 'pc', 'tagger', 'text', 'xml', 'latex', 'shallow', 'last_access', 'size'])
         self.add_table('parse', ['ID', 'sid', 'pid', 'ident', 'jmrs', 'jdmrs', 'mrs', 'dmrs'])
+        self.add_table('rendering', ['ID', 'sid', 'format', 'data'])
+        self.compress = compress
+        self.max_size = max_size
+        self.save_count = 0
+        self._accessed = {}  # key => last access time, not written to the DB yet
+        self._access_lock = threading.Lock()
+        self._last_flush = time.time()
+        self.upgrade_if_needed()
 
-    def build_query(self, txt, grammar, pc, tagger):
-        q = 'raw=? AND grm=?'
-        p = [txt, grammar]
-        if tagger is None:
-            q += ' AND tagger IS NULL'
-        else:
-            q += ' AND tagger=?'
-            p.append(tagger)
-        if pc is None:
-            q += ' AND pc IS NULL'
-        else:
-            q += ' AND pc=?'
-            p.append(pc)
-        return (q, p)
+    def build_key(self, txt, grammar, pc, tagger):
+        return cache_key(txt, grammar, pc, tagger)
 
     @with_ctx
-    def save(self, txt, grammar, pc, tagger, sent, ctx=None):
-        # delete old data
-        # dq, dp = self.build_query(sent.text, grammar, pc, tagger)
-        # self.sent.delete(dq, dp)
-        # TODO: delete parses as well ...
-        sid = ctx.sent.insert(txt, grammar, pc, tagger, sent.text, sent.to_xml_str(), sent.to_latex(), json.dumps(sent.shallow.to_json()) if sent.shallow else None)
+    def upgrade(self, ctx=None):
+        """ Add key, last_access, size columns and rendering table to a cache DB created by older versions """
+        upgraded = KeyedCache.upgrade(self, ctx=ctx)
+        columns = {row['name'] for row in ctx.select('PRAGMA table_info(sent)')}
+        if 'size' not in columns:
+            logger.warning("Adding size tracking to cache DB at {}".format(self.ds.path))
+            ctx.execute('ALTER TABLE sent ADD COLUMN last_access REAL')
+            ctx.execute('ALTER TABLE sent ADD COLUMN size INTEGER')
+            ctx.execute("""UPDATE sent SET last_access = 0,
+                           size = COALESCE(length(xml), 0) + COALESCE(length(latex), 0) + COALESCE(length(shallow), 0)
+                                  + (SELECT COALESCE(SUM(COALESCE(length(jmrs), 0) + COALESCE(length(jdmrs), 0) + COALESCE(length(mrs), 0) + COALESCE(length(dmrs), 0)), 0)
+                                     FROM parse WHERE parse.sid = sent.ID)""")
+            ctx.execute('CREATE INDEX IF NOT EXISTS sent_last_access ON sent(last_access)')
+            upgraded = True
+        if not ctx.select("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'rendering'"):
+            ctx.execute('CREATE TABLE rendering (ID INTEGER PRIMARY KEY AUTOINCREMENT, sid INTEGER REFERENCES sent(ID) ON UPDATE CASCADE, format TEXT NOT NULL, data TEXT)')
+            ctx.execute('CREATE UNIQUE INDEX rendering_sid_format ON rendering(sid, format)')
+            upgraded = True
+        return upgraded
+
+    @with_ctx
+    def save(self, txt, grammar, pc, tagger, sent, renderings=None, ctx=None):
+        """ Store the canonical form (sentence XML) of a parsed sentence.
+        renderings: a JSON dict of the same sentence (from sent2json) whose renderings should be memoized as well
+        """
+        # replace old data
+        key = self.build_key(txt, grammar, pc, tagger)
+        self.clear_key(key, ctx=ctx)
+        memcache = self.get_memcache(grammar)
+        if memcache is not None:
+            memcache.discard(key)
+        xml = pack(sent.to_xml_str(), self.compress)
+        shallow = json.dumps(sent.shallow.to_json()) if sent.shallow else None
+        sid = ctx.sent.insert(key, txt, grammar, pc, tagger, sent.text, xml, None, shallow, time.time(), blob_size(xml, shallow))
         for r in sent:
             # insert parses
-            ctx.parse.insert(sid, r.ID, r.rid, r.mrs().json_str(), r.dmrs().json_str(), r.mrs().tostring(), r.dmrs().tostring())
+            ctx.parse.insert(sid, r.ID, r.rid, None, None, None, None)
+        if renderings:
+            memo = {fmt: renderings[fmt] for fmt in JSON_FORMATS if fmt in renderings and fmt != 'xml'}
+            for fmt in PARSE_FORMATS:
+                if renderings.get('parses') and all(fmt in p for p in renderings['parses']):
+                    memo[fmt] = [p[fmt] for p in renderings['parses']]
+            self.memoize(sid, memo, ctx=ctx)
+        self.save_count += 1
+        if self.max_size and self.save_count % EVICT_INTERVAL == 1:
+            self.evict(ctx=ctx)
 
     @with_ctx
-    def load(self, txt, grm, pc, tagger, ctx=None):
-        query, params = self.build_query(txt, grm, pc, tagger)
-        sobj = ctx.sent.select_single(query, params)
-        # logger.debug("q", query, "p", params, "sobj", sobj)
-        if not sobj:
-            return None
-        # else
-        sent = {'sent': sobj.text,
-                'parse_count': sobj.pc,
-                'tagger': sobj.tagger,
-                'grammar': sobj.grm,
+    def memoize(self, sid, renderings, ctx=None):
+        """ Store derived renderings (format => value) of a cached sentence """
+        size = 0
+        for fmt, value in renderings.items():
+            data = pack(value if isinstance(value, str) else json.dumps(value, ensure_ascii=False), self.compress)
+            ctx.execute('INSERT OR REPLACE INTO rendering (sid, format, data) VALUES (?, ?, ?)', (sid, fmt, data))
+            size += blob_size(data)
+        if size:
+            ctx.execute('UPDATE sent SET size = size + ? WHERE ID = ?', (size, sid))
+
+    def touch(self, key, ctx=None):
+        """ Record an access to a cache entry. Access times are written to the DB in batches (see flush_access) """
+        now = time.time()
+        with self._access_lock:
+            self._accessed[key] = now
+            due = len(self._accessed) >= ACCESS_FLUSH_SIZE or now - self._last_flush >= ACCESS_FLUSH_INTERVAL
+        if due:
+            self.flush_access(ctx=ctx)
+
+    @with_ctx
+    def flush_access(self, ctx=None):
+        """ Write pending last access times to the DB """
+        with self._access_lock:
+            accessed, self._accessed = self._accessed, {}
+            self._last_flush = time.time()
+        if accessed:
+            ctx.cur.executemany('UPDATE sent SET last_access = ? WHERE key = ?', [(t, k) for k, t in accessed.items()])
+            if ctx.auto_commit:
+                ctx.commit()
+
+    @with_ctx
+    def total_size(self, ctx=None):
+        return ctx.select_scalar('SELECT COALESCE(SUM(size), 0) FROM sent')
+
+    @with_ctx
+    def evict(self, max_size=None, ctx=None):
+        """ Remove least recently accessed entries until the stored blobs fit in max_size bytes.
+        Return the number of evicted entries
+        """
+        self.flush_access(ctx=ctx)
+        if max_size is None:
+            max_size = self.max_size
+        if max_size is None:
+            return 0
+        excess = self.total_size(ctx=ctx) - max_size
+        if excess <= 0:
+            return 0
+        victims = []
+        cur = ctx.conn.execute('SELECT ID, key, grm, size FROM sent ORDER BY last_access, ID')
+        for row in cur:
+            if excess <= 0:
+                break
+            victims.append(row)
+            excess -= row['size'] or 0
+        cur.close()
+        ids = [(row['ID'],) for row in victims]
+        auto_commit = ctx.auto_commit
+        ctx.auto_commit = False
+        try:
+            for table in self.CHILD_TABLES:
+                ctx.cur.executemany('DELETE FROM {} WHERE sid = ?'.format(table), ids)
+            ctx.cur.executemany('DELETE FROM sent WHERE ID = ?', ids)
+            ctx.commit()
+        except Exception:
+            ctx.rollback()
+            raise
+        finally:
+            ctx.auto_commit = auto_commit
+        for row in victims:
+            memcache = self.get_memcache(row['grm'])
+            if memcache is not None:
+                memcache.discard(row['key'])
+        logger.info("Evicted {} entries from ISF cache".format(len(victims)))
+        return len(victims)
+
+    def compact(self):
+        """ Evict entries over max_size and VACUUM the DB file. Return (size before, size after) in bytes """
+        size_before = os.path.getsize(self.ds.path)
+        with self.ctx() as ctx:
+            self.evict(ctx=ctx)
+            ctx.commit()
+            ctx.execute('VACUUM')
+        return size_before, os.path.getsize(self.ds.path)
+
+    def load(self, txt, grm, pc, tagger, formats=None, ctx=None):
+        """ Load a parsed sentence as a JSON-ready dict (same layout as coolisf.util.sent2json).
+        formats: renderings to include (see coolisf.util.JSON_FORMATS), all of them by default
+        """
+        if formats is None:
+            formats = JSON_FORMATS
+        key = self.build_key(txt, grm, pc, tagger)
+        memcache = self.get_memcache(grm)
+        if memcache is not None:
+            entry = memcache.get(key)
+            if entry is not None and all(fmt in entry['renderings'] for fmt in formats):
+                self.touch(key, ctx=ctx)
+                return self.to_json(entry, formats)
+        entry = self.load_key(key, grm, formats, ctx=ctx)
+        return self.to_json(entry, formats) if entry is not None else None
+
+    def to_json(self, entry, formats):
+        renderings = entry['renderings']
+        sent = {'sent': entry['sent'],
+                'parse_count': entry['parse_count'],
+                'tagger': entry['tagger'],
+                'grammar': entry['grammar'],
                 'parses': [],
-                'xml': sobj.xml,
-                'latex': sobj.latex,
-                'shallow': json.loads(sobj.shallow) if sobj.shallow else None}
-        # select parses
-        parses = ctx.parse.select('sid=?', (sobj.ID,))
-        for p in parses:
-            sent['parses'].append({'pid': p.pid,
-                                   'ident': p.ident,
-                                   'mrs': json.loads(p.jmrs),
-                                   'dmrs': json.loads(p.jdmrs),
-                                   'mrs_raw': p.mrs,
-                                   'dmrs_raw': p.dmrs})
+                'shallow': entry['shallow']}
+        for fmt in formats:
+            if fmt not in PARSE_FORMATS:
+                sent[fmt] = renderings[fmt]
+        for idx, (pid, ident) in enumerate(entry['parses']):
+            p = {'pid': pid, 'ident': ident}
+            for fmt in formats:
+                if fmt in PARSE_FORMATS:
+                    p[fmt] = renderings[fmt][idx]
+            sent['parses'].append(p)
         return sent
+
+    @with_ctx
+    def load_key(self, key, grm, formats=JSON_FORMATS, ctx=None):
+        """ Load a cache entry and make sure that the requested renderings are available """
+        sobj = ctx.sent.select_single('key = ?', (key,))
+        if not sobj:
+            return None
+        self.touch(key, ctx=ctx)
+        memcache = self.get_memcache(grm)
+        entry = memcache.get(key) if memcache is not None else None
+        if entry is None:
+            xml = unpack(sobj.xml)
+            entry = {'sent': sobj.text,
+                     'parse_count': sobj.pc,
+                     'tagger': sobj.tagger,
+                     'grammar': sobj.grm,
+                     'parses': [],
+                     'shallow': json.loads(sobj.shallow) if sobj.shallow else None,
+                     'renderings': {'xml': xml}}
+            renderings = entry['renderings']
+            if sobj.latex:
+                renderings['latex'] = unpack(sobj.latex)
+            parses = ctx.parse.select('sid=?', (sobj.ID,))
+            entry['parses'] = [(p.pid, p.ident) for p in parses]
+            if parses and parses[0].jmrs is not None:
+                # entries from older versions stored every rendering
+                renderings['mrs'] = [json.loads(unpack(p.jmrs)) for p in parses]
+                renderings['dmrs'] = [json.loads(unpack(p.jdmrs)) for p in parses]
+                renderings['mrs_raw'] = [unpack(p.mrs) for p in parses]
+                renderings['dmrs_raw'] = [unpack(p.dmrs) for p in parses]
+        else:
+            entry = dict(entry, renderings=dict(entry['renderings']))
+        renderings = entry['renderings']
+        missing = [fmt for fmt in formats if fmt not in renderings]
+        if missing:
+            query = 'SELECT format, data FROM rendering WHERE sid = ? AND format IN ({})'.format(','.join('?' * len(missing)))
+            for row in ctx.select(query, [sobj.ID] + missing):
+                data = unpack(row['data'])
+                renderings[row['format']] = json.loads(data) if row['format'] in PARSE_FORMATS else data
+            missing = [fmt for fmt in missing if fmt not in renderings]
+        if missing:
+            logger.debug("Deriving {} for cached sentence: {}".format(missing, sobj.text))
+            derived = derive_renderings(renderings['xml'], missing)
+            self.memoize(sobj.ID, derived, ctx=ctx)
+            renderings.update(derived)
+        if memcache is not None:
+            memcache.put(key, entry, size=self.entry_size(entry))
+        return entry
+
+    def entry_size(self, entry):
+        """ Estimate memory footprint of a cache entry """
+        size = len(entry['sent'])
+        for value in entry['renderings'].values():
+            size += len(value) if isinstance(value, str) else len(json.dumps(value))
+        return size
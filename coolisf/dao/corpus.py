@@ -13,12 +13,16 @@ Corpus DAO - ISF Corpus management functions
 
 import os
 import os.path
+import sqlite3
 import logging
+import threading
 
 from texttaglib.puchikarui import Schema, with_ctx
 from texttaglib.chirptext import ttl
 
 from coolisf.util import is_valid_name
+from coolisf.common import chunked
+from coolisf.dao.pool import PooledSchema
 from coolisf.model import Corpus, Document, Sentence, Reading
 from coolisf.model import MRS, DMRS, DMRSLayout, Node, Sense, SortInfo, Link, Predicate
 from coolisf.model import GpredValue, Lemma
@@ -32,13 +36,40 @@ from coolisf.model import Word, Concept, CWLink
 logger = logging.getLogger(__name__)
 MY_DIR = os.path.dirname(os.path.realpath(__file__))
 INIT_SCRIPT = os.path.join(MY_DIR, 'scripts', 'init_corpus.sql')
+SEARCH_SCRIPT = os.path.join(MY_DIR, 'scripts', 'init_search.sql')
+UPGRADE_OBJECTS = ('pred_index', 'sentence_|_docID_flag_ID')  # added after the first schema version
+BULK_CHUNK_SIZE = 500  # max number of values in one IN (...) lookup
+FAST_IMPORT_PRAGMAS = (('synchronous', 'OFF'), ('journal_mode', 'MEMORY'))
+CURSOR_BATCH_SIZE = 200  # number of sentences fetched at once by iter_sents()
+SEARCH_RESULT_FIELDS = ('text', 'sentence_ident', 'docID', 'doc_name', 'corpus_name', 'corpusID')
 
 
-class RichKopasu(Schema):
+def fts5_available():
+    """ Check if the sqlite3 library supports full-text search (FTS5) """
+    global _FTS5
+    if _FTS5 is None:
+        conn = sqlite3.connect(':memory:')
+        try:
+            conn.execute('CREATE VIRTUAL TABLE fts_test USING fts5(text)')
+            _FTS5 = True
+        except sqlite3.OperationalError:
+            logger.warning("SQLite FTS5 is not available, sentence text search will not be indexed")
+            _FTS5 = False
+        finally:
+            conn.close()
+    return _FTS5
+
+
+_FTS5 = None
+
+
+class RichKopasu(PooledSchema, Schema):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.add_file(INIT_SCRIPT)
+        if fts5_available():
+            self.add_file(SEARCH_SCRIPT)
         self.add_table('corpus', ['ID', 'name', 'title'], proto=Corpus).set_id('ID')
         self.add_table('document', ['ID', 'name', 'corpusID', 'title',
                                     'grammar', 'tagger', 'parse_count', 'lang'],
@@ -74,6 +105,12 @@ class RichKopasu(Schema):
                        proto=Concept).set_id('ID')
         self.add_table('cwl', ['cid', 'wid'],
                        proto=CWLink)
+        # Search index
+        self.add_table('pred_index', ['ID', 'sentID', 'readingID', 'nodeid', 'pred', 'lemma', 'carg', 'synsetid']).set_id('ID')
+
+
+def in_clause(field, values):
+    return "{f} IN ({p})".format(f=field, p=','.join(['?'] * len(values)))
 
 
 class CachedTable():
@@ -123,6 +160,33 @@ class CachedTable():
             self.cache(new_object)
         return self.cacheMap[value]
 
+    def by_values(self, values, ctx):
+        """ Resolve many values at once.
+        Missing records are looked up and inserted in bulk, then cached.
+        """
+        missing = list({v for v in values if v not in self.cacheMap})
+        for inserting in (False, True):
+            if not missing:
+                break
+            if inserting:
+                query = "INSERT INTO {t} ({f}) VALUES (?)".format(t=self.table.name, f=self.cache_by_field)
+                ctx.cur.executemany(query, [(v,) for v in missing])
+            for chunk in chunked(missing, BULK_CHUNK_SIZE):
+                where = in_clause(self.cache_by_field, chunk)
+                for instance in self.table.select(where, chunk, ctx=ctx):
+                    self.cache(instance)
+            missing = [v for v in missing if v not in self.cacheMap]
+        return {v: self.cacheMap[v] for v in values}
+
+    def by_ids(self, IDs, ctx):
+        """ Cache many records (of a single-column ID table) at once """
+        missing = list({ID for ID in IDs if (ID,) not in self.cacheMapByID})
+        id_col = self.table.id_cols[0]
+        for chunk in chunked(missing, BULK_CHUNK_SIZE):
+            where = in_clause(id_col, chunk)
+            for instance in self.table.select(where, chunk, ctx=ctx):
+                self.cache(instance)
+
     def by_id(self, *ID, ctx=None):
         k = tuple(ID)
         if k not in self.cacheMapByID:
@@ -139,11 +203,126 @@ class CorpusDAOSQLite(RichKopasu):
         self.name = name
         self.lemmaCache = CachedTable(self.rplemma, "lemma", auto_fill=auto_fill)
         self.gpredCache = CachedTable(self.gpval, "value", auto_fill=auto_fill)
+        self._schema_checked = False
+        self._schema_lock = threading.Lock()
+        self._has_pred_index = False
+        self._has_fts = False
 
     @property
     def db_path(self):
         return self.ds.path
 
+    def ctx(self):
+        ctx = super().ctx()
+        if not self._schema_checked:
+            # databases created by older versions are upgraded when they are first used
+            with self._schema_lock:
+                if not self._schema_checked:
+                    try:
+                        self.upgrade_schema(ctx)
+                    except Exception:
+                        ctx.close()
+                        raise
+                    self._schema_checked = True
+        return ctx
+
+    def _schema_objects(self, ctx):
+        names = {row['name'] for row in ctx.execute("SELECT name FROM sqlite_master")}
+        self._has_pred_index = 'pred_index' in names
+        self._has_fts = 'sentence_fts' in names
+        return names
+
+    def upgrade_schema(self, ctx):
+        """ Run ensure_indexes() if tables or indexes of this version are missing """
+        expected = set(UPGRADE_OBJECTS)
+        if fts5_available():
+            expected.add('sentence_fts')
+        if expected - self._schema_objects(ctx):
+            try:
+                self.ensure_indexes(ctx=ctx)
+            except sqlite3.Error:
+                # e.g. a read-only database, it can still be used without the search index
+                logger.exception("Could not upgrade database at {}".format(self.ds.path))
+                self._schema_objects(ctx)
+
+    @with_ctx
+    def ensure_indexes(self, ctx=None):
+        """ Create missing tables and indexes in a database created by an older version """
+        names = self._schema_objects(ctx)
+        scripts = [INIT_SCRIPT, SEARCH_SCRIPT] if fts5_available() else [INIT_SCRIPT]
+        for script in scripts:
+            with open(script) as script_file:
+                ctx.cur.executescript(script_file.read())
+        self._schema_objects(ctx)
+        texts = self._has_fts and 'sentence_fts' not in names
+        preds = 'pred_index' not in names
+        if texts or preds:
+            logger.warning("Building search index of {} (this may take a while)".format(self.ds.path))
+            self.rebuild_search_index(texts=texts, preds=preds, ctx=ctx)
+
+    @with_ctx
+    def rebuild_search_index(self, texts=True, preds=True, ctx=None):
+        """ Re-index all sentence texts and/or DMRS nodes """
+        if texts and self._has_fts:
+            ctx.execute("INSERT INTO sentence_fts(sentence_fts) VALUES ('rebuild')")
+        if preds and self._has_pred_index:
+            ctx.pred_index.delete()
+            for doc in ctx.doc.select():
+                for sent in self.iter_sents(doc.ID, ctx=ctx):
+                    self.index_readings(sent.readings, ctx=ctx)
+
+    @with_ctx
+    def index_readings(self, readings, ctx=None):
+        """ Add DMRS nodes of saved readings to the search index """
+        if not self._has_pred_index:
+            return
+        rows = [(r.sentID, r.ID, n.nodeid, n.predstr, n.rplemma, n.carg, n.synsetid)
+                for r in readings for n in r.dmrs().layout.nodes]
+        ctx.cur.executemany("INSERT INTO pred_index (sentID, readingID, nodeid, pred, lemma, carg, synsetid) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    @with_ctx
+    def search_sents(self, text=None, pred=None, lemma=None, carg=None, synsetid=None, docID=None, limit=None, with_comment=False, with_readings=False, ctx=None):
+        """ Find sentences by text and/or by DMRS nodes.
+        text -- FTS5 query over sentence texts (a LIKE pattern when FTS5 is not available)
+        pred, lemma, carg, synsetid -- all given values must match the same node (e.g. _dog_n_1 tagged 02084071-n)
+        Return sentences with the matched readings (see build_search_result)
+        """
+        node_filters = [(f, v) for f, v in (('pred', pred), ('lemma', lemma), ('carg', carg), ('synsetid', synsetid)) if v is not None]
+        if node_filters and not self._has_pred_index:
+            raise Exception("Search index is not available in {}".format(self.ds.path))
+        where = []
+        params = []
+        if node_filters:
+            query = """SELECT DISTINCT p.sentID, p.readingID, s.text, s.ident AS sentence_ident, s.docID,
+                              d.name AS doc_name, c.name AS corpus_name, c.ID AS corpusID
+                       FROM pred_index p JOIN sentence s ON s.ID = p.sentID"""
+            for field, value in node_filters:
+                where.append('p.{} = ?'.format(field))
+                params.append(value)
+        else:
+            query = """SELECT s.ID AS sentID, NULL AS readingID, s.text, s.ident AS sentence_ident, s.docID,
+                              d.name AS doc_name, c.name AS corpus_name, c.ID AS corpusID
+                       FROM sentence s"""
+        query += """ LEFT JOIN document d ON d.ID = s.docID LEFT JOIN corpus c ON c.ID = d.corpusID"""
+        if text:
+            if self._has_fts:
+                where.append('s.ID IN (SELECT rowid FROM sentence_fts WHERE sentence_fts MATCH ?)')
+                params.append(text)
+            else:
+                where.append('s.text LIKE ?')
+                params.append(text)
+        if docID is not None:
+            where.append('s.docID = ?')
+            params.append(docID)
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY sentID, readingID' if node_filters else ' ORDER BY sentID'
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit)
+        rows = ctx.execute(query, params).fetchall()
+        return self.build_search_result(rows, with_comment=with_comment, with_readings=with_readings, ctx=ctx)
+
     @with_ctx
     def get_corpus(self, corpus_name, ctx=None):
         return ctx.corpus.select_single('name=?', (corpus_name,))
@@ -188,23 +367,74 @@ class CorpusDAOSQLite(RichKopasu):
         return doc
 
     @with_ctx
-    def get_sents(self, docID, flag=None, add_dummy_parses=True, page=None, pagesize=1000, ctx=None):
+    def get_sents(self, docID, flag=None, add_dummy_parses=True, page=None, pagesize=1000, after_id=None, before_id=None, ctx=None):
+        """ Get sentences of a document (ordered by ID)
+        after_id/before_id -- keyset pagination: pagesize sentences right after/before a sentence ID.
+                              Prefer these to page, which has to skip all previous rows.
+        """
         where = ['docID = ?']
         params = [docID]
         limit = None
+        orderby = 'ID'
         if flag is not None:
             where.append('flag = ?')
             params.append(flag)
-        if page is not None:
+        if after_id is not None:
+            where.append('ID > ?')
+            params.append(after_id)
+            limit = pagesize
+        elif before_id is not None:
+            where.append('ID < ?')
+            params.append(before_id)
+            orderby = 'ID DESC'
+            limit = pagesize
+        elif page is not None:
             offset = page * pagesize
             limit = "{}, {}".format(offset, pagesize)
-        sents = ctx.sentence.select(' AND '.join(where), params, limit=limit)
+        sents = ctx.sentence.select(' AND '.join(where), params, orderby=orderby, limit=limit)
+        if before_id is not None:
+            sents.reverse()
         if add_dummy_parses:
+            reading_counts = self.count_readings([sent.ID for sent in sents], ctx=ctx)
             for sent in sents:
-                reading_count = ctx.select_scalar('SELECT COUNT(*) FROM reading WHERE sentid=?', (sent.ID,))
-                sent.readings = [None] * reading_count
+                sent.readings = [None] * reading_counts.get(sent.ID, 0)
         return sents
 
+    @with_ctx
+    def count_readings(self, sentIDs, ctx=None):
+        """ Number of readings of each sentence (sentID => count) """
+        reading_counts = {}
+        for chunk in chunked(sentIDs, BULK_CHUNK_SIZE):
+            query = 'SELECT sentID, COUNT(*) FROM reading WHERE {} GROUP BY sentID'.format(in_clause('sentID', chunk))
+            for sentID, count in ctx.execute(query, chunk).fetchall():
+                reading_counts[sentID] = count
+        return reading_counts
+
+    def iter_sents(self, docID, flag=None, with_readings=True, batch_size=CURSOR_BATCH_SIZE, ctx=None):
+        """ Iterate through all sentences of a document (and their readings) in ID order.
+        Sentences are fetched in batches using keyset pagination.
+        """
+        if ctx is None:
+            with self.ctx() as ctx:
+                yield from self.iter_sents(docID, flag=flag, with_readings=with_readings, batch_size=batch_size, ctx=ctx)
+            return
+        last_id = 0
+        while True:
+            sents = self.get_sents(docID, flag=flag, add_dummy_parses=False, pagesize=batch_size, after_id=last_id, ctx=ctx)
+            if not sents:
+                break
+            if with_readings:
+                sent_map = {sent.ID: sent for sent in sents}
+                readings = []
+                for chunk in chunked(sent_map, BULK_CHUNK_SIZE):
+                    readings.extend(ctx.reading.select(in_clause('sentID', chunk), chunk, orderby='ID'))
+                for r in readings:
+                    r.sent = sent_map[r.sentID]
+                    r.sent.readings.append(r)
+                self.get_readings(readings, ctx=ctx)
+            yield from sents
+            last_id = sents[-1].ID
+
     @with_ctx
     def note_sentence(self, sent_id, comment, ctx=None):
         # save comments
@@ -266,30 +496,7 @@ class CorpusDAOSQLite(RichKopasu):
         # nodes and links are in layout
         # save nodes
         for node in dmrs.layout.nodes:
-            node.dmrsID = dmrs.ID
-            # save realpred
-            node.pred = node.predstr
-            if node.rplemma:
-                # Escape lemma
-                lemma = self.lemmaCache.by_value(node.rplemma, ctx=ctx)
-                node.rplemmaID = lemma.ID
-            # save gpred
-            if node.gpred:
-                gpred_value = self.gpredCache.by_value(node.gpred, ctx=ctx)
-                node.gpred_valueID = gpred_value.ID
-            # save sense
-            if node.sense:
-                node.synsetid = node.sense.synsetid
-                node.synset_score = node.sense.score
-            elif node.nodeid in dmrs.tags:
-                tags = dmrs.tags[node.nodeid]
-                tag = tags[0]
-                for t in tags[1:]:
-                    if t.method == ttl.Tag.GOLD:
-                        tag = t
-                        break
-                node.synsetid = tag.synset.ID.to_canonical()
-                node.synset_score = tag.synset.tagcount
+            self.prepare_node(dmrs, node, ctx=ctx)
             # reset node ID
             node.ID = None
             node.ID = ctx.node.save(node)
@@ -304,49 +511,208 @@ class CorpusDAOSQLite(RichKopasu):
                 link.rargname = ''
             link.ID = None  # reset link ID
             link.ID = ctx.link.save(link)
+        self.index_readings([reading], ctx=ctx)
+
+    def prepare_node(self, dmrs, node, ctx=None):
+        """ Fill in the DB fields of a DMRS node (pred value IDs and sense) """
+        node.dmrsID = dmrs.ID
+        # save realpred
+        node.pred = node.predstr
+        if node.rplemma:
+            # Escape lemma
+            lemma = self.lemmaCache.by_value(node.rplemma, ctx=ctx)
+            node.rplemmaID = lemma.ID
+        # save gpred
+        if node.gpred:
+            gpred_value = self.gpredCache.by_value(node.gpred, ctx=ctx)
+            node.gpred_valueID = gpred_value.ID
+        # save sense
+        if node.sense:
+            node.synsetid = node.sense.synsetid
+            node.synset_score = node.sense.score
+        elif node.nodeid in dmrs.tags:
+            tags = dmrs.tags[node.nodeid]
+            tag = tags[0]
+            for t in tags[1:]:
+                if t.method == ttl.Tag.GOLD:
+                    tag = t
+                    break
+            node.synsetid = tag.synset.ID.to_canonical()
+            node.synset_score = tag.synset.tagcount
+
+    @with_ctx
+    def save_doc_bulk(self, doc, fast=False, ctx=None):
+        """ Save a document and all of its new sentences (readings, DMRS nodes, sortinfo & links) in one transaction.
+        Rows are inserted with executemany() and lemma/gpred values are resolved in bulk.
+        fast -- relax durability (synchronous=OFF, in-memory journal) during the import.
+                An interrupted import may corrupt the database, only use it on a copy or a new database.
+        """
+        sents = [s for s in doc if not s.ID]
+        pragmas = []
+        if fast:
+            for name, value in FAST_IMPORT_PRAGMAS:
+                pragmas.append((name, ctx.select_scalar("PRAGMA {}".format(name))))
+                ctx.execute("PRAGMA {}={}".format(name, value))
+        auto_commit = ctx.auto_commit
+        ctx.auto_commit = False
+        try:
+            # take the write lock before IDs are picked so that concurrent imports can't pick the same ones
+            if ctx.conn.in_transaction:
+                # a transaction started by the caller, a no-op write acquires its lock
+                ctx.execute("DELETE FROM sqlite_sequence WHERE 0")
+            else:
+                ctx.execute("BEGIN IMMEDIATE")
+            if not doc.ID:
+                self.save_doc(doc, ctx=ctx)
+            # pre-resolve pred values
+            dmrses = [r.dmrs() for s in sents for r in s.readings if r.ID is None]
+            nodes = [n for d in dmrses for n in d.layout.nodes]
+            self.lemmaCache.by_values({n.rplemma for n in nodes if n.rplemma}, ctx=ctx)
+            self.gpredCache.by_values({n.gpred for n in nodes if n.gpred}, ctx=ctx)
+            # assign IDs and collect rows
+            rows = {name: [] for name in ('sentence', 'reading', 'dmrs', 'dmrs_node', 'dmrs_node_sortinfo', 'dmrs_link')}
+            next_ids = {name: self.next_id(name, ctx=ctx) for name in rows}
+
+            def add_row(name, obj):
+                obj.ID = next_ids[name]
+                next_ids[name] += 1
+                rows[name].append(obj)
+            for sent in sents:
+                sent.docID = doc.ID
+                add_row('sentence', sent)
+                if sent.ident is None or sent.ident in (-1, '-1', ''):
+                    sent.ident = str(sent.ID)
+                for idx, reading in enumerate(sent.readings):
+                    if reading.ID is not None:
+                        continue
+                    if reading.rid is None:
+                        reading.rid = idx
+                    reading.sentID = sent.ID
+                    add_row('reading', reading)
+                    dmrs = reading.dmrs()
+                    if dmrs.raw is None:
+                        dmrs.raw = dmrs.xml_str(pretty_print=False)
+                    dmrs.readingID = reading.ID
+                    if dmrs.ident is None:
+                        dmrs.ident = reading.rid
+                    add_row('dmrs', dmrs)
+                    for node in dmrs.layout.nodes:
+                        self.prepare_node(dmrs, node, ctx=ctx)
+                        add_row('dmrs_node', node)
+                        node.sortinfo.dmrs_nodeID = node.ID
+                        add_row('dmrs_node_sortinfo', node.sortinfo)
+                    for link in dmrs.layout.links:
+                        link.dmrsID = dmrs.ID
+                        if link.rargname is None:
+                            link.rargname = ''
+                        add_row('dmrs_link', link)
+            for name, objs in rows.items():
+                self.insert_many(name, objs, ctx=ctx)
+            self.index_readings(rows['reading'], ctx=ctx)
+            # human annotations
+            for sent in sents:
+                if sent.shallow is not None:
+                    self.save_annotations(sent, ctx=ctx)
+            ctx.commit()
+        except Exception:
+            ctx.rollback()
+            raise
+        finally:
+            ctx.auto_commit = auto_commit
+            for name, value in pragmas:
+                ctx.execute("PRAGMA {}={}".format(name, value))
+        logger.debug("Imported {} sentences into {}".format(len(sents), doc.name))
+        return doc
+
+    @with_ctx
+    def next_id(self, table_name, ctx=None):
+        """ Next ID of an AUTOINCREMENT table (IDs of deleted rows are never reused).
+        The caller must hold the write lock (BEGIN IMMEDIATE) until rows with these IDs are inserted.
+        """
+        max_id = ctx.select_scalar('SELECT IFNULL(MAX(ID), 0) FROM {}'.format(table_name))
+        seq = ctx.select_single('SELECT seq FROM sqlite_sequence WHERE name=?', (table_name,))
+        return max(max_id, seq[0] if seq else 0) + 1
+
+    @with_ctx
+    def insert_many(self, table_name, objs, ctx=None):
+        """ Insert objects (IDs included) into a table with executemany """
+        if not objs:
+            return
+        table = getattr(self, table_name)
+        field_map = table._field_map
+        columns = table.columns
+        query = "INSERT INTO {t} ({c}) VALUES ({p})".format(t=table.name, c=','.join(columns), p=','.join(['?'] * len(columns)))
+        ctx.cur.executemany(query, (tuple(getattr(obj, field_map.get(c, c)) for c in columns) for obj in objs))
 
     @with_ctx
     def get_reading(self, a_reading, ctx=None):
+        self.get_readings([a_reading], ctx=ctx)
+        return a_reading
+
+    @with_ctx
+    def get_readings(self, readings, ctx=None):
+        """ Load DMRSes (nodes, sortinfo & links) of many readings with a few queries """
+        reading_map = {r.ID: r for r in readings}
         # retrieve all DMRSes
         # right now, only 1 DMRS per reading
-        a_dmrs = ctx.dmrs.select_single('readingID=?', (a_reading.ID,))
-        a_reading._dmrs = a_dmrs
-        a_dmrs.reading = a_reading
-        a_dmrs._layout = DMRSLayout(source=a_dmrs)
-        # retrieve all nodes
-        nodes = ctx.node.select('dmrsID=?', (a_dmrs.ID,))
+        dmrs_map = {}
+        loaded = set()
+        for chunk in chunked(reading_map, BULK_CHUNK_SIZE):
+            for a_dmrs in ctx.dmrs.select(in_clause('readingID', chunk), chunk, orderby='ID'):
+                a_reading = reading_map[a_dmrs.readingID]
+                if a_reading.ID in loaded:
+                    continue  # keep the first DMRS
+                loaded.add(a_reading.ID)
+                a_reading._dmrs = a_dmrs
+                a_dmrs.reading = a_reading
+                a_dmrs._layout = DMRSLayout(source=a_dmrs)
+                dmrs_map[a_dmrs.ID] = a_dmrs
+        dmrsIDs = list(dmrs_map.keys())
+        # retrieve all nodes & sortinfo
+        nodes = []
+        sortinfo_map = {}
+        for chunk in chunked(dmrsIDs, BULK_CHUNK_SIZE):
+            nodes.extend(ctx.node.select(in_clause('dmrsID', chunk), chunk, orderby='ID'))
+            sortinfos = ctx.sortinfo.select('dmrs_nodeID IN (SELECT ID FROM dmrs_node WHERE {})'.format(in_clause('dmrsID', chunk)), chunk, orderby='ID')
+            for sortinfo in sortinfos:
+                sortinfo_map.setdefault(sortinfo.dmrs_nodeID, sortinfo)
+        self.lemmaCache.by_ids({int(n.rplemmaID) for n in nodes if n.rplemmaID is not None}, ctx=ctx)
+        self.gpredCache.by_ids({int(n.gpred_valueID) for n in nodes if n.gpred_valueID}, ctx=ctx)
         for a_node in nodes:
-            # retrieve sortinfo
-            sortinfo = ctx.sortinfo.select_single('dmrs_nodeID=?', (a_node.ID,))
-            if sortinfo is not None:
-                a_node.sortinfo = sortinfo
-            if a_node.rplemmaID is not None:
-                # is a realpred
-                a_node.rplemma = self.lemmaCache.by_id(int(a_node.rplemmaID), ctx=ctx).lemma
-                a_node.pred = Predicate(Predicate.REALPRED, a_node.rplemma, a_node.rppos, a_node.rpsense)
-            if a_node.gpred_valueID:
-                # is a gpred
-                a_node.pred = self.gpredCache.by_id(int(a_node.gpred_valueID), ctx=ctx).value
-                # a_node.pred = Predicate.from_string(a_node.gpred)
-            # create sense object
-            if a_node.synsetid:
-                sense = Sense()
-                sense.synsetid = a_node.synsetid
-                sense.score = a_node.synset_score
-                sense.lemma = a_node.rplemma if a_node.rplemma else ''  # this also?
-                sense.pos = a_node.synsetid[-1]  # Do we really need this?
-                a_node.sense = sense
-                a_dmrs.tag_node(a_node.nodeid, sense.synsetid, sense.lemma, ttl.Tag.DEFAULT, sense.score)
-            a_dmrs.layout.add_node(a_node)
-            # next node ...
+            self.build_node(dmrs_map[a_node.dmrsID], a_node, sortinfo_map.get(a_node.ID), ctx=ctx)
         # retrieve all links
-        links = ctx.link.select('dmrsID=?', (a_dmrs.ID,))
-        for link in links:
-            a_dmrs.layout.add_link(link)
-        return a_reading
+        for chunk in chunked(dmrsIDs, BULK_CHUNK_SIZE):
+            for link in ctx.link.select(in_clause('dmrsID', chunk), chunk, orderby='ID'):
+                dmrs_map[link.dmrsID].layout.add_link(link)
+        return readings
+
+    def build_node(self, a_dmrs, a_node, sortinfo, ctx=None):
+        """ Restore a node from its DB fields and add it to a DMRS """
+        if sortinfo is not None:
+            a_node.sortinfo = sortinfo
+        if a_node.rplemmaID is not None:
+            # is a realpred
+            a_node.rplemma = self.lemmaCache.by_id(int(a_node.rplemmaID), ctx=ctx).lemma
+            a_node.pred = Predicate(Predicate.REALPRED, a_node.rplemma, a_node.rppos, a_node.rpsense)
+        if a_node.gpred_valueID:
+            # is a gpred
+            a_node.pred = self.gpredCache.by_id(int(a_node.gpred_valueID), ctx=ctx).value
+            # a_node.pred = Predicate.from_string(a_node.gpred)
+        # create sense object
+        if a_node.synsetid:
+            sense = Sense()
+            sense.synsetid = a_node.synsetid
+            sense.score = a_node.synset_score
+            sense.lemma = a_node.rplemma if a_node.rplemma else ''  # this also?
+            sense.pos = a_node.synsetid[-1]  # Do we really need this?
+            a_node.sense = sense
+            a_dmrs.tag_node(a_node.nodeid, sense.synsetid, sense.lemma, ttl.Tag.DEFAULT, sense.score)
+        a_dmrs.layout.add_node(a_node)
 
     @with_ctx
     def delete_reading(self, readingID, ctx=None):
+        if self._has_pred_index:
+            ctx.pred_index.delete('readingID=?', (readingID,))
         # delete all DMRS link, node
         ctx.dmrs_link.delete('dmrsID IN (SELECT ID FROM dmrs WHERE readingID=?)', (readingID,))
         ctx.dmrs_node_sortinfo.delete('dmrs_nodeID IN (SELECT ID FROM dmrs_node WHERE dmrsID IN (SELECT ID from dmrs WHERE readingID=?))', (readingID,))
@@ -359,6 +725,8 @@ class CorpusDAOSQLite(RichKopasu):
 
     @with_ctx
     def update_reading(self, reading, ctx=None):
+        if self._has_pred_index:
+            ctx.pred_index.delete('readingID=?', (reading.ID,))
         # delete all DMRS link, node
         ctx.dmrs_link.delete('dmrsID IN (SELECT ID FROM dmrs WHERE readingID=?)', (reading.ID,))
         ctx.dmrs_node_sortinfo.delete('dmrs_nodeID IN (SELECT ID FROM dmrs_node WHERE dmrsID IN (SELECT ID from dmrs WHERE readingID=?))', (reading.ID,))
@@ -370,9 +738,11 @@ class CorpusDAOSQLite(RichKopasu):
         self.save_reading(reading, ctx=ctx)
 
     @with_ctx
-    def build_search_result(self, rows, with_comment=True, ctx=None):
+    def build_search_result(self, rows, with_comment=True, with_readings=False, ctx=None):
         ''' build search result from query results
         Format: sentID, readingID, text, sentence_ident, docID, doc_name, corpus_name, corpusID
+        Only sentID and readingID are required, other fields are fetched from the database when missing.
+        with_readings -- load DMRSes of the found readings
         '''
         if rows:
             logger.debug(("Found: %s presentation(s)" % len(rows)))
@@ -384,30 +754,56 @@ class CorpusDAOSQLite(RichKopasu):
         for row in rows:
             readingID = row['readingID']
             sentID = row['sentID']
-            sentence_ident = row['sentence_ident']
-            text = row['text']
-            docID = row['docID']
             if sentID in sentences_by_id:
                 # sentence exists, add this reading to that sentence
-                a_reading = Reading(ID=readingID)
-                # self.get_reading(a_reading)
-                sentences_by_id[sentID].readings.append(a_reading)
+                a_sentence = sentences_by_id[sentID]
             else:
-                a_sentence = Sentence(ident=sentence_ident, text=text, docID=docID, ID=sentID)
-                a_sentence.corpus = Corpus(name=row['corpus_name'], ID=row['corpusID'])
-                a_sentence.doc = Document(name=row['doc_name'], ID=docID)
-                if readingID:
-                    # add reading if needed
-                    a_reading = Reading(ID=readingID)
-                    a_sentence.readings.append(a_reading)
+                a_sentence = Sentence(ID=sentID)
                 sentences.append(a_sentence)
                 sentences_by_id[sentID] = a_sentence
+            if readingID:
+                # add reading if needed
+                a_reading = Reading(ID=readingID)
+                a_reading.sent = a_sentence
+                a_reading.sentID = sentID
+                a_sentence.readings.append(a_reading)
         logger.debug(("Sentence count: %s" % len(sentences)))
-        if with_comment:
-            for sent in sentences:
-                sent.comment = self.read_note_sentence(sent_id=sent.ID, ctx=ctx)
+        # sentence metadata
+        if all(f in rows[0].keys() for f in SEARCH_RESULT_FIELDS):
+            for row in rows:
+                self._fill_search_result(sentences_by_id[row['sentID']], row)
+            if with_comment:
+                for sentID, comment, flag in self._select_sent_info(list(sentences_by_id.keys()), 's.comment, s.flag', ctx=ctx):
+                    sentences_by_id[sentID].comment = comment
+                    sentences_by_id[sentID].flag = flag
+        else:
+            columns = """s.text, s.ident AS sentence_ident, s.docID, d.name AS doc_name, c.name AS corpus_name,
+                         c.ID AS corpusID, s.comment, s.flag"""
+            for row in self._select_sent_info(list(sentences_by_id.keys()), columns, ctx=ctx):
+                a_sentence = sentences_by_id[row['sentID']]
+                self._fill_search_result(a_sentence, row)
+                a_sentence.flag = row['flag']
+                if with_comment:
+                    a_sentence.comment = row['comment']
+        if with_readings:
+            self.get_readings([r for sent in sentences for r in sent.readings], ctx=ctx)
         return sentences
 
+    def _fill_search_result(self, a_sentence, row):
+        a_sentence.ident = row['sentence_ident']
+        a_sentence.text = row['text']
+        a_sentence.docID = row['docID']
+        a_sentence.corpus = Corpus(name=row['corpus_name'], ID=row['corpusID'])
+        a_sentence.doc = Document(name=row['doc_name'], ID=row['docID'])
+
+    def _select_sent_info(self, sentIDs, columns, ctx):
+        """ Select columns of many sentences (joined with their documents & corpora) """
+        query = """SELECT s.ID AS sentID, {columns}
+                   FROM sentence s LEFT JOIN document d ON d.ID = s.docID LEFT JOIN corpus c ON c.ID = d.corpusID
+                   WHERE {where}"""
+        for chunk in chunked(sentIDs, BULK_CHUNK_SIZE):
+            yield from ctx.execute(query.format(columns=columns, where=in_clause('s.ID', chunk)), chunk).fetchall()
+
     @with_ctx
     def get_sent(self, sentID, mode=None, readingIDs=None, skip_details=False, ctx=None):
         a_sentence = ctx.sentence.by_id(sentID)
@@ -426,9 +822,8 @@ class CorpusDAOSQLite(RichKopasu):
             for r in readings:
                 r.sent = a_sentence
                 a_sentence.readings.append(r)
-            for a_reading in a_sentence.readings:
-                if not skip_details:
-                    self.get_reading(a_reading, ctx=ctx)
+            if not skip_details:
+                self.get_readings(a_sentence.readings, ctx=ctx)
         else:
             logging.debug("No sentence with ID={} was found".format(sentID))
         # Return
@@ -486,24 +881,18 @@ class CorpusDAOSQLite(RichKopasu):
 
     @with_ctx
     def next_sentid(self, sid, flag=None, ctx=None):
-        sent_obj = ctx.sentence.by_id(sid, columns=('ID', 'docID'))
-        docid = sent_obj.docID
-        where = 'ID > ? AND docID == ?'
-        params = [sid, docid]
-        if flag is not None:
-            where += " AND flag = ?"
-            params.append(flag)
-        next_sent = ctx.sentence.select_single(where=where, values=params, orderby="docID, ID", limit=1)
-        return next_sent.ID if next_sent is not None else None
+        return self.get_sent_neighbours(sid, flag=flag, ctx=ctx)[1]
 
     @with_ctx
     def prev_sentid(self, sid, flag=None, ctx=None):
-        sent_obj = ctx.sentence.by_id(sid, columns=('ID', 'docID'))
-        docid = sent_obj.docID
-        where = 'ID < ? AND docID == ?'
-        params = [sid, docid]
-        if flag is not None:
-            where += " AND flag = ?"
-            params.append(flag)
-        prev_sent = ctx.sentence.select_single(where=where, values=params, orderby="docID DESC, ID DESC", limit=1)
-        return prev_sent.ID if prev_sent is not None else None
+        return self.get_sent_neighbours(sid, flag=flag, ctx=ctx)[0]
+
+    @with_ctx
+    def get_sent_neighbours(self, sid, flag=None, ctx=None):
+        """ IDs of the previous and the next sentence in the same document (None if there is none) """
+        flag_filter = ' AND s.flag = :flag' if flag is not None else ''
+        query = """SELECT (SELECT MAX(s.ID) FROM sentence s WHERE s.docID = cur.docID AND s.ID < cur.ID{flag}),
+                          (SELECT MIN(s.ID) FROM sentence s WHERE s.docID = cur.docID AND s.ID > cur.ID{flag})
+                   FROM sentence cur WHERE cur.ID = :sid""".format(flag=flag_filter)
+        row = ctx.select_single(query, {'sid': sid, 'flag': flag})
+        return (row[0], row[1]) if row else (None, None)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+"""
+Per-thread SQLite connection pool for DAO classes
+"""
+
+# This code is a part of coolisf library: https://github.com/letuananh/intsem.fx
+# :copyright: (c) 2014 Le Tuan Anh <tuananh.ke@gmail.com>
+# :license: MIT, see LICENSE for more details.
+
+import os
+import sqlite3
+import logging
+import threading
+
+from texttaglib.puchikarui.puchikarui import ExecutionContext
+
+
+# ----------------------------------------------------------------------
+# Configuration
+# ----------------------------------------------------------------------
+
+BUSY_TIMEOUT = 30  # seconds to wait for a lock held by another connection
+STATEMENT_CACHE = 256  # number of prepared statements kept by each connection
+
+
+def getLogger():
+    return logging.getLogger(__name__)
+
+
+# ----------------------------------------------------------------------
+
+class ConnectionPool(object):
+    """ SQLite connections to a database file, one per thread.
+    A connection is reused by all schemas (of the same database) in its thread until close() is called.
+    """
+
+    __pools = {}
+    __pools_lock = threading.Lock()
+
+    def __init__(self, path, timeout=BUSY_TIMEOUT, wal=True, cached_statements=STATEMENT_CACHE):
+        self.path = path
+        self.timeout = timeout
+        self.wal = wal
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+
+    @staticmethod
+    def get(path, **kwargs):
+        """ Get the shared pool of a database file (kwargs are only used when the pool is created) """
+        key = os.path.abspath(path)
+        with ConnectionPool.__pools_lock:
+            if key not in ConnectionPool.__pools:
+                ConnectionPool.__pools[key] = ConnectionPool(key, **kwargs)
+            return ConnectionPool.__pools[key]
+
+    def connect(self):
+        """ The connection of the current thread """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            getLogger().debug("Opening {} for thread {}".format(self.path, threading.current_thread().name))
+            conn = sqlite3.connect(self.path, timeout=self.timeout, cached_statements=self.cached_statements)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA busy_timeout = {}".format(int(self.timeout * 1000)))
+            if self.wal:
+                conn.execute("PRAGMA journal_mode = WAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """ Close the connection of the current thread (a new one will be opened on demand).
+        SQLite connections can only be closed by their own thread, connections of other threads
+        are closed when their threads end.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            conn.close()
+
+
+class PooledContext(ExecutionContext):
+    """ An execution context on a pooled connection.
+    Closing it commits pending changes (when auto_commit is on) but keeps the connection open.
+    """
+
+    def __init__(self, conn, schema, auto_commit=True):
+        self.conn = conn
+        self.cur = conn.cursor()
+        self.schema = schema
+        self.auto_commit = auto_commit
+
+    def close(self):
+        if self.conn is not None and self.auto_commit:
+            self.commit()
+
+    def __exit__(self, type, value, traceback):
+        if type is not None:
+            # don't leave a failed transaction on a shared connection
+            if self.conn is not None and self.conn.in_transaction:
+                self.rollback()
+            self.auto_commit = self.schema.auto_commit
+        super().__exit__(type, value, traceback)
+
+
+class PooledSchema(object):
+    """ Mixin for puchikarui Schema classes.
+    After use_pool() is called, ctx() (and therefore @with_ctx methods) reuses
+    one connection per thread instead of opening a new one for every call.
+    """
+
+    _pool = None
+    _pool_local = None
+
+    def use_pool(self, **kwargs):
+        """ Switch to pooled connections (kwargs: see ConnectionPool) """
+        path = self.ds.path
+        if not path or str(path) == ':memory:':
+            raise ValueError("In-memory databases cannot be pooled")
+        # create the database if needed
+        with self.ds.open(schema=self):
+            pass
+        self._pool_local = threading.local()
+        self._pool = ConnectionPool.get(path, **kwargs)
+        return self
+
+    @property
+    def pooled(self):
+        return self._pool is not None
+
+    def ctx(self):
+        if self._pool is None:
+            return super().ctx()
+        conn = self._pool.connect()
+        ctx = getattr(self._pool_local, 'ctx', None)
+        if ctx is None or ctx.conn is not conn:
+            ctx = PooledContext(conn, schema=self, auto_commit=self.auto_commit)
+            self._pool_local.ctx = ctx
+        return ctx
+
+    def close_pool(self):
+        """ Close the pooled connection of the current thread """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool_local.ctx = None
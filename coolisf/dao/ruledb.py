@@ -216,6 +216,17 @@ AND ID NOT IN (SELECT ruleid FROM rulepred WHERE {excl})
         getLogger().debug("where -> {}".format(where))
         return ctx.ruleinfo.select(where, params, columns=('ID', 'lid', 'rid'), limit=limit)
 
+    @with_ctx
+    def get_rulepreds(self, restricted=True, ctx=None):
+        """ Get (ID, lid, rid, head, pred, carg) rows of all rules (same restriction as find_ruleinfo) """
+        query = """SELECT ruleinfo.ID, ruleinfo.lid, ruleinfo.rid, ruleinfo.head, predinfo.pred, rulepred.carg
+FROM ruleinfo JOIN rulepred ON rulepred.ruleid = ruleinfo.ID
+     LEFT JOIN predinfo ON predinfo.ID = rulepred.predid
+{res}
+ORDER BY ruleinfo.ID"""
+        restricted = 'WHERE ruleinfo.flag = 2 AND lid IN (SELECT lid FROM lexunit WHERE flag > 3)' if restricted else ''
+        return ctx.select(query.format(res=restricted))
+
 
 def parse_lexunit(lu, ERG):
     getLogger().debug("parse_lexunit() lu -> {}".format(lu))
@@ -1,6 +1,7 @@
 /* Init ACE cache DB */
 CREATE TABLE sent (
        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+       key TEXT NOT NULL, -- content hash of text, grm, pc and extra_args
        text TEXT NOT NULL,
        grm TEXT NOT NULL,
        pc INTEGER,
@@ -13,8 +14,5 @@ CREATE TABLE mrs (
        mrs TEXT
 );
 
-CREATE INDEX sent_text ON sent(text);
-CREATE INDEX sent_grm ON sent(grm);
-CREATE INDEX sent_pc ON sent(pc);
-CREATE INDEX sent_extra_args ON sent(extra_args);
+CREATE UNIQUE INDEX sent_key ON sent(key);
 CREATE INDEX mrs_sid ON mrs(sid);
@@ -173,9 +173,26 @@ CREATE TABLE IF NOT EXISTS "cwl" (
     ,FOREIGN KEY(wid) REFERENCES word(ID) ON DELETE CASCADE ON UPDATE CASCADE
 );
 
+--
+-- SEARCH INDEX (one row per DMRS node)
+--
+CREATE TABLE IF NOT EXISTS "pred_index" (
+    "ID" INTEGER PRIMARY KEY AUTOINCREMENT
+    ,"sentID" INTEGER NOT NULL
+    ,"readingID" INTEGER NOT NULL
+    ,"nodeid" INTEGER
+    ,"pred" TEXT
+    ,"lemma" TEXT
+    ,"carg" TEXT
+    ,"synsetid" TEXT
+    ,FOREIGN KEY(sentID) REFERENCES sentence(ID) ON DELETE CASCADE ON UPDATE CASCADE
+    ,FOREIGN KEY(readingID) REFERENCES reading(ID) ON DELETE CASCADE ON UPDATE CASCADE
+);
+
 
 
 CREATE INDEX IF NOT EXISTS "sentence_|_docID" ON "sentence" ("docID" ASC);
+CREATE INDEX IF NOT EXISTS "sentence_|_docID_flag_ID" ON "sentence" ("docID", "flag", "ID");
 CREATE INDEX IF NOT EXISTS "sentence_|_ident" ON "sentence" ("ident" ASC);
 CREATE INDEX IF NOT EXISTS "document_|_grammar" ON "document" ("grammar");
 CREATE INDEX IF NOT EXISTS "document_|_lang" ON "document" ("lang");
@@ -220,3 +237,10 @@ CREATE INDEX IF NOT EXISTS "dmrs_link_|_dmrsID" ON "dmrs_link" ("dmrsID" ASC);
 
 CREATE INDEX IF NOT EXISTS "dmrs_link_|_post" ON "dmrs_link"("post");
 CREATE INDEX IF NOT EXISTS "dmrs_link_|_rargname" ON "dmrs_link"("rargname");
+
+-- PRED_INDEX INDICES
+CREATE INDEX IF NOT EXISTS "pred_index_|_pred_synsetid" ON "pred_index"("pred", "synsetid");
+CREATE INDEX IF NOT EXISTS "pred_index_|_lemma" ON "pred_index"("lemma");
+CREATE INDEX IF NOT EXISTS "pred_index_|_carg" ON "pred_index"("carg");
+CREATE INDEX IF NOT EXISTS "pred_index_|_synsetid" ON "pred_index"("synsetid");
+CREATE INDEX IF NOT EXISTS "pred_index_|_readingID" ON "pred_index"("readingID");
@@ -1,6 +1,7 @@
 /* Init parse cache DB */
 CREATE TABLE sent (
        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+       key TEXT NOT NULL, -- content hash of raw, grm, pc and tagger
        raw TEXT NOT NULL,
        grm TEXT NOT NULL,
        pc INTEGER,
@@ -8,7 +9,9 @@ CREATE TABLE sent (
        text TEXT NOT NULL,       
        xml TEXT,
        latex TEXT,
-       shallow TEXT
+       shallow TEXT,
+       last_access REAL,
+       size INTEGER -- bytes of stored renderings
 );
 
 CREATE TABLE parse (
@@ -16,15 +19,24 @@ CREATE TABLE parse (
        sid INTEGER REFERENCES sent(ID) ON UPDATE CASCADE,
        pid TEXT,
        ident TEXT,
-       jmrs TEXT,
+       jmrs TEXT, -- renderings below are only filled by older versions, see rendering
        jdmrs TEXT,
        mrs TEXT,
        dmrs TEXT
 );
 
-CREATE INDEX sent_text ON sent(text);
-CREATE INDEX sent_grm ON sent(grm);
+/* Renderings derived from sent.xml on demand */
+CREATE TABLE rendering (
+       ID INTEGER PRIMARY KEY AUTOINCREMENT,
+       sid INTEGER REFERENCES sent(ID) ON UPDATE CASCADE,
+       format TEXT NOT NULL,
+       data TEXT
+);
+
+CREATE UNIQUE INDEX sent_key ON sent(key);
+CREATE INDEX sent_last_access ON sent(last_access);
 CREATE INDEX parse_ID ON parse(ID);
 CREATE INDEX parse_sid ON parse(sid);
 CREATE INDEX parse_pid ON parse(pid);
 CREATE INDEX parse_ident ON parse(ident);
+CREATE UNIQUE INDEX rendering_sid_format ON rendering(sid, format);
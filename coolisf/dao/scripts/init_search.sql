@@ -0,0 +1,17 @@
+/**
+ * Full-text index of sentence texts (requires SQLite with FTS5)
+ **/
+CREATE VIRTUAL TABLE IF NOT EXISTS "sentence_fts" USING fts5(text, content='sentence', content_rowid='ID');
+
+CREATE TRIGGER IF NOT EXISTS "sentence_fts_|_insert" AFTER INSERT ON "sentence" BEGIN
+    INSERT INTO sentence_fts(rowid, text) VALUES (new.ID, new.text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS "sentence_fts_|_delete" AFTER DELETE ON "sentence" BEGIN
+    INSERT INTO sentence_fts(sentence_fts, rowid, text) VALUES ('delete', old.ID, old.text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS "sentence_fts_|_update" AFTER UPDATE OF text ON "sentence" BEGIN
+    INSERT INTO sentence_fts(sentence_fts, rowid, text) VALUES ('delete', old.ID, old.text);
+    INSERT INTO sentence_fts(rowid, text) VALUES (new.ID, new.text);
+END;
@@ -11,15 +11,25 @@ Grammar helpers
 # :copyright: (c) 2014 Le Tuan Anh <tuananh.ke@gmail.com>
 # :license: MIT, see LICENSE for more details.
 
+import os
 import logging
+import asyncio
+import threading
+import functools
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import Future
 from delphin.interfaces import ace
 
 from texttaglib.chirptext import FileHelper
 
 from coolisf.config import read_config
+from coolisf.common import LRUCache, chunked
+from coolisf.acepool import AceParserPool, AsyncAceParserPool, ASYNC_POOL_SIZE
 from coolisf.dao.cache import AceCache, ISFCache
 from coolisf.util import sent2json
 from coolisf.model import Sentence
+from coolisf.mappings import PredSense
 from coolisf.processors.base import ProcessorManager
 
 
@@ -27,6 +37,9 @@ from coolisf.processors.base import ProcessorManager
 # Configuration
 # ----------------------------------------------------------------------
 
+CHUNK_SIZE = 1000  # number of texts looked up from (and written back to) the ACE cache at once
+
+
 def getLogger():
     return logging.getLogger(__name__)
 
@@ -38,12 +51,17 @@ class GrammarHub:
     def __init__(self):
         self.read_config()
         self.grammars = {}
+        self.db_pool = self.cfg.get('db_pool', None)  # true or ConnectionPool arguments, e.g. {"timeout": 30, "wal": true}
         if self.cache_path:
-            self.cache = ISFCache(self.cache_path)
+            self.cache = ISFCache(self.cache_path, compress=self.cfg.get('cache_compress', False), max_size=self.cfg.get('cache_max_size', None))
+            self.use_db_pool(self.cache)
         else:
             self.cache = None
+        self.setup_memcache()
         self.preps = ProcessorManager.from_json(self.cfg["preprocessors"])
         self.posts = ProcessorManager.from_json(self.cfg["postprocessors"])
+        self._loop = None
+        self._loop_lock = threading.Lock()
 
     def read_config(self):
         self.cfg = read_config()
@@ -56,6 +74,55 @@ class GrammarHub:
         getLogger().info("ISF Cache DB: {o} => {c}".format(o=self.cfg['cache'], c=self.cache_path))
         return self.cfg
 
+    def setup_memcache(self):
+        """ Put in-memory LRU caches in front of the ISF cache (global and per grammar "memcache" settings)
+        and size the WordNet search cache ("predsense_cache" setting) """
+        if self.cache is not None:
+            if 'memcache' in self.cfg:
+                self.cache.set_memcache(LRUCache.from_config(self.cfg['memcache']))
+            for grm, ginfo in self.cfg['grammars'].items():
+                if 'memcache' in ginfo:
+                    self.cache.set_memcache(LRUCache.from_config(ginfo['memcache']), grm)
+        if 'predsense_cache' in self.cfg:
+            PredSense.set_search_cache(LRUCache.from_config(self.cfg['predsense_cache']))
+
+    def use_db_pool(self, db):
+        """ Make a cache DB reuse one connection per thread when "db_pool" is configured """
+        if self.db_pool and db is not None:
+            db.use_pool(**(self.db_pool if isinstance(self.db_pool, dict) else {}))
+        return db
+
+    def compact_caches(self):
+        """ Evict and VACUUM the ISF cache and VACUUM all ACE caches.
+        Return a list of (path, size before, size after)
+        """
+        reports = []
+        if self.cache:
+            reports.append((self.cache_path,) + self.cache.compact())
+        ace_caches = set()
+        for grm, ginfo in self.cfg['grammars'].items():
+            if 'acecache' in ginfo:
+                ace_caches.add(self.to_path(ginfo['acecache']))
+            elif 'acecache' in self.cfg:
+                ace_caches.add(self.to_path(self.cfg['acecache']))
+        for path in sorted(ace_caches):
+            if os.path.isfile(path):
+                reports.append((path,) + AceCache(path).compact())
+        return reports
+
+    def memcache_stats(self):
+        """ Hit/miss/eviction counters of all in-memory caches """
+        stats = {'isf': {}, 'ace': {}, 'predsense': PredSense.cache_info()}
+        if self.cache:
+            for grm, memcache in self.cache.memcaches.items():
+                stats['isf'][grm if grm else '*'] = memcache.stats()
+        for grm, grammar in self.grammars.items():
+            if grammar.cache:
+                memcache = grammar.cache.get_memcache(grm)
+                if memcache is not None:
+                    stats['ace'][grm] = memcache.stats()
+        return stats
+
     def to_path(self, path):
         return FileHelper.abspath(path.format(data_root=self.cfg['data_root']))
 
@@ -86,13 +153,43 @@ class GrammarHub:
                 cache_loc = self.to_path(self.cfg['acecache'])
             else:
                 cache_loc = None
+            pool_size = ginfo['pool'] if 'pool' in ginfo else self.cfg.get('pool', None)
+            memcache_cfg = ginfo['memcache'] if 'memcache' in ginfo else self.cfg.get('memcache', None)
+            memcache = LRUCache.from_config(memcache_cfg) if memcache_cfg else None
             preps = self.lookup_preps(ginfo)
             posts = self.lookup_posts(ginfo)
             grm_path = self.to_path(ginfo['path'])
-            self.grammars[grm] = Grammar(grm, grm_path, ginfo['args'], ace_bin, cache_loc, preps=preps, posts=posts)
+            self.grammars[grm] = Grammar(grm, grm_path, ginfo['args'], ace_bin, cache_loc, preps=preps, posts=posts, pool_size=pool_size, memcache=memcache)
+            self.use_db_pool(self.grammars[grm].cache)
         # done creating grammar
         return self.grammars[grm]
 
+    @property
+    def loop(self):
+        """ A background event loop which serves synchronous callers of the async API """
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="ghub-asyncio", daemon=True).start()
+            return self._loop
+
+    def run(self, coro):
+        """ Run a coroutine (e.g. aparse_json()) on the hub's event loop and wait for its result.
+        Concurrent callers from different threads share the same async ACE workers.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def close(self):
+        """ Stop all long-lived ACE workers and close pooled DB connections of the current thread """
+        for grammar in self.grammars.values():
+            grammar.close()
+            if self._loop is not None:
+                self.run(grammar.aclose())
+            if grammar.cache is not None:
+                grammar.cache.close_pool()
+        if self.cache is not None:
+            self.cache.close_pool()
+
     def lookup_preps(self, gcfg):
         if 'preps' not in gcfg:
             return None
@@ -105,23 +202,56 @@ class GrammarHub:
         else:
             return [self.posts[pname] for pname in gcfg['posts']]
 
-    def parse_json(self, txt, grm, pc=None, tagger=None, ignore_cache=False):
+    def parse_json(self, txt, grm, pc=None, tagger=None, ignore_cache=False, formats=None):
+        """ Parse a sentence and return a JSON-ready dict
+        formats: renderings to include (see coolisf.util.JSON_FORMATS), all of them by default
+        """
         # validation
         if not txt:
             raise ValueError('Sentence cannot be empty')
         # look up from cache first
         if not ignore_cache and self.cache:
-            s = self.cache.load(txt, grm, pc, tagger)
+            s = self.cache.load(txt, grm, pc, tagger, formats=formats)
             if s is not None:
                 getLogger().debug("Retrieved {} parse(s) from cache for sent: {}".format(len(s['parses']), s['sent']))
                 return s
         # else parse it ...
         sent = self.parse(txt, grm, pc, tagger, ignore_cache)
+        # make it JSON
+        sent_json = sent2json(sent, txt, pc, tagger, grm, formats=formats)
         # cache sent if possible
         if self.cache and not ignore_cache:
-            self.cache.save(txt, grm, pc, tagger, sent)
-        # make it JSON
-        return sent2json(sent, txt, pc, tagger, grm)
+            self.cache.save(txt, grm, pc, tagger, sent, renderings=sent_json)
+        return sent_json
+
+    async def aparse_json(self, txt, grm, pc=None, tagger=None, ignore_cache=False, formats=None):
+        """ Non-blocking version of parse_json() """
+        if not txt:
+            raise ValueError('Sentence cannot be empty')
+        loop = asyncio.get_event_loop()
+        if not ignore_cache and self.cache:
+            s = await loop.run_in_executor(None, functools.partial(self.cache.load, txt, grm, pc, tagger, formats=formats))
+            if s is not None:
+                getLogger().debug("Retrieved {} parse(s) from cache for sent: {}".format(len(s['parses']), s['sent']))
+                return s
+        sent = await self.aparse(txt, grm, pc, tagger, ignore_cache)
+        sent_json = await loop.run_in_executor(None, functools.partial(sent2json, sent, txt, pc, tagger, grm, formats=formats))
+        if self.cache and not ignore_cache:
+            await loop.run_in_executor(None, functools.partial(self.cache.save, txt, grm, pc, tagger, sent, renderings=sent_json))
+        return sent_json
+
+    async def aparse(self, txt, grm, pc=None, tagger=None, ignore_cache=False, wsd=None):
+        """ Non-blocking version of parse().
+        ACE is driven through asyncio pipes, sense-tagging runs in the default executor
+        """
+        if not txt:
+            raise ValueError('Sentence cannot be empty')
+        getLogger().debug("Parsing sentence: {}".format(txt))
+        sent = await self[grm].aparse(txt, parse_count=pc, ignore_cache=ignore_cache)
+        if tagger:
+            getLogger().debug("Sense-tagging sentence using {}".format(tagger))
+            await asyncio.get_event_loop().run_in_executor(None, functools.partial(sent.tag_xml, method=tagger, wsd=wsd))
+        return sent
 
     def parse(self, txt, grm, pc=None, tagger=None, ignore_cache=False, wsd=None, ctx=None):
         """ Parse a sentence using ISF """
@@ -138,7 +268,7 @@ class GrammarHub:
 
 
 class Grammar:
-    def __init__(self, name, gram_file, cmdargs, ace_bin, cache_loc, preps=None, posts=None):
+    def __init__(self, name, gram_file, cmdargs, ace_bin, cache_loc, preps=None, posts=None, pool_size=None, memcache=None):
         self.name = name
         self.gram_file = FileHelper.abspath(gram_file)
         self.cmdargs = cmdargs
@@ -148,11 +278,17 @@ class Grammar:
         if cache_loc:
             self.cache_loc = FileHelper.abspath(cache_loc)
             self.cache = AceCache(self.cache_loc)
+            if memcache is not None:
+                self.cache.set_memcache(memcache, self.name)
             getLogger().debug("Caching enabled for grammar [{g}] at [{l}]".format(g=self.name, l=self.cache_loc))
         else:
             self.cache = None
         self.preps = preps  # pre-processors
         self.posts = posts  # post-processors
+        self.pool_size = pool_size  # number of long-lived ACE workers, None means no pool
+        self.pools = {}
+        self.pool_lock = threading.Lock()
+        self.apools = {}  # asyncio pools, keyed by event loop and cmdargs
 
     def generate(self, parse_obj):
         """ Generate text from coolisf.model.Parse object """
@@ -170,57 +306,195 @@ class Grammar:
                     sents.append(sent)
             return sents
 
-    def parse_many_iterative(self, texts, parse_count=None, extra_args=None, ignore_cache=None):
+    def build_args(self, parse_count=None, extra_args=None):
         args = self.cmdargs.copy()
         if parse_count:
             args += ['-n', str(parse_count)]
         if extra_args:
             args += extra_args
-        with ace.AceParser(self.gram_file, executable=self.ace_bin, cmdargs=args) as parser, self.cache.ctx() as ctx:
-            getLogger().debug("Executing ACE with cmdargs: {}".format(args))
-            for text in texts:
-                exargs_str = ' '.join(extra_args) if extra_args else None
-                if not ignore_cache and self.cache:
+        return args
+
+    def get_pool(self, args, pool_size=None):
+        """ Get (or start) an ACE worker pool for a set of command-line arguments """
+        if not pool_size:
+            pool_size = self.pool_size
+        key = (tuple(args), pool_size)
+        with self.pool_lock:
+            if key not in self.pools:
+                getLogger().debug("Creating ACE pool for grammar [{g}] | Size: {s} | cmdargs: {a}".format(g=self.name, s=pool_size, a=args))
+                self.pools[key] = AceParserPool(self.gram_file, cmdargs=args, executable=self.ace_bin, size=pool_size)
+            return self.pools[key]
+
+    def get_apool(self, args):
+        """ Get (or create) an asyncio ACE worker pool for the running event loop """
+        key = (id(asyncio.get_event_loop()), tuple(args))
+        if key not in self.apools:
+            self.apools[key] = AsyncAceParserPool(self.gram_file, cmdargs=args, executable=self.ace_bin, size=self.pool_size or ASYNC_POOL_SIZE)
+        return self.apools[key]
+
+    def close(self):
+        """ Stop all long-lived ACE workers of this grammar """
+        with self.pool_lock:
+            pools, self.pools = list(self.pools.values()), {}
+        for pool in pools:
+            pool.close()
+
+    async def aclose(self):
+        """ Stop asyncio ACE workers which belong to the running event loop """
+        loop_id = id(asyncio.get_event_loop())
+        for key in [k for k in self.apools if k[0] == loop_id]:
+            await self.apools.pop(key).close()
+
+    def _prepare(self, text):
+        s = Sentence(text)
+        if self.preps:
+            for prep in self.preps:
+                prep.process(s)
+        return s
+
+    def _finish(self, s, result, parse_count, exargs_str, ignore_cache, ctx, to_save=None):
+        getLogger().debug("reading ACE output")
+        # postprocessors
+        if result and 'RESULTS' in result:
+            top_res = result['RESULTS']
+            for mrs in top_res:
+                parse = s.add(mrs['MRS'])
+                if self.posts:
+                    for p in self.posts:
+                        p.process(parse)
+        # cache it
+        if not ignore_cache and self.cache:
+            if to_save is not None:
+                # written back in bulk, keep a snapshot before the sentence is handed out
+                to_save.append((s.text, [p.mrs() for p in s]))
+            else:
+                getLogger().debug("Caching result")
+                self.cache.save(s, self.name, parse_count, exargs_str, ctx=ctx)
+
+    def parse_many_iterative(self, texts, parse_count=None, extra_args=None, ignore_cache=None, pool_size=None, chunk_size=CHUNK_SIZE):
+        """ Parse texts and yield Sentence objects in input order.
+        When pool_size (or the grammar's pool_size) is greater than 1, sentences are spread
+        across long-lived ACE workers which are kept alive for the next call.
+        Cache lookups are done chunk_size texts at a time and new results are written back in bulk.
+        """
+        args = self.build_args(parse_count, extra_args)
+        exargs_str = ' '.join(extra_args) if extra_args else None
+        use_cache = not ignore_cache and self.cache
+        if pool_size is None:
+            pool_size = self.pool_size
+        with ExitStack() as stack:
+            ctx = stack.enter_context(self.cache.ctx()) if self.cache else None
+            if pool_size and pool_size > 1:
+                submit = self.get_pool(args, pool_size).submit
+                window = pool_size * 2  # keep all workers busy while yielding in order
+            else:
+                parsers = []
+
+                def submit(text):
+                    # only start ACE when something is not in the cache
+                    if not parsers:
+                        getLogger().debug("Executing ACE with cmdargs: {}".format(args))
+                        parsers.append(stack.enter_context(ace.AceParser(self.gram_file, executable=self.ace_bin, cmdargs=args)))
+                    return _interact_now(parsers[0], text)
+                window = 0
+            pending = deque()
+            to_save = []
+            try:
+                for chunk in chunked(texts, chunk_size):
                     # try to fetch from cache first
-                    s = self.cache.load(text, self.name, parse_count, exargs_str, ctx=ctx)
-                    if s is not None:
-                        getLogger().debug("Retrieved {pc} parses from cache for sent: {s}".format(s=text, pc=len(s)))
-                        yield s
-                        continue
-                # not in cache then ...
-                s = Sentence(text)
-                try:
-                    # preprocessors
-                    if self.preps:
-                        for prep in self.preps:
-                            prep.process(s)
-                    # interact with grammar
-                    getLogger().debug("interacting with ACE")
-                    result = parser.interact(s.text)
-                    getLogger().debug("reading ACE output")
-                    # postprocessors
-                    if result and 'RESULTS' in result:
-                        top_res = result['RESULTS']
-                        for mrs in top_res:
-                            parse = s.add(mrs['MRS'])
-                            if self.posts:
-                                for p in self.posts:
-                                    p.process(parse)
-                    # cache it
-                    if not ignore_cache and self.cache:
-                        getLogger().debug("Caching result")
-                        self.cache.save(s, self.name, parse_count, exargs_str, ctx=ctx)
-                except Exception as e:
-                    s.flag = Sentence.ERROR
-                    s.comment = "This sentence is not fully processed"
-                    getLogger().exception("Error happened while processing sentence: {}".format(text))
-                yield s
-
-    def parse_many(self, texts, parse_count=None, extra_args=None, ignore_cache=False):
+                    cached = self.cache.load_many(chunk, self.name, parse_count, exargs_str, ctx=ctx) if use_cache else {}
+                    handed_out = set()
+                    for text in chunk:
+                        s = cached.get(text)
+                        if s is not None:
+                            if text in handed_out:
+                                # repeated in this chunk, don't yield the same object twice
+                                s = _copy_sentence(s)
+                            handed_out.add(text)
+                            getLogger().debug("Retrieved {pc} parses from cache for sent: {s}".format(s=text, pc=len(s)))
+                            pending.append((s, None))
+                        else:
+                            # not in cache then ...
+                            s = Sentence(text)
+                            try:
+                                s = self._prepare(text)
+                                # interact with grammar
+                                getLogger().debug("interacting with ACE")
+                                pending.append((s, submit(s.text)))
+                            except Exception:
+                                self._flag_error(s)
+                                pending.append((s, None))
+                        while len(pending) > window:
+                            yield self._collect(pending.popleft(), parse_count, exargs_str, ignore_cache, ctx, to_save)
+                    if len(to_save) >= chunk_size:
+                        self._flush(to_save, parse_count, exargs_str, ctx)
+                while pending:
+                    yield self._collect(pending.popleft(), parse_count, exargs_str, ignore_cache, ctx, to_save)
+            finally:
+                if to_save:
+                    self._flush(to_save, parse_count, exargs_str, ctx)
+
+    def _flush(self, to_save, parse_count, exargs_str, ctx):
+        getLogger().debug("Caching {} results".format(len(to_save)))
+        self.cache.save_many(to_save, self.name, parse_count, exargs_str, ctx=ctx)
+        to_save.clear()
+
+    def _collect(self, item, parse_count, exargs_str, ignore_cache, ctx, to_save=None):
+        s, future = item
+        if future is not None:
+            try:
+                self._finish(s, future.result(), parse_count, exargs_str, ignore_cache, ctx, to_save)
+            except Exception:
+                self._flag_error(s)
+        return s
+
+    def _flag_error(self, s):
+        s.flag = Sentence.ERROR
+        s.comment = "This sentence is not fully processed"
+        getLogger().exception("Error happened while processing sentence: {}".format(s.text))
+
+    def parse_many(self, texts, parse_count=None, extra_args=None, ignore_cache=False, pool_size=None):
         sents = []
-        for sent in self.parse_many_iterative(texts, parse_count, extra_args, ignore_cache):
+        for sent in self.parse_many_iterative(texts, parse_count, extra_args, ignore_cache, pool_size=pool_size):
             sents.append(sent)
         return sents
 
     def parse(self, text, parse_count=None, extra_args=None, ignore_cache=False):
         return self.parse_many((text,), parse_count, extra_args, ignore_cache)[0]
+
+    async def aparse(self, text, parse_count=None, extra_args=None, ignore_cache=False):
+        """ Parse a sentence without blocking the event loop """
+        args = self.build_args(parse_count, extra_args)
+        exargs_str = ' '.join(extra_args) if extra_args else None
+        loop = asyncio.get_event_loop()
+        if not ignore_cache and self.cache:
+            s = await loop.run_in_executor(None, self.cache.load, text, self.name, parse_count, exargs_str)
+            if s is not None:
+                getLogger().debug("Retrieved {pc} parses from cache for sent: {s}".format(s=text, pc=len(s)))
+                return s
+        s = Sentence(text)
+        try:
+            s = await loop.run_in_executor(None, self._prepare, text)
+            result = await self.get_apool(args).interact(s.text)
+            await loop.run_in_executor(None, self._finish, s, result, parse_count, exargs_str, ignore_cache, None)
+        except Exception:
+            self._flag_error(s)
+        return s
+
+
+def _copy_sentence(s):
+    """ A new Sentence with the same parses (parsed pydelphin objects are shared) """
+    copy = Sentence(s.text)
+    for parse in s:
+        copy.add(parse.mrs().raw).mrs()._obj = parse.mrs().obj()
+    return copy
+
+
+def _interact_now(parser, text):
+    """ Run a blocking ACE interaction and wrap its outcome in a completed Future """
+    future = Future()
+    try:
+        future.set_result(parser.interact(text))
+    except Exception as e:
+        future.set_exception(e)
+    return future
@@ -18,14 +18,12 @@ from lxml import etree
 from texttaglib.chirptext.leutile import FileHelper
 from texttaglib.chirptext import texttaglib as ttl
 from texttaglib.chirptext import chio
-from lelesk import LeLeskWSD
-from lelesk import LeskCache  # WSDResources
 
 from coolisf.data import read_ccby30
 from coolisf.dao import read_tsdb
 from coolisf.model import Sentence
 from coolisf.lexsem import tag_gold, Lexsem
-from coolisf.mappings import PredSense
+from coolisf.wsd import WSDResources
 from coolisf.common import write_file
 from coolisf.config import read_config
 
@@ -81,8 +79,10 @@ def tag_doc(isf_doc, ttl_doc, use_ttl_sid=True, wsd_method=None, wsd=None, taggo
     if isf_doc is None:
         raise Exception("isf_doc and ttl_doc could not be matched")
     not_matched = set()
-    wsd = LeLeskWSD(dbcache=LeskCache())
-    ctx = PredSense.wn.ctx()
+    if wsd is None:
+        wsd = WSDResources.get().wsd
+    if ctx is None:
+        ctx = WSDResources.get().ctx
     to_remove = set()
     for sent in isf_doc:
         if use_ttl_sid and sent.shallow and sent.shallow.ID:
@@ -19,13 +19,11 @@ from texttaglib.chirptext.cli import CLIApp, setup_logging
 from texttaglib.chirptext import header, confirm, TextReport, FileHelper, Counter, Timer
 from texttaglib.chirptext.leutile import is_number
 from texttaglib.chirptext import texttaglib as ttl
-from lelesk import LeLeskWSD
-from lelesk import LeskCache  # WSDResources
 
 from coolisf import __version__
 from coolisf.lexsem import Lexsem
 from coolisf.config import read_config, _get_config_manager
-from coolisf.common import write_file
+from coolisf.common import chunked
 from coolisf.morph import Transformer
 from coolisf.ghub import GrammarHub
 from coolisf.util import read_ace_output
@@ -34,9 +32,12 @@ from coolisf.gold_extract import read_tsdb_ttl, tag_doc
 from coolisf.gold_extract import generate_gold_profile
 from coolisf.gold_extract import export_to_visko
 from coolisf.gold_extract import read_gold_sents
-from coolisf.model import Document
+from coolisf.model import Document, DocumentWriter, iter_sentences, prefetch_senses
 from coolisf.dao.textcorpus import RawCollection
 from coolisf.mappings import PredSense
+from coolisf.wsd import WSDResources
+from coolisf.wsdpool import WSDPool
+from coolisf.checkpoint import Checkpoint, CHECKPOINT_FILE, CHECKPOINT_SUFFIX, recover_document
 
 
 OUTPUT_DMRS = 'dmrs'
@@ -44,6 +45,7 @@ OUTPUT_MRS = 'mrs'
 OUTPUT_XML = 'xml'
 OUTPUT_FORMATS = [OUTPUT_DMRS, OUTPUT_MRS, OUTPUT_XML]
 WSD_CHOICES = [ttl.Tag.LELESK, ttl.Tag.MFS]
+PREFETCH_SIZE = 100  # number of sentences to fetch WordNet senses for at once
 setup_logging('logging.json', 'logs')
 
 
@@ -88,29 +90,60 @@ def parse_isf(cli, args):
     # verification
     if not os.path.isfile(args.infile):
         print("Error. File does not exist. (provided: {})".format(args.infile))
-    if args.output and os.path.exists(args.output):
+    if args.resume and not args.output:
+        print("An output file is required to resume parsing")
+        return
+    if args.output and os.path.exists(args.output) and not args.resume:
         if not confirm("Output file exists. Do you want to continue (Y/N)? "):
             print("Program aborted.")
             return
     # process
     header("Processing file: {}".format(args.infile))
-    report = TextReport(args.output)
+    checkpoint = Checkpoint(args.output + CHECKPOINT_SUFFIX, resume=args.resume) if args.output else None
+    key = os.path.abspath(args.infile)
+    if checkpoint is not None and checkpoint.is_done(key):
+        print("All sentences have been processed (checkpoint: {})".format(checkpoint.path))
+        return
     ghub = GrammarHub()
     lines = FileHelper.read(args.infile).splitlines()
-    wsd = LeLeskWSD(dbcache=LeskCache())
-    ctx = PredSense.wn.ctx()
+    wsd = WSDResources.get().wsd
+    ctx = WSDResources.get().ctx
     timer = Timer(cli.logger)
     timer.start("Parsing {} sentences".format(len(lines)))
-    for idx, sent in enumerate(ghub.ERG_ISF.parse_many_iterative(lines, parse_count=args.topk, ignore_cache=args.nocache)):
-        if args.max and args.max < idx:
-            break
-        print("Processing sentence {} of {}".format(idx + 1, len(lines)))
-        sent.tag_xml(method=args.wsd, wsd=wsd, ctx=ctx)
-        report.writeline(sent.to_xml_str(pretty_print=not args.compact))
-        report.writeline("\n\n")
+    with DocumentWriter(args.output, pretty_print=not args.compact, with_dmrs=not args.nodmrs) as writer:
+        done = checkpoint.completed(key) if checkpoint is not None else 0
+        if done:
+            done = recover_document(args.output, writer, done)
+            print("Resuming from sentence {} of {}".format(done + 1, len(lines)))
+        for idx, sent in enumerate(ghub.ERG_ISF.parse_many_iterative(lines[done:], parse_count=args.topk, ignore_cache=args.nocache, pool_size=args.pool), start=done):
+            if args.max and args.max < idx:
+                break
+            print("Processing sentence {} of {}".format(idx + 1, len(lines)))
+            sent.tag_xml(method=args.wsd, wsd=wsd, ctx=ctx)
+            writer.write(sent)
+            done = idx + 1
+            if checkpoint is not None:
+                checkpoint.update(key, sentences=done)
+    if checkpoint is not None:
+        # a run which was cut short by --max is not finished
+        checkpoint.update(key, sentences=done, done=done >= len(lines))
+    ghub.close()
     timer.stop("Finished")
 
 
+def tag_parallel(sents, method, jobs, forgive=False):
+    ''' Sense-tag sentences using a pool of worker processes '''
+    sents = list(sents)
+    with WSDPool(jobs) as pool:
+        for idx, (sent, error) in enumerate(pool.tag(sents, method=method)):
+            print("Tagging sentence #{}/{}".format(idx + 1, len(sents)))
+            if error is not None:
+                if forgive:
+                    getLogger().warning("Could not process sentence {} ({})".format(sent.ID, error))
+                else:
+                    raise Exception("Could not process sentence {} ({})".format(sent.ID, error))
+
+
 def retag_doc(cli, args):
     ''' Re-tag an ISF document '''
     # verification
@@ -120,31 +153,39 @@ def retag_doc(cli, args):
             return
     # process
     header("Processing file: {}".format(args.path))
-    doc = Document.from_file(args.path, idents=args.ident)
-    print("Document size: {}".format(len(doc)))
     if not args.wsd and not args.ttl:
         print("Nothing to do")
         return
+    if not args.ttl and not (args.jobs and args.jobs > 1):
+        # only WSD is needed, sentences can be streamed from input to output
+        retag_stream(args)
+        return
+    doc = Document.from_file(args.path, idents=args.ident)
+    print("Document size: {}".format(len(doc)))
     if args.wsd:
         print("Retagging document using {}".format(args.wsd))
-        wsd = LeLeskWSD(dbcache=LeskCache())
-        wsd.connect()
-        ctx = PredSense.wn.ctx()
-        for idx, sent in enumerate(doc):
-            if args.topk and idx > args.topk:
-                break
-            if args.ident and sent.ident not in args.ident:
-                continue
-            print("Tagging sentence #{}/{}".format(idx + 1, len(doc)))
-            try:
-                sent.tag_xml(method=args.wsd, wsd=wsd, ctx=ctx)
-            except Exception as e:
-                if args.forgive:
-                    getLogger().warning("Could not process sentence {}".format(sent.ID))
-                else:
-                    raise e
-        ctx.close()
-        wsd.disconnect()
+        if args.jobs and args.jobs > 1:
+            sents = doc[:args.topk + 1] if args.topk else doc
+            sents = [s for s in sents if not args.ident or s.ident in args.ident]
+            tag_parallel(sents, args.wsd, args.jobs, forgive=args.forgive)
+        else:
+            wsd = WSDResources.get().wsd
+            ctx = WSDResources.get().ctx
+            for idx, sent in enumerate(doc):
+                if args.topk and idx > args.topk:
+                    break
+                if idx % PREFETCH_SIZE == 0:
+                    prefetch_senses(doc[idx:idx + PREFETCH_SIZE], ctx=ctx)
+                if args.ident and sent.ident not in args.ident:
+                    continue
+                print("Tagging sentence #{}/{}".format(idx + 1, len(doc)))
+                try:
+                    sent.tag_xml(method=args.wsd, wsd=wsd, ctx=ctx)
+                except Exception as e:
+                    if args.forgive:
+                        getLogger().warning("Could not process sentence {}".format(sent.ID))
+                    else:
+                        raise e
     if args.ttl:
         print("Tagging doc {} using TTL doc {}".format(doc.name, args.ttl))
         ttl_doc = ttl.read(args.ttl, mode=args.ttl_format)
@@ -152,8 +193,35 @@ def retag_doc(cli, args):
         if args.mode:
             kwargs['mode'] = args.mode
         tag_doc(doc, ttl_doc, taggold=not args.nogold, on_error=args.on_error, **kwargs)
-    doc_xml_str = doc.to_xml_str(pretty_print=not args.compact, with_dmrs=not args.nodmrs)
-    write_file(doc_xml_str, args.output)
+    with DocumentWriter(args.output, doc=doc, pretty_print=not args.compact, with_dmrs=not args.nodmrs) as writer:
+        for sent in doc:
+            writer.write(sent)
+
+
+def retag_stream(args):
+    ''' Re-tag an ISF document one sentence at a time '''
+    print("Retagging document using {}".format(args.wsd))
+    wsd = WSDResources.get().wsd
+    ctx = WSDResources.get().ctx
+    doc = Document()  # document attributes are read together with the first sentence
+    sents = iter_sentences(args.path, idents=args.ident, doc=doc)
+    with DocumentWriter(args.output, doc=doc, pretty_print=not args.compact, with_dmrs=not args.nodmrs) as writer:
+        idx = 0
+        for batch in chunked(sents, PREFETCH_SIZE):
+            if not args.topk or idx <= args.topk:
+                prefetch_senses(batch, ctx=ctx)
+            for sent in batch:
+                if not args.topk or idx <= args.topk:
+                    print("Tagging sentence #{}".format(idx + 1))
+                    try:
+                        sent.tag_xml(method=args.wsd, wsd=wsd, ctx=ctx)
+                    except Exception as e:
+                        if args.forgive:
+                            getLogger().warning("Could not process sentence {}".format(sent.ID))
+                        else:
+                            raise e
+                writer.write(sent)
+                idx += 1
 
 
 def extract_tsdb(cli, args):
@@ -204,18 +272,25 @@ def extract_tsdb(cli, args):
         # perform WSD if required
         if args.wsd:
             print("Performing WSD using {}...".format(args.wsd))
-            wsd = LeLeskWSD(dbcache=LeskCache())
-            ctx = PredSense.wn.ctx()
-            for idx, sent in enumerate(doc):
-                print("processed {} of {} sentences".format(idx + 1, len(doc)))
-                sent.tag_xml(method=args.wsd, wsd=wsd, ctx=ctx)
-                if args.topk and int(args.topk) < idx:
-                    break
-            ctx.close()
+            if args.jobs and args.jobs > 1:
+                # the serial loop below tags one sentence past topk
+                sents = doc[:int(args.topk) + 2] if args.topk else doc
+                tag_parallel(sents, args.wsd, args.jobs)
+            else:
+                wsd = WSDResources.get().wsd
+                ctx = WSDResources.get().ctx
+                for idx, sent in enumerate(doc):
+                    if idx % PREFETCH_SIZE == 0:
+                        prefetch_senses(doc[idx:idx + PREFETCH_SIZE], ctx=ctx)
+                    print("processed {} of {} sentences".format(idx + 1, len(doc)))
+                    sent.tag_xml(method=args.wsd, wsd=wsd, ctx=ctx)
+                    if args.topk and int(args.topk) < idx:
+                        break
             timer.stop("WSD ({})".format(args.wsd))
         print("Generating output ...")
-        doc_xml_str = doc.to_xml_str(pretty_print=not args.compact, with_dmrs=not args.nodmrs)
-        write_file(doc_xml_str, args.output)
+        with DocumentWriter(args.output, doc=doc, pretty_print=not args.compact, with_dmrs=not args.nodmrs) as writer:
+            for sent in doc:
+                writer.write(sent)
         timer.stop("Finished")
 
 
@@ -223,8 +298,8 @@ def parse_text(cli, args):
     ''' Analyse a text '''
     ghub = GrammarHub()
     text = args.input
-    wsd = LeLeskWSD(dbcache=LeskCache())
-    ctx = PredSense.wn.ctx()
+    wsd = WSDResources.get().wsd
+    ctx = WSDResources.get().ctx
     timer = Timer(logger=cli.logger)
     timer.start("Parsing \"{}\"".format(text))
     result = ghub.parse(text, args.grammar, args.topk, args.wsd, args.nocache, wsd=wsd, ctx=ctx)
@@ -271,6 +346,7 @@ def parse_bib(cli, args):
     if not args.output or not os.path.isdir(args.output):
         cli.logger.warning("Output directory does not exist")
         exit()
+    checkpoint = Checkpoint(os.path.join(args.output, CHECKPOINT_FILE), resume=args.resume)
     bib = RawCollection(bib_path)
     corpuses = bib.get_corpuses()
     print("Available corpuses: {}".format(len(corpuses)))
@@ -283,19 +359,30 @@ def parse_bib(cli, args):
             os.makedirs(corpus_path)
         for doc in corpus.get_documents():
             c.count("Documents")
+            if checkpoint.is_done(corpus.name, doc.name):
+                print("Skipped document: {} {} (completed)".format(doc.name, doc.title))
+                c.count("Documents (skipped)")
+                continue
             sents = list(doc.read_sentences())
             c.update({'Sentences': len(sents)})
             print("Processing document: {} {} | Size: {}".format(doc.name, doc.title, len(sents)))
             doc_path = os.path.join(corpus_path, doc.name + '.xml')
             doc_isf = Document(name=doc.name, title=doc.title)
             sent_texts = [s.text for s in sents]
-            # parse document
-            report = TextReport(doc_path)
-            for sent in ghub.ERG_ISF.parse_many_iterative(sent_texts, parse_count=args.topk, ignore_cache=args.nocache):
-                sent.tag_xml(method=args.wsd)
-                print("Processed: {}".format(sent.text))
-                doc_isf.add(sent)
-            report.writeline(doc_isf.to_xml_str(pretty_print=not args.compact))
+            # parse document, sentences are written as soon as they are tagged
+            with DocumentWriter(doc_path, doc=doc_isf, pretty_print=not args.compact) as writer:
+                done = checkpoint.completed(corpus.name, doc.name)
+                if done:
+                    done = recover_document(doc_path, writer, done)
+                    print("Resuming from sentence {}".format(done + 1))
+                for sent in ghub.ERG_ISF.parse_many_iterative(sent_texts[done:], parse_count=args.topk, ignore_cache=args.nocache, pool_size=args.pool):
+                    sent.tag_xml(method=args.wsd)
+                    print("Processed: {}".format(sent.text))
+                    writer.write(sent)
+                    done += 1
+                    checkpoint.update(corpus.name, doc.name, sentences=done)
+            checkpoint.update(corpus.name, doc.name, sentences=done, done=True)
+    ghub.close()
     c.summarise()
 
 
@@ -388,6 +475,32 @@ def show_isf_info(cli, args):
         print_dict(config, rp)
 
 
+def manage_cache(cli, args):
+    ''' Maintain ISF and ACE cache DBs '''
+    ghub = GrammarHub()
+    if args.action == 'compact':
+        if args.max_size is not None and ghub.cache:
+            ghub.cache.max_size = args.max_size
+        for path, size_before, size_after in ghub.compact_caches():
+            print("{}: {:,} -> {:,} bytes ({:,} bytes reclaimed)".format(path, size_before, size_after, size_before - size_after))
+    elif args.action == 'size' and ghub.cache:
+        print("{}: {:,} bytes on disk | {:,} bytes of cached renderings".format(ghub.cache_path, os.path.getsize(ghub.cache_path), ghub.cache.total_size()))
+
+
+def build_pred_index(cli, args):
+    ''' Compile ERG preds and their WordNet senses into a pred index '''
+    output = args.output if args.output else PredSense.index_path()
+    preds = None
+    if args.preds:
+        preds = [p.strip() for p in FileHelper.read(args.preds).splitlines() if p.strip()]
+    timer = Timer(cli.logger)
+    timer.start("Building pred index")
+    index = PredSense.build_index(preds=preds)
+    index.save(output)
+    timer.stop("Building pred index")
+    print("Indexed {} preds ({} synsets) -> {}".format(len(index), len(index.synsets), output))
+
+
 # app instance
 app = CLIApp(f"coolisf - Integrated Semantic Framework - Version {__version__}", logger=__name__, config_logging=isf_config_logging)
 
@@ -405,12 +518,15 @@ def make_task(name, func):
     task.add_argument('-c', '--compact', help="Produce compact outputs", action="store_true")
     task.add_argument('--nodmrs', help="Do not generate DMRS XML", action="store_true")
     task.add_argument('--shallow', help="With shallow", action="store_true")
+    task.add_argument('--pool', help="Number of ACE workers to parse with", type=int, default=None)
+    task.add_argument('-j', '--jobs', help="Number of processes to sense-tag with", type=int, default=1)
     return task
 
 
 def main():
     task = make_task('parse', func=parse_isf)
     task.add_argument('infile', help='Path to input text file')
+    task.add_argument('--resume', help='Skip sentences which have been processed by a previous run', action='store_true')
 
     task = make_task('text', func=parse_text)
     task.add_argument('input', help='Any text')
@@ -418,6 +534,7 @@ def main():
     # batch processing a raw text corpus
     task = make_task('bib', func=parse_bib)
     task.add_argument('input', help='Path to raw biblioteca')
+    task.add_argument('--resume', help='Skip documents and sentences which have been processed by a previous run', action='store_true')
     # Create ISF gold profile
     task = app.add_task('gold', lambda cli, args: generate_gold_profile(), help='Extract gold profile')
 
@@ -462,6 +579,16 @@ def main():
     task.add_argument('--top1dmrs', help='When ACE\'s option -1Tf is used', action='store_true')
     task.add_argument('--forgive', help='Do not halt on error', action='store_true')
 
+    # maintain caches
+    task = app.add_task('cache', func=manage_cache)
+    task.add_argument('action', choices=['compact', 'size'])
+    task.add_argument('--max_size', help='Evict least recently used ISF cache entries to fit in this many bytes', type=int, default=None)
+
+    # compile pred-synset index
+    task = app.add_task('index', func=build_pred_index)
+    task.add_argument('-o', '--output', help='Index file (default: predsense_index in config)')
+    task.add_argument('--preds', help='A file with additional pred strings (one per line)')
+
     # show ISF configuration
     task = app.add_task('info', func=show_isf_info)
     task.add_argument('--detail', help='Show detailed configuration', action='store_true')
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pre-compiled ERG pred - WordNet synset index
+"""
+
+# This code is a part of coolisf library: https://github.com/letuananh/intsem.fx
+# :copyright: (c) 2014 Le Tuan Anh <tuananh.ke@gmail.com>
+# :license: MIT, see LICENSE for more details.
+
+import gzip
+import json
+import logging
+
+from yawlib import Synset, SynsetCollection
+
+
+# ----------------------------------------------------------------------
+# Configuration
+# ----------------------------------------------------------------------
+
+INDEX_VERSION = 1
+
+
+def getLogger():
+    return logging.getLogger(__name__)
+
+
+# ----------------------------------------------------------------------
+
+def normalize_pred_str(pred_str):
+    """ Canonical index key of a pred string (unquoted, with _rel suffix) """
+    pred_str = str(pred_str).strip('"')
+    return pred_str if pred_str.endswith('_rel') else pred_str + '_rel'
+
+
+class PredSenseIndex(object):
+    """ Map pred strings to ranked synset lists without touching WordNet.
+
+    preds      -- pred string -> [[synsetid, lemma], ...] (the result of PredSense.search_pred_string)
+    adjectives -- pred string -> {pos: [[synsetid, lemma], ...]} (adjectival EPs, keyed by the guessed POS)
+    synsets    -- synsetid -> [tagcount, lemmas, sensekeys, definitions]
+    A pred which is indexed with an empty list is known to have no sense.
+    """
+
+    def __init__(self, preds=None, adjectives=None, synsets=None):
+        self.preds = preds if preds is not None else {}
+        self.adjectives = adjectives if adjectives is not None else {}
+        self.synsets = synsets if synsets is not None else {}
+
+    def __len__(self):
+        return len(self.preds)
+
+    def __contains__(self, pred_str):
+        return normalize_pred_str(pred_str) in self.preds
+
+    def _entries(self, synsets):
+        entries = []
+        for ss in synsets:
+            sid = ss.ID.to_canonical()
+            if sid not in self.synsets:
+                self.synsets[sid] = [ss.tagcount, list(ss.lemmas), list(ss.sensekeys), list(ss.definitions)]
+            # searches overwrite the first lemma, so the canonical lemma is stored per pred
+            entries.append([sid, ss.lemma])
+        return entries
+
+    def add_pred(self, pred_str, synsets):
+        self.preds[normalize_pred_str(pred_str)] = self._entries(synsets)
+
+    def add_adjective(self, pred_str, pos, synsets):
+        self.adjectives.setdefault(normalize_pred_str(pred_str), {})[pos] = self._entries(synsets)
+
+    def _to_collection(self, entries):
+        synsets = SynsetCollection()
+        for sid, lemma in entries:
+            tagcount, lemmas, keys, defs = self.synsets[sid]
+            ss = Synset(sid, keys=list(keys), lemmas=list(lemmas), defs=list(defs), tagcount=tagcount)
+            if lemma:
+                ss.lemma = lemma
+            synsets.add(ss)
+        return synsets
+
+    def get_pred(self, pred_str):
+        """ Return a SynsetCollection or None if this pred was not indexed """
+        entries = self.preds.get(normalize_pred_str(pred_str))
+        return self._to_collection(entries) if entries is not None else None
+
+    def get_adjective(self, pred_str, pos):
+        """ Return a SynsetCollection or None if this adjective was not indexed """
+        entries = self.adjectives.get(normalize_pred_str(pred_str), {}).get(pos)
+        return self._to_collection(entries) if entries is not None else None
+
+    def save(self, path):
+        content = {'version': INDEX_VERSION,
+                   'preds': self.preds,
+                   'adjectives': self.adjectives,
+                   'synsets': self.synsets}
+        with gzip.open(path, 'wt', encoding='utf-8') as outfile:
+            json.dump(content, outfile, separators=(',', ':'))
+
+    @staticmethod
+    def load(path):
+        with gzip.open(path, 'rt', encoding='utf-8') as infile:
+            content = json.load(infile)
+        if content.get('version') != INDEX_VERSION:
+            raise Exception("Unsupported pred index version (provided: {}, expected: {})".format(content.get('version'), INDEX_VERSION))
+        getLogger().debug("Loaded {} preds from {}".format(len(content['preds']), path))
+        return PredSenseIndex(content['preds'], content['adjectives'], content['synsets'])
@@ -8,28 +8,54 @@ ERG-Wordnet mapping
 # :copyright: (c) 2014 Le Tuan Anh <tuananh.ke@gmail.com>
 # :license: MIT, see LICENSE for more details.
 
+import os
 import logging
-import copy
 from itertools import chain
-from collections import defaultdict as dd
 from delphin.mrs.components import Pred
 
-from yawlib import SynsetCollection
+from texttaglib.chirptext import FileHelper
+from yawlib import Synset, SynsetCollection
 from yawlib.helpers import get_wn
-from coolisf.common import ptpos_to_wn, get_ep_lemma
+from coolisf.common import ptpos_to_wn, get_ep_lemma, LRUCache, chunked
+from coolisf.config import read_config
 from coolisf.mappings.mwemap import MWE_ERG_PRED_LEMMA
+from coolisf.mappings.ergpreds import ERG_PRED_MAP
+from coolisf.mappings.predindex import PredSenseIndex
 
 
 # ----------------------------------------------------------------------
 # Configuration
 # ----------------------------------------------------------------------
 
+DEFAULT_INDEX_PATH = '{data_root}/predsense_index.json.gz'
+SEARCH_CACHE_SIZE = 20000  # number of (lemmata, pos) search results to keep in memory
+LEMMA_CACHE_SIZE = 50000  # number of lemmas with prefetched senses
+SYNSET_CACHE_SIZE = 50000  # number of prefetched synsets
+MAX_PARAMS = 500  # maximum number of values in one IN (...) clause
+
+
 def getLogger():
     return logging.getLogger(__name__)
 
 
 # ----------------------------------------------------------------------
 
+class FrozenSynsetCollection(SynsetCollection):
+    """ A read-only SynsetCollection which can be shared between callers without copying.
+    Use SynsetCollection(frozen) to get a modifiable copy.
+    """
+
+    def __init__(self, synsets=None, lang='eng'):
+        super().__init__(synsets, lang=lang)
+        self.synsets = tuple(self.synsets)
+        self.frozen = True
+
+    def add(self, synset):
+        if getattr(self, 'frozen', False):
+            raise TypeError("FrozenSynsetCollection cannot be modified")
+        return super().add(synset)
+
+
 class PredSense(object):
 
     wn = get_wn()
@@ -64,6 +90,62 @@ class PredSense(object):
                   'be_v_id_rel': ('02604760-v', ' 02664769-v', '02445925-v', '02616386-v'),
                   'be_v_there_rel': ('02749904-v', '02603699-v', '02655135-v')}
 
+    index = None  # pre-compiled PredSenseIndex, see get_index()
+    index_checked = False
+
+    @staticmethod
+    def index_path():
+        """ Location of the pred index (config key: predsense_index) """
+        cfg = read_config()
+        if not cfg or 'data_root' not in cfg:
+            return None
+        path = cfg.get('predsense_index', DEFAULT_INDEX_PATH)
+        return FileHelper.abspath(path.format(data_root=cfg['data_root']))
+
+    @staticmethod
+    def get_index():
+        """ Get the pred index (loaded on first use), return None if it has not been built """
+        if PredSense.index is None and not PredSense.index_checked:
+            PredSense.index_checked = True
+            path = PredSense.index_path()
+            if path and os.path.isfile(path):
+                PredSense.load_index(path)
+            else:
+                getLogger().info("Pred index could not be found at {}. WordNet will be searched directly.".format(path))
+        return PredSense.index
+
+    @staticmethod
+    def load_index(path):
+        PredSense.index = PredSenseIndex.load(path)
+        PredSense.index_checked = True
+        getLogger().info("Loaded pred index from {} ({} preds)".format(path, len(PredSense.index)))
+        return PredSense.index
+
+    @staticmethod
+    def build_index(preds=None, ctx=None):
+        """ Compile search results of all known preds (ERG_PRED_MAP, MWE_ERG_PRED_LEMMA, MANUAL_MAP
+        and the provided preds) into a PredSenseIndex """
+        if ctx is None:
+            with PredSense.wn.ctx() as ctx:
+                return PredSense.build_index(preds=preds, ctx=ctx)
+        pred_strs = set(chain(ERG_PRED_MAP.keys(), MWE_ERG_PRED_LEMMA.keys(), PredSense.MANUAL_MAP.keys()))
+        if preds:
+            pred_strs.update(preds)
+        index = PredSenseIndex()
+        for idx, pred_str in enumerate(sorted(pred_strs)):
+            if idx and idx % 1000 == 0:
+                getLogger().info("Indexed {}/{} preds".format(idx, len(pred_strs)))
+            try:
+                pred = Pred.string_or_grammar_pred(pred_str)
+            except Exception:
+                getLogger().warning("Invalid pred string: {}".format(pred_str))
+                continue
+            index.add_pred(pred_str, PredSense.search_pred_string(pred_str, ctx=ctx, use_index=False))
+            if pred.pos == 'a':
+                for pos in ('a', 'r'):
+                    index.add_adjective(pred_str, pos, PredSense.search_adjective(pred, pos, ctx=ctx, use_index=False))
+        return index
+
     @staticmethod
     def extend_lemma(lemma):
         """ Get a set of potential lemmas """
@@ -89,40 +171,164 @@ class PredSense(object):
         return potential
 
     singleton_sm = None
-    search_cache = dd()
+    search_cache = LRUCache(max_entries=SEARCH_CACHE_SIZE)
+
+    @staticmethod
+    def set_search_cache(cache):
+        """ Replace the search cache, e.g. PredSense.set_search_cache(LRUCache(max_entries=1000)) """
+        PredSense.search_cache = cache
+
+    @staticmethod
+    def cache_info():
+        """ Hit/miss/eviction counters of the search cache """
+        return PredSense.search_cache.stats()
 
     @staticmethod
     def search_sense(lemmata, pos=None, ctx=None):
+        """ Return a FrozenSynsetCollection (shared by all callers, do not modify) """
         search_key = (tuple(lemmata), pos)
-        if search_key in PredSense.search_cache:
-            return copy.deepcopy(PredSense.search_cache[search_key])
-        if ctx is None:
+        if ctx is None and search_key not in PredSense.search_cache:
             with PredSense.wn.ctx() as ctx:
                 return PredSense.search_sense(lemmata, pos=pos, ctx=ctx)
+        cached = PredSense.search_cache.get(search_key)
+        if cached is not None:
+            return cached
         # ctx is ensured to be not null
-        """ Return a SynsetCollection """
         if pos and pos in ('x', 'p'):
             pos = None
         potential = SynsetCollection()
         getLogger().debug("search sense lemmas={} (pos={})".format(lemmata, pos))
         for lemma in lemmata:
-            synsets = PredSense.wn.search(lemma, pos=pos, ctx=ctx)
+            synsets = PredSense.search_lemma(lemma, pos=pos, ctx=ctx)
             getLogger().debug("search_sense: {} (pos={}): {}".format(lemma, pos, synsets))
             for synset in synsets:
                 if synset.ID not in potential:
                     synset.lemma = lemma
                     potential.add(synset)
-        PredSense.search_cache[search_key] = potential
+        potential = FrozenSynsetCollection(potential)
+        PredSense.search_cache.put(search_key, potential)
         return potential
 
+    lemma_cache = LRUCache(max_entries=LEMMA_CACHE_SIZE)  # lower(lemma) => ((synsetid, pos), ...)
+    synset_cache = LRUCache(max_entries=SYNSET_CACHE_SIZE)  # synsetid => (definition, lemmas, sensekeys, tagcount, examples)
+
+    @staticmethod
+    def search_lemma(lemma, pos=None, ctx=None):
+        """ Same as wn.search(lemma, pos) but use prefetched senses when they are available """
+        senses = PredSense.lemma_cache.get(lemma.lower())
+        if senses is None:
+            return PredSense.wn.search(lemma, pos=pos, ctx=ctx)
+        synsets = SynsetCollection()
+        for synsetid, sspos in senses:
+            # adjective satellites are adjectives too
+            if pos is None or sspos == pos or (pos == 'a' and sspos == 's'):
+                synsets.add(PredSense.get_synset(synsetid, ctx=ctx))
+        return synsets
+
+    @staticmethod
+    def get_synset(synsetid, ctx=None):
+        """ Same as wn.get_synset(synsetid) but use prefetched synsets when they are available """
+        info = PredSense.synset_cache.get(synsetid)
+        if info is None:
+            return PredSense.wn.get_synset(synsetid, ctx=ctx)
+        definition, lemmas, keys, tagcount, examples = info
+        ss = Synset(synsetid, keys=list(keys), lemmas=list(lemmas), exes=list(examples), tagcount=tagcount)
+        ss.definition = definition
+        return ss
+
+    @staticmethod
+    def ep_lemmas(ep, extend_lemma=True):
+        """ All lemmas which search_ep(ep) may look up in WordNet """
+        variants = PredSense.extend_lemma if extend_lemma else lambda x: (x,)
+        lemmas = set()
+        if ep.carg:
+            lemmas.update(variants(ep.carg))
+        pred = ep.pred
+        if pred.type != Pred.GRAMMARPRED and pred.lemma:
+            lemma = pred.lemma.split('/')[0] if pred.pos == 'u' else pred.lemma
+            lemmas.update(variants(lemma))
+            if pred.pos == 'a':
+                lemmas.update(variants(lemma + 'ly'))
+        pred_str = str(pred) if str(pred).endswith('_rel') else str(pred) + '_rel'
+        if pred_str in MWE_ERG_PRED_LEMMA:
+            lemmas.add(MWE_ERG_PRED_LEMMA[pred_str])
+        return lemmas
+
+    @staticmethod
+    def prefetch(eps, extend_lemma=True, ctx=None, use_index=True):
+        """ Fetch WordNet senses for all lemmas that tagging the given EPs (of a sentence or a whole document)
+        may need using a few batched queries. Return the number of newly fetched lemmas.
+        """
+        index = PredSense.get_index() if use_index else None
+        lemmas = set()
+        for ep in eps:
+            if index is not None and not ep.carg and str(ep.pred) in index:
+                continue  # can be answered without WordNet
+            lemmas.update(PredSense.ep_lemmas(ep, extend_lemma=extend_lemma))
+        return PredSense.prefetch_lemmas(lemmas, ctx=ctx)
+
+    @staticmethod
+    def prefetch_lemmas(lemmas, ctx=None):
+        # wn.search() matches lemmas with LIKE, wildcards and non-ASCII case folding are left to it
+        lemmas = {x.lower() for x in lemmas if x and all(ord(c) < 128 for c in x) and '_' not in x and '%' not in x}
+        lemmas = sorted(x for x in lemmas if x not in PredSense.lemma_cache)
+        if not lemmas:
+            return 0
+        if ctx is None:
+            with PredSense.wn.ctx() as ctx:
+                return PredSense.prefetch_lemmas(lemmas, ctx=ctx)
+        senses = {x: [] for x in lemmas}
+        for chunk in chunked(lemmas, MAX_PARAMS):
+            params = ','.join('?' * len(chunk))
+            words = {row['wordid']: row['lemma'] for row in ctx.select('SELECT wordid, lower(lemma) AS lemma FROM words WHERE lower(lemma) IN ({})'.format(params), chunk)}
+            # same WHERE clause as wn.search() so that senses come in the same order (MFS ties)
+            rows = ctx.select('SELECT wordid, synsetid FROM senses WHERE wordid IN (SELECT wordid FROM words WHERE lower(lemma) IN ({}))'.format(params), chunk)
+            sspos = {}
+            for sschunk in chunked({row['synsetid'] for row in rows}, MAX_PARAMS):
+                for ss in ctx.select('SELECT synsetid, pos FROM synsets WHERE synsetid IN ({})'.format(','.join('?' * len(sschunk))), sschunk):
+                    sspos[ss['synsetid']] = ss['pos']
+            for row in rows:
+                lemma = words.get(row['wordid'])
+                if lemma in senses and row['synsetid'] in sspos:
+                    senses[lemma].append((row['synsetid'], sspos[row['synsetid']]))
+        synsetids = {sid for rows in senses.values() for sid, _ in rows if sid not in PredSense.synset_cache}
+        PredSense.prefetch_synsets(synsetids, ctx=ctx)
+        for lemma, rows in senses.items():
+            PredSense.lemma_cache.put(lemma, tuple(rows))
+        getLogger().debug("Prefetched {} lemmas ({} new synsets)".format(len(lemmas), len(synsetids)))
+        return len(lemmas)
+
+    @staticmethod
+    def prefetch_synsets(synsetids, ctx):
+        infos = {}
+        for chunk in chunked(synsetids, MAX_PARAMS):
+            params = ','.join('?' * len(chunk))
+            for row in ctx.select('SELECT synsetid, definition FROM synsets WHERE synsetid IN ({})'.format(params), chunk):
+                infos[row['synsetid']] = (row['definition'], [], [], [0], [])
+            for row in ctx.select('SELECT synsetid, lemma, sensekey, tagcount FROM wordsXsenses WHERE synsetid IN ({})'.format(params), chunk):
+                if row['synsetid'] in infos:
+                    definition, lemmas, keys, tagcount, examples = infos[row['synsetid']]
+                    lemmas.append(row['lemma'])
+                    keys.append(row['sensekey'])
+                    tagcount[0] += row['tagcount']
+            for row in ctx.select('SELECT synsetid, sample FROM samples WHERE synsetid IN ({}) ORDER BY synsetid, sampleid'.format(params), chunk):
+                if row['synsetid'] in infos:
+                    infos[row['synsetid']][4].append(row['sample'])
+        for synsetid, (definition, lemmas, keys, tagcount, examples) in infos.items():
+            PredSense.synset_cache.put(synsetid, (definition, tuple(lemmas), tuple(keys), tagcount[0], tuple(examples)))
+
     # alias
     @staticmethod
-    def search_pred_string(pred_str, extend_lemma=True, ctx=None):
+    def search_pred_string(pred_str, extend_lemma=True, ctx=None, use_index=True):
         if not pred_str:
             raise Exception("pred_str cannot be empty")
+        if use_index and extend_lemma and PredSense.get_index() is not None:
+            ss = PredSense.index.get_pred(pred_str)
+            if ss is not None:
+                return ss
         if ctx is None:
             with PredSense.wn.ctx() as ctx:
-                return PredSense.search_pred_string(pred_str, extend_lemma=extend_lemma, ctx=ctx)
+                return PredSense.search_pred_string(pred_str, extend_lemma=extend_lemma, ctx=ctx, use_index=False)
         # ctx will never be null
         # ensure that pred_str is really a str
         pred_str = str(pred_str)
@@ -145,7 +351,31 @@ class PredSense(object):
             return ep.pred.pos if ep.pred.pos and ep.pred.pos in 'nvar' else 'x'
 
     @staticmethod
-    def search_ep(ep, extend_lemma=True, ctx=None):
+    def search_adjective(pred, pos, extend_lemma=True, ctx=None, use_index=True):
+        """ Search senses for an adjectival EP, pos is the guessed POS (a or r) """
+        if use_index and extend_lemma and PredSense.get_index() is not None:
+            ss = PredSense.index.get_adjective(str(pred), pos)
+            if ss is not None:
+                return ss
+        if extend_lemma:
+            lemmas = list(chain(PredSense.extend_lemma(pred.lemma), PredSense.extend_lemma(pred.lemma + 'ly')))
+        else:
+            lemmas = (pred.lemma, pred.lemma + 'ly')
+        candidates = PredSense.search_sense(lemmas, pos=pos, ctx=ctx)
+        if not candidates:
+            # change to the other
+            old_pos = pos
+            pos = 'r' if pos != 'r' else 'a'
+            getLogger().debug("Not found {}, change POS {} -> {}".format(lemmas, old_pos, pos))
+            candidates = PredSense.search_sense(lemmas, pos=pos, ctx=ctx)
+            getLogger().debug("Candidate for {}: {}".format(pred.string, candidates))
+        if candidates:
+            return candidates
+        # search by preds
+        return PredSense.search_pred(pred, auto_expand=extend_lemma, ctx=ctx)
+
+    @staticmethod
+    def search_ep(ep, extend_lemma=True, ctx=None, use_index=True):
         candidates = None
         pred_str = str(ep.pred)
         if not pred_str.endswith('_rel'):
@@ -164,28 +394,15 @@ class PredSense(object):
             candidates = PredSense.search_sense(lemmas, pos=pos, ctx=ctx)
             getLogger().debug("Candidate for {}: {}".format(ep.pred.string, candidates))
         elif ep.pred.pos == 'a' and 'ARG1' in ep.args:
-            if extend_lemma:
-                lemmas = list(chain(PredSense.extend_lemma(ep.pred.lemma), PredSense.extend_lemma(ep.pred.lemma + 'ly')))
-            else:
-                lemmas = (ep.pred.lemma, ep.pred.lemma + 'ly')
             arg1 = ep.args['ARG1']
             # try to guess POS first
             if arg1.startswith('h') or arg1.startswith('e'):
                 pos = 'r'
             else:
                 pos = 'a'
-            candidates = PredSense.search_sense(lemmas, pos=pos, ctx=ctx)
-            if candidates:
-                return candidates
-            else:
-                # change to the other
-                old_pos = pos
-                pos = 'r' if pos != 'r' else 'a'
-                getLogger().debug("Not found {}, change POS {} -> {}".format(lemmas, old_pos, pos))
-                candidates = PredSense.search_sense(lemmas, pos=pos, ctx=ctx)
-                getLogger().debug("Candidate for {}: {}".format(ep.pred.string, candidates))
+            return PredSense.search_adjective(ep.pred, pos, extend_lemma=extend_lemma, ctx=ctx, use_index=use_index)
         else:
-            candidates = PredSense.search_pred_string(ep.pred.string, ctx=ctx)
+            candidates = PredSense.search_pred_string(ep.pred.string, ctx=ctx, use_index=use_index)
             getLogger().debug("Candidates for [{} [CARG '{}']]: {}".format(ep.pred.string, ep.carg, [(c, c.lemmas) for c in candidates]))
         if candidates:
             return candidates
@@ -233,8 +450,7 @@ class PredSense(object):
             lemmata = [pred.lemma] if not auto_expand else list(PredSense.extend_lemma(pred.lemma))
             ssa = PredSense.search_sense(lemmata, 'a', ctx=ctx)
             ssr = PredSense.search_sense(lemmata, 'r', ctx=ctx)
-            ssa = ssa.merge(ssr)
-            return ssa
+            return SynsetCollection(ssa).merge(ssr)
         else:
             lemmata = [pred.lemma] if not auto_expand else list(PredSense.extend_lemma(pred.lemma))
             pos = pred.pos
@@ -255,6 +471,4 @@ class PredSense(object):
                 pos = 'a'
                 ss = PredSense.search_sense(lemmata, pos, ctx=ctx)
         # Done
-        ss.synsets.sort(key=lambda x: x.tagcount, reverse=True)
-        # return sorted(ss.synsets, key=lambda x: x.tagcount, reverse=True)
-        return ss
+        return SynsetCollection(sorted(ss, key=lambda x: x.tagcount, reverse=True))
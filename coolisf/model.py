@@ -8,6 +8,7 @@ ISF data models
 # :copyright: (c) 2014 Le Tuan Anh <tuananh.ke@gmail.com>
 # :license: MIT, see LICENSE for more details.
 
+import sys
 import copy
 import json
 import gzip
@@ -17,6 +18,7 @@ import itertools
 # import threading
 from collections import defaultdict as dd
 from collections import namedtuple
+from contextlib import ExitStack
 from lxml import etree
 # delphin
 from delphin.extra.latex import dmrs_tikz_dependency
@@ -27,17 +29,17 @@ from delphin.mrs import Mrs
 from delphin.mrs import Dmrs
 from delphin.mrs.components import Pred
 from delphin.mrs.components import normalize_pred_string
+from delphin.mrs.config import QUANTIFIER_POS
 
 from texttaglib.chirptext.anhxa import update_obj
 from texttaglib.chirptext.leutile import StringTool, header
 from texttaglib.chirptext import texttaglib as ttl
 from yawlib import Synset
-from lelesk import LeLeskWSD
-from lelesk import LeskCache  # WSDResources
 
-from coolisf.common import read_file, get_ep_lemma
+from coolisf.common import open_file, get_ep_lemma
 from coolisf.parsers import parse_dmrs_str
 from coolisf.mappings import PredSense
+from coolisf.wsd import WSDResources
 
 
 # ----------------------------------------------------------------------
@@ -209,15 +211,87 @@ class Document(object):
         return Document.from_xml_node(doc_root, *args, **kwargs)
 
     @staticmethod
-    def from_file(file_path, *args, **kwargs):
+    def from_file(file_path, idents=None):
         getLogger().info("Reading ISF Document from: {}".format(file_path))
-        doc_str = read_file(file_path)
-        getLogger().debug("Raw doc string size: {}".format(len(doc_str)))
-        doc = Document.from_xml_str(doc_str, *args, **kwargs)
+        doc = Document()
+        for sent in iter_sentences(file_path, idents=idents, doc=doc):
+            doc.add(sent)
         getLogger().debug("Doc size: {}".format(len(doc)))
         return doc
 
 
+class DocumentWriter(object):
+    """ Write an ISF document (xml or xml.gz) one sentence at a time.
+    Sentences are flushed as soon as they are written so a long job leaves usable partial output.
+    The <document> element is opened with the first sentence, using the attributes of doc.
+    When path is None, the document is written to stdout.
+    """
+
+    def __init__(self, path=None, doc=None, pretty_print=True, with_raw=True, with_shallow=True, with_dmrs=True, strict=True):
+        self.path = path
+        self.doc = doc if doc is not None else Document()
+        self.pretty_print = pretty_print
+        self.with_raw = with_raw
+        self.with_shallow = with_shallow
+        self.with_dmrs = with_dmrs
+        self.strict = strict
+        self.sent_count = 0
+        self._stack = None
+        self._file = None
+        self._xf = None
+
+    def _start(self):
+        self._stack = ExitStack()
+        if not self.path:
+            self._file = sys.stdout.buffer
+        elif self.path.endswith('.gz'):
+            self._file = self._stack.enter_context(gzip.open(self.path, 'wb'))
+        else:
+            self._file = self._stack.enter_context(open(self.path, 'wb'))
+        self._xf = self._stack.enter_context(etree.xmlfile(self._file, encoding='utf-8'))
+        self._xf.write_declaration()
+        self._stack.enter_context(self._xf.element('document', {'id': str(self.doc.ID) if self.doc.ID else '',
+                                                                'name': self.doc.name if self.doc.name else '',
+                                                                'title': self.doc.title if self.doc.title else ''}))
+        if self.pretty_print:
+            self._xf.write('\n')
+
+    def write(self, sent):
+        if self._stack is None:
+            self._start()
+        try:
+            sent_node = sent.to_xml_node(with_raw=self.with_raw, with_shallow=self.with_shallow, with_dmrs=self.with_dmrs)
+        except Exception as e:
+            if self.strict:
+                raise e
+            else:
+                getLogger().warning("Sentence {} was corrupted: {}".format(sent.ID, sent.text))
+                return
+        self._xf.write(sent_node, pretty_print=self.pretty_print)
+        self._xf.flush()
+        self._file.flush()
+        self.sent_count += 1
+
+    def close(self):
+        """ Close the <document> element and the output file """
+        if self._stack is None:
+            self._start()  # an empty document
+        elif self._xf is None:
+            return  # closed already
+        self._xf = None
+        self._stack.close()
+        if not self.path:
+            sys.stdout.buffer.write(b'\n')
+            sys.stdout.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
 class Sentence(object):
 
     NONE = 0
@@ -346,11 +420,15 @@ class Sentence(object):
         return self[key].edit()
 
     def tag(self, method=None, **kwargs):
+        if method is not None:
+            prefetch_senses([self], strict=kwargs.get('strict', False), ctx=kwargs.get('ctx', None))
         for parse in self:
             parse.dmrs().tag(method=method, **kwargs)
         return self
 
     def tag_xml(self, method=None, update_back=True, **kwargs):
+        if method is not None:
+            prefetch_senses([self], strict=kwargs.get('strict', False), ctx=kwargs.get('ctx', None))
         for parse in self:
             parse.dmrs().tag_xml(method=method, update_back=update_back, **kwargs)
         return self
@@ -472,6 +550,11 @@ class Reading(object):
         if self._dmrs is not None:
             self._mrs = self.dmrs().to_mrs()
 
+    def reset_mrs(self):
+        # MRS will be generated from DMRS when it is needed
+        if self._dmrs is not None:
+            self._mrs = None
+
     def update_dmrs(self, with_raw=False):
         # Generate DMRS from MRS
         if self._mrs:
@@ -572,6 +655,7 @@ class DMRS(object):
         self._layout = None  # editable DMRS
         self._obj = None  # pydelphin object
         self._node = None  # xml_node cache
+        self._edited = None  # JSON of the last saved DMRSLayout
         self.tags = dd(list)  # sense tagging
         if tags:
             self.tags.update(tags)
@@ -586,7 +670,8 @@ class DMRS(object):
 
     @raw.setter
     def raw(self, value):
-        self.reset(raw=value)
+        # sense tags are not always stored in XML
+        self.reset(raw=value, tags=self.tags)
 
     @property
     def layout(self):
@@ -600,6 +685,7 @@ class DMRS(object):
         self._layout = layout
         self._obj = obj
         self._node = node
+        self._edited = None
         self.tags = dd(list)
         if tags is not None:
             self.tags.update(tags)
@@ -618,6 +704,15 @@ class DMRS(object):
             self.reading.update_mrs()
         return self
 
+    def from_layout(self, layout):
+        """ Write an edited DMRSLayout back without going through JSON and pyDelphin """
+        self.reset(node=layout.to_xml())
+        # pyDelphin object will only be built when it is needed
+        self._edited = layout.to_json()
+        if self.reading is not None:
+            self.reading.reset_mrs()
+        return self
+
     def surface(self, node):
         if node is None or self.parse is None or self.reading.sent is None:
             return None
@@ -704,6 +799,8 @@ class DMRS(object):
     def obj(self):
         """ Get pydelphin DMRS object
         """
+        if self._obj is None and self._edited is not None:
+            self._obj = Dmrs.from_dict(self._edited)
         if self._obj is None:
             xml_str = '<dmrs-list>{}</dmrs-list>'.format(self.xml_str())
             mrses = []
@@ -773,14 +870,16 @@ class DMRS(object):
         """
         if method not in (ttl.Tag.LELESK, ttl.Tag.MFS):
             return {}  # no tag
-        if wsd is None:
-            wsd = LeLeskWSD(dbcache=LeskCache())
+        if wsd is None or ctx is None:
+            # reuse the WSD objects & WordNet connection of this thread
+            resources = WSDResources.get()
+            if wsd is None:
+                wsd = resources.wsd
             if ctx is None:
-                with PredSense.wn.ctx() as ctx:
-                    getLogger().warning("Creating a new WSD, this can be optimized further ...")
-                    return self.tag(method=method, wsd=wsd, strict=strict, ctx=ctx)
+                ctx = resources.ctx
         eps = self.get_lexical_preds(strict=strict)
         getLogger().debug("eps for WSD: {}".format(eps))
+        PredSense.prefetch(eps, ctx=ctx)
         context = self.get_wsd_context()  # all lemmas from other predicates
         for ep in eps:
             # taggable eps
@@ -883,7 +982,9 @@ class DMRS(object):
     def tokenize_pos(self, strict=False):
         """ Convert a DMRS to a token list with POS """
         token_list = []
-        for ep in self.get_lexical_preds(strict=strict):
+        eps = self.get_lexical_preds(strict=strict)
+        PredSense.prefetch(eps)
+        for ep in eps:
             pos = PredSense.get_wn_pos(ep)
             token_list.append((get_ep_lemma(ep), pos, ep.cfrom, ep.cto))
         # TODO: lemma or surface form?
@@ -891,7 +992,52 @@ class DMRS(object):
         return token_list
 
     def edit(self):
-        return DMRSLayout(self.json(), self)
+        return DMRSLayout.from_xml(self.xml(), source=self)
+
+
+def prefetch_senses(sents, strict=False, ctx=None):
+    """ Fetch WordNet senses for all readings of the given sentences in a few batched queries """
+    eps = []
+    for sent in sents:
+        for reading in sent:
+            try:
+                eps.extend(reading.dmrs().get_lexical_preds(strict=strict))
+            except Exception:
+                # this is only an optimization, broken readings are reported when they are tagged
+                getLogger().warning("Could not read EPs of sentence {}".format(sent.ID))
+    return PredSense.prefetch(eps, ctx=ctx)
+
+
+def iter_sentences(path, idents=None, doc=None):
+    """ Read sentences from an ISF document file (xml or xml.gz) one by one.
+    XML elements are discarded once they have been processed, so the whole document is never kept in memory.
+    If doc is provided, its name, title, ident and ID will be read from the <document> element.
+    path can also be a binary file object.
+    """
+    if isinstance(path, str):
+        with open_file(path) as infile:
+            yield from iter_sentences(infile, idents=idents, doc=doc)
+        return
+    for event, node in etree.iterparse(path, events=('start', 'end'), tag=('document', 'sentence'), huge_tree=True):
+        if node.tag == 'document':
+            if event == 'start' and doc is not None:
+                doc.name = get_attr(node, 'name', '')
+                doc.title = get_attr(node, 'title', '') or doc.name
+                doc.ident = get_attr(node, 'ident', None)
+                doc.ID = get_attr(node, 'ID', None)
+            continue
+        elif event != 'end':
+            continue
+        try:
+            if idents and get_attr(node.attrib, 'ident', None) not in idents:
+                getLogger().debug("Skipped sentence #{}".format(node.get('ident')))
+            else:
+                yield Sentence.from_xml_node(node)
+        finally:
+            # free parsed elements (readings keep their own DMRS nodes)
+            parent = node.getparent()
+            if parent is not None:
+                parent.remove(node)
 
 
 def get_attr(a_dict, key, default):
@@ -900,6 +1046,8 @@ def get_attr(a_dict, key, default):
 
 class Predicate(object):
 
+    __slots__ = ('_ptype', '_lemma', '_pos', '_sense', '_predstr')
+
     GRAMMARPRED = Pred.GRAMMARPRED
     REALPRED = Pred.REALPRED
     STRINGPRED = Pred.STRINGPRED
@@ -982,6 +1130,9 @@ Triplet = namedtuple("Triplet", ("name", "in_links", "out_links"))
 
 class Node(object):
 
+    __slots__ = ('ID', 'dmrsID', 'nodeid', '_pred', 'cfrom', 'cto', 'sortinfo', 'surface', 'base', 'carg',
+                 'links', 'dmrs', 'gpred_valueID', 'rplemmaID', 'sense', 'synsetid', 'synset_score')
+
     def __init__(self, nodeid=None, predstr=None, cfrom=-1, cto=-1, sortinfo=None, pos=None, surface=None, base=None, carg=None, predtype=None, dmrs=None):
         # corpus management
         self.ID = None
@@ -1093,7 +1244,7 @@ class Node(object):
         return self.links.in_links
 
     def arg(self, name):
-        return self.links.out_map[name] if name in self.links.out_map else None
+        return self.links.arg(name)
 
     def __getitem__(self, name):
         return self.arg(name)
@@ -1203,6 +1354,8 @@ class Lemma(object):
 
 class Link(object):
 
+    __slots__ = ('ID', 'dmrsID', 'from_nodeid', 'to_nodeid', 'rargname', 'post', 'dmrs')
+
     def __init__(self, from_node=0, to_node=0, rargname=None, post=None, dmrs=None):
         # corpus management
         self.ID = None
@@ -1256,10 +1409,22 @@ class Link(object):
 
 class LinkMap(object):
 
+    __slots__ = ('in_links', 'out_links')
+
     def __init__(self):
         self.in_links = list()
         self.out_links = list()
-        self.out_map = {}
+
+    @property
+    def out_map(self):
+        return {l.rargname: l.to_node for l in self.out_links}
+
+    def arg(self, name):
+        # the last link wins, as in out_map
+        for lnk in reversed(self.out_links):
+            if lnk.rargname == name:
+                return lnk.to_node
+        return None
 
     def link_in(self, lnk):
         self.in_links.append(lnk)
@@ -1269,11 +1434,9 @@ class LinkMap(object):
 
     def link_out(self, lnk):
         self.out_links.append(lnk)
-        self.out_map[lnk.rargname] = lnk.to_node
 
     def unlink_out(self, lnk):
         self.out_links.remove(lnk)
-        self.pop(lnk.rargname)
 
 
 class DMRSLayout(object):
@@ -1287,9 +1450,8 @@ class DMRSLayout(object):
         self.cfrom = None
         self.cto = None
         self.surface = None
-        self._nodes = []
-        self._links = []
-        self._node_map = {}
+        self._node_map = {}  # nodeid -> Node (in insertion order)
+        self._links = {}  # Link -> None (an ordered set)
         self._top = None  # point to a Node object or None
         self._tags = dd(set)  # map nodeid => a list of (SynsetID(sid, lemma), method)
         if data is not None:  # JSON data
@@ -1328,7 +1490,7 @@ class DMRSLayout(object):
     def top(self, value):
         if value in self:
             self._top = self[value]
-        elif value in self._nodes:
+        elif isinstance(value, Node) and self._node_map.get(value.nodeid) is value:
             self._top = value
         else:
             raise Exception("Invalid node object invaded ({}({}) was provided)".format(repr(value), type(value)))
@@ -1341,12 +1503,11 @@ class DMRSLayout(object):
 
     def add_node(self, node):
         node.dmrs = self
-        self._nodes.append(node)
         self._node_map[node.nodeid] = node
 
     def add_link(self, link):
         link.dmrs = self
-        self._links.append(link)
+        self._links[link] = None
         if link.from_nodeid == 0:
             # FOUND TOP
             self.top = link.to_nodeid
@@ -1359,8 +1520,7 @@ class DMRSLayout(object):
             self[link.from_nodeid].links.out_links.remove(link)
         if link.to_nodeid in self:
             self[link.to_nodeid].links.in_links.remove(link)
-        if link in self._links:
-            self._links.remove(link)
+        self._links.pop(link, None)
 
     def delete_node(self, nodeid):
         node = self[nodeid]
@@ -1372,7 +1532,6 @@ class DMRSLayout(object):
         # delete node
         if node == self.top:
             self._top = None
-        self._nodes.remove(node)
         self._node_map.pop(node.nodeid)
 
     def delete(self, *items):
@@ -1410,7 +1569,10 @@ class DMRSLayout(object):
         getLogger().debug("adjacent dict: {}".format(adj_list))
         return {frozenset(n.predstr for n in v) for k, v in adj_list.items() if len(v) > 1}
 
-    def subgraph(self, headid, constraints=None, ignore_rstr=True):
+    def subgraph_nodes(self, headid, constraints=None, ignore_rstr=True, max_size=None):
+        """ Find node IDs and links of the subgraph headed by headid without copying anything.
+        Return None if the subgraph has more than max_size nodes.
+        """
         if isinstance(headid, Node):
             headid = headid.nodeid
         if isinstance(constraints, DMRSLayout):
@@ -1418,7 +1580,6 @@ class DMRSLayout(object):
         head = self[headid]
         head_rstr = [r.nodeid for r in head.rstr()]
         nodeids = set()
-        sub = DMRSLayout()
         candidates = [l.from_nodeid for l in head.in_links]
         links = set(l for l in head.in_links)
         while candidates:
@@ -1430,12 +1591,35 @@ class DMRSLayout(object):
                     if self[c].predstr not in constraints:
                         continue
                 nodeids.add(c)
+                if max_size is not None and len(nodeids) >= max_size:
+                    # the head is not counted yet
+                    return None
                 candidates.extend(l.from_nodeid for l in self[c].in_links)
                 candidates.extend(l.to_nodeid for l in self[c].out_links)
                 links.update(self[c].in_links)
                 links.update(self[c].out_links)
-        # Add nodes and links to subgraph
         nodeids.add(headid)
+        return nodeids, links
+
+    def signature(self, nodeids=None):
+        """ Pred labels (and CARGs) of this graph (or a part of it), used to reject mismatches cheaply.
+        Every node of a connected subgraph shows up in to_graph() of its head but edges may not
+        (links back to visited nodes and out-links of the head are skipped), so only labels are compared.
+        """
+        if nodeids is None:
+            nodeids = self._node_map.keys()
+        return frozenset((self[n].predstr, self[n].carg) for n in nodeids)
+
+    def subgraph(self, headid, constraints=None, ignore_rstr=True, found=None):
+        """ Copy the subgraph headed by headid into a new DMRSLayout
+        (found -- a result of subgraph_nodes() to be reused) """
+        if isinstance(headid, Node):
+            headid = headid.nodeid
+        if found is None:
+            found = self.subgraph_nodes(headid, constraints=constraints, ignore_rstr=ignore_rstr)
+        nodeids, links = found
+        sub = DMRSLayout()
+        # Add nodes and links to subgraph
         for nodeid in sorted(nodeids):
             new_node = copy.copy(self[nodeid])
             new_node.pred = self[nodeid].predstr
@@ -1458,11 +1642,11 @@ class DMRSLayout(object):
 
     @property
     def nodes(self):
-        return self._nodes
+        return list(self._node_map.values())
 
     @property
     def links(self):
-        return self._links
+        return list(self._links)
 
     def preds(self):
         return [n.predstr for n in self.nodes]
@@ -1480,12 +1664,53 @@ class DMRSLayout(object):
 
     def save(self):
         if self.source is not None:
-            self.source.from_json(self.to_json())
+            self.source.from_layout(self)
         return self
 
     def to_dmrs(self):
         return DMRS().from_json(self.to_json())
 
+    def to_xml(self):
+        """ Serialize this layout to a DMRX <dmrs> element (the format of pyDelphin's dmrx module) """
+        root = etree.Element('dmrs')
+        root.set('cfrom', str(self.cfrom) if self.cfrom not in (None, '') else '-1')
+        root.set('cto', str(self.cto) if self.cto not in (None, '') else '-1')
+        if self.surface:
+            root.set('surface', self.surface)
+        if self.ident:
+            root.set('ident', str(self.ident))
+        for node in self.nodes:
+            node_tag = etree.SubElement(root, 'node')
+            node_tag.set('nodeid', str(node.nodeid))
+            node_tag.set('cfrom', str(node.cfrom))
+            node_tag.set('cto', str(node.cto))
+            if node.surface:
+                node_tag.set('surface', node.surface)
+            if node.base:
+                node_tag.set('base', node.base)
+            if node.carg:
+                node_tag.set('carg', node.carg)
+            pred = node.pred.to_pred()
+            if pred.type == Pred.GRAMMARPRED:
+                etree.SubElement(node_tag, 'gpred').text = pred.string.strip('"\'')
+            else:
+                realpred_tag = etree.SubElement(node_tag, 'realpred')
+                for k, v in (('lemma', pred.lemma), ('pos', pred.pos), ('sense', pred.sense)):
+                    if v is not None:
+                        realpred_tag.set(k, str(v))
+            sortinfo_tag = etree.SubElement(node_tag, 'sortinfo')
+            if pred.pos != QUANTIFIER_POS:
+                # quantifiers have an empty sortinfo
+                for k, v in node.sortinfo.to_json().items():
+                    sortinfo_tag.set(k.lower(), str(v))
+        for link in self.links:
+            link_tag = etree.SubElement(root, 'link')
+            link_tag.set('from', str(link.from_nodeid))
+            link_tag.set('to', str(link.to_nodeid))
+            etree.SubElement(link_tag, 'rargname').text = link.rargname if link.rargname else None
+            etree.SubElement(link_tag, 'post').text = link.post if link.post else None
+        return root
+
     @staticmethod
     def from_xml_str(xml_content):
         root = etree.XML(xml_content)
@@ -1494,10 +1719,10 @@ class DMRSLayout(object):
         return DMRSLayout.from_xml(root)
 
     @staticmethod
-    def from_xml(dmrs_tag):
+    def from_xml(dmrs_tag, source=None):
         """ Get DMRS from XML node
         """
-        dmrs = DMRSLayout()
+        dmrs = DMRSLayout(source=source)
         dmrs.ident = get_attr(dmrs_tag.attrib, 'ident', '')
         dmrs.cfrom = get_attr(dmrs_tag.attrib, 'cfrom', '')
         dmrs.cto = get_attr(dmrs_tag.attrib, 'cto', '')
@@ -1508,12 +1733,16 @@ class DMRSLayout(object):
             nid = int(node_tag.attrib['nodeid'])
             cfrom = int(node_tag.attrib['cfrom'])
             cto = int(node_tag.attrib['cto'])
-            surface = get_attr(node_tag.attrib, 'surface', '')
-            base = get_attr(node_tag.attrib, 'base', '')
-            carg = get_attr(node_tag.attrib, 'carg', '')
+            surface = get_attr(node_tag.attrib, 'surface', None)
+            base = get_attr(node_tag.attrib, 'base', None)
+            carg = get_attr(node_tag.attrib, 'carg', None)
             # TODO: parse sort info
             sortinfo_tag = node_tag.find("sortinfo")
-            sortinfo = SortInfo().update(sortinfo_tag.attrib) if sortinfo_tag is not None else None
+            sortinfo = None
+            if sortinfo_tag is not None:
+                # property names and values are shared by all nodes
+                sortinfo = SortInfo()
+                sortinfo.data = {sys.intern(k): sys.intern(v) for k, v in sortinfo_tag.attrib.items()}
             pred = None
             gpred_tag = node_tag.find("gpred")
             if gpred_tag is not None:
@@ -1522,9 +1751,9 @@ class DMRSLayout(object):
                 realpred_tag = node_tag.find("realpred")
                 if realpred_tag is not None:
                     lemma = get_attr(realpred_tag.attrib, 'lemma', '')
-                    pos = get_attr(realpred_tag.attrib, 'pos', '')
-                    sense = get_attr(realpred_tag.attrib, 'sense', '')
-                    pred = Predicate(Predicate.REALPRED, lemma, pos, sense)
+                    pos = get_attr(realpred_tag.attrib, 'pos', None)
+                    sense = get_attr(realpred_tag.attrib, 'sense', None)
+                    pred = Predicate(Predicate.REALPRED, lemma, sys.intern(pos) if pos else pos, sys.intern(sense) if sense else sense)
             temp_node = Node(nid, pred, cfrom=cfrom, cto=cto, sortinfo=sortinfo, surface=surface, base=base, carg=carg)
 
             # Parse sense info
@@ -1547,7 +1776,7 @@ class DMRSLayout(object):
                     temp_node.sense = sense_info
 
             # Completed parsing, add the node_tag to DMRS object
-            dmrs.nodes.append(temp_node)
+            dmrs.add_node(temp_node)
             # end for nodes
 
         # parse all links inside
@@ -1556,10 +1785,10 @@ class DMRSLayout(object):
             toNodeID = int(link_tag.attrib['to'])
             # TODO: parse post
             post_tag = link_tag.find("post")
-            post = post_tag.text if post_tag is not None else ''
+            post = sys.intern(post_tag.text) if post_tag is not None and post_tag.text else None
             rargname_tag = link_tag.find("rargname")
-            rargname = rargname_tag.text if rargname_tag is not None else ''
-            dmrs.links.append(Link(fromNodeID, toNodeID, rargname, post))
+            rargname = sys.intern(rargname_tag.text) if rargname_tag is not None and rargname_tag.text else None
+            dmrs.add_link(Link(fromNodeID, toNodeID, rargname, post))
         # finished, add dmrs object to reading
         return dmrs
 
@@ -1570,6 +1799,7 @@ class SortInfo(object):
                     'mood', 'prontype', 'prog', 'perf', 'ind'}
     ORDER = ['num', 'pers', 'gend', 'sf', 'tense', 'mood', 'prontype', 'prog', 'perf', 'ind']
     PRIVATE = ['ID', 'dmrs_nodeID', 'data']
+    __slots__ = PRIVATE
 
     """
     sortinfo of a Node
@@ -1579,18 +1809,11 @@ class SortInfo(object):
         object.__setattr__(self, "ID", None)
         object.__setattr__(self, "dmrs_nodeID", None)
         object.__setattr__(self, "data", {})
-        # known fields
-        self.cvarsort = cvarsort
-        self.num = num
-        self.pers = pers
-        self.gend = gend
-        self.sf = sf
-        self.tense = tense
-        self.mood = mood
-        self.prontype = prontype
-        self.prog = prog
-        self.perf = perf
-        self.ind = ind
+        # known fields (empty fields are not stored)
+        for k, v in (('cvarsort', cvarsort), ('num', num), ('pers', pers), ('gend', gend), ('sf', sf), ('tense', tense),
+                     ('mood', mood), ('prontype', prontype), ('prog', prog), ('perf', perf), ('ind', ind)):
+            if v:
+                self.data[k] = v
 
     def __str__(self):
         return self.to_string()
@@ -1604,9 +1827,11 @@ class SortInfo(object):
 
     def __getattr__(self, name):
         if name in SortInfo.PRIVATE:
-            return self.__dict__[name]
+            raise AttributeError(name)
         if name in self.data:
             return self.data[name]
+        elif name in SortInfo.KNOWN_FIELDS:
+            return ''
         else:
             return None
 
@@ -1620,11 +1845,13 @@ class SortInfo(object):
         return si
 
     def to_json(self):
-        j = {k: v for k, v in self.data.items() if v}
+        # known fields first
+        j = {k: self.data[k] for k in ['cvarsort'] + SortInfo.ORDER if self.data.get(k)}
+        j.update((k, v) for k, v in self.data.items() if v and k not in j)
         return j
 
     def to_string(self):
-        valdict = [(k, self.data[k]) for k in SortInfo.ORDER if self.data[k]]
+        valdict = [(k, self.data[k]) for k in SortInfo.ORDER if self.data.get(k)]
         extra = [(k, self.data[k]) for k in sorted(self.data.keys()) if k not in SortInfo.ORDER and k not in SortInfo.PRIVATE and self.data[k]]
         valdict.extend(extra)
         if self.cvarsort:
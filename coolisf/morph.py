@@ -11,6 +11,7 @@ DMRS transforming utility
 import os
 import logging
 from collections import defaultdict as dd
+from collections import namedtuple
 
 from texttaglib.chirptext import FileHelper
 
@@ -114,8 +115,10 @@ class Compound(object):
         self.lemma = self.pred_lemma(lemma)
         self._graph = None
         self._adjacent_nodes = None
+        self._signature = None
         self.adjacent = adjacent
         self.sign = self.head().predstr
+        self.constraints = {n.predstr for n in construction.nodes}
 
     def head(self):
         return self.construction.head()
@@ -129,6 +132,12 @@ class Compound(object):
             self._graph = self.head().to_graph()
         return self._graph
 
+    @property
+    def signature(self):
+        if self._signature is None:
+            self._signature = self.construction.signature()
+        return self._signature
+
     @property
     def adjacent_nodes(self):
         if self._adjacent_nodes is None:
@@ -137,11 +146,17 @@ class Compound(object):
 
     def match(self, dmrs):
         found = []
+        size = len(self.construction.nodes)
         for node in dmrs.nodes:
             if node.predstr == self.sign:
-                sub = dmrs.subgraph(node, constraints=self.construction)
+                # compare sizes and signatures before copying the candidate subgraph
+                candidate = dmrs.subgraph_nodes(node, constraints=self.constraints, max_size=size)
+                if candidate is None or len(candidate[0]) != size or dmrs.signature(candidate[0]) != self.signature:
+                    getLogger().debug("Not exactly matching")
+                    continue
+                sub = dmrs.subgraph(node, found=candidate)
                 getLogger().debug("matching {} to {}: sub={}".format(node.predstr, self.sign, sub.to_dmrs()))
-                if len(sub.nodes) == len(self.construction.nodes) and sub.top.to_graph() == self.graph:
+                if sub.top.to_graph() == self.graph:
                     if self.adjacent and self.adjacent_nodes != sub.adjacent_nodes():
                         getLogger().debug("Oh no, not adjacent - {} v.s {}".format(self.adjacent_nodes, sub.adjacent_nodes()))
                         continue
@@ -150,8 +165,9 @@ class Compound(object):
                     getLogger().debug("Not exactly matching")
         return found
 
-    def apply(self, dmrs):
-        matches = self.match(dmrs)
+    def apply(self, dmrs, matches=None):
+        if matches is None:
+            matches = self.match(dmrs)
         if not matches:
             getLogger().debug("No subgraph matched for {}".format(self))
         for sub in matches:
@@ -206,6 +222,82 @@ class SimpleHeadedCompound(Compound):
         return "SHComp(lemma={}, construction={})".format(repr(self.lemma), repr(self.construction.to_dmrs().to_mrs().tostring(False)))
 
 
+RuleEntry = namedtuple('RuleEntry', ('ID', 'lid', 'rid', 'head', 'preds', 'cargs', 'pred_cargs'))
+
+
+class RuleIndex(object):
+    """ In-memory index of the compound rules in a LexRuleDB.
+    Applicable rules for a set of DMRS nodes are found with set operations instead of SQL,
+    using the same conditions as LexRuleDB.find_ruleinfo()
+    """
+
+    DEFAULT_PREDS = ('udef_q', 'unknown')
+
+    def __init__(self):
+        self.by_head = dd(list)  # head pred -> [RuleEntry]
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.by_head.values())
+
+    def add(self, entry):
+        self.by_head[entry.head].append(entry)
+
+    @staticmethod
+    def build(rdb, restricted=True, ctx=None):
+        """ Compile all rules from a LexRuleDB """
+        index = RuleIndex()
+        rows = rdb.get_rulepreds(restricted=restricted, ctx=ctx)
+        entry = None
+        for row in rows:
+            if entry is None or entry[0] != row['ID']:
+                if entry is not None:
+                    index.add(RuleIndex._to_entry(*entry))
+                entry = (row['ID'], row['lid'], row['rid'], row['head'], [])
+            entry[4].append((row['pred'], row['carg']))
+        if entry is not None:
+            index.add(RuleIndex._to_entry(*entry))
+        getLogger().debug("Indexed {} rules".format(len(index)))
+        return index
+
+    @staticmethod
+    def _to_entry(ID, lid, rid, head, rulepreds):
+        return RuleEntry(ID, lid, rid, head,
+                         preds=frozenset(pred for pred, carg in rulepreds),
+                         cargs=frozenset(carg for pred, carg in rulepreds if carg is not None),
+                         pred_cargs=frozenset((pred, carg) for pred, carg in rulepreds if carg is not None))
+
+    def find(self, nodes, limit=None):
+        """ Find entries of rules that are applicable to nodes """
+        heads = set(self.DEFAULT_PREDS)
+        nocargs = set(self.DEFAULT_PREDS)
+        pred_cargs = set()
+        cargs = set()
+        for node in nodes:
+            pred_str = str(node.pred)
+            heads.add(pred_str)
+            if node.carg:
+                pred_cargs.add((pred_str, node.carg))
+                cargs.add(node.carg)
+            else:
+                nocargs.add(pred_str)
+        candidates = []
+        for head in heads:
+            candidates.extend(self.by_head.get(head, ()))
+        found = []
+        for entry in sorted(candidates, key=lambda x: x.ID):
+            # all preds of a rule must be available, at least one of them must be matched by a node
+            if not entry.preds <= heads:
+                continue
+            if entry.preds.isdisjoint(nocargs) and entry.pred_cargs.isdisjoint(pred_cargs):
+                continue
+            if cargs and not entry.cargs <= cargs:
+                continue
+            found.append(entry)
+            if limit and len(found) >= limit:
+                break
+        return found
+
+
 class Transformer(object):
 
     def __init__(self, ruledb_path=None):
@@ -215,7 +307,8 @@ class Transformer(object):
                       self.get_big_bad_wolf()]
         self.loaded = set()
         self.rule_map = dd(list)
-        self.rule_cache = {}
+        self.rule_cache = {}  # ruleinfo ID -> prebuilt rule (None if the rule could not be loaded)
+        self.rule_index = None
         if not ruledb_path:
             # read from config file if not provided
             self.cfg = read_config()
@@ -244,26 +337,49 @@ class Transformer(object):
     def to_hcmp_rule(self, layout, lemma, adjacent=True):
         return SimpleHeadedCompound(layout, lemma, adjacent)
 
+    def get_rule_index(self):
+        """ Compile the rule DB into a RuleIndex (only once) """
+        if self.rule_index is None and self.rdb is not None:
+            self.rule_index = RuleIndex.build(self.rdb)
+        return self.rule_index
+
+    def load_rule(self, entry, ctx=None):
+        """ Build the rule object of an indexed rule (only once) """
+        if entry.ID not in self.rule_cache:
+            rule = None
+            lexunit = self.rdb.get_rule(entry.lid, entry.rid, ctx=ctx)
+            if lexunit is not None:
+                lemma = lexunit.lemma.replace(' ', '+')
+                rule = self.to_hcmp_rule(lexunit[0].edit(), lemma)
+                if lexunit.ID not in self.loaded:
+                    self.loaded.add(lexunit.ID)
+                    self.add_rule(rule)
+            self.rule_cache[entry.ID] = rule
+        return self.rule_cache[entry.ID]
+
     def find_rules(self, nodes, limit=None):
         applicable_rules = []
         for node in nodes:
             applicable_rules.extend(self.rule_map[node.predstr])
         if self.rdb is None:
             return applicable_rules
-        with self.rdb.ctx() as ctx:
-            getLogger().debug("Searching for applicable rules for {} nodes: {}".format(len(nodes), nodes))
-            ruleinfos = self.rdb.find_ruleinfo(nodes, limit=limit, ctx=None)
-            getLogger().debug("Found {} rules".format(len(ruleinfos)))
-            for ruleinfo in ruleinfos:
-                ruleinfo = self.rdb.get_rule(ruleinfo.lid, ruleinfo.rid, ctx=ctx)
-                if ruleinfo is not None:
-                    lemma = ruleinfo.lemma.replace(' ', '+')
-                    rule = self.to_hcmp_rule(ruleinfo[0].edit(), lemma)
-                    if ruleinfo.ID not in self.loaded:
-                        self.loaded.add(ruleinfo.ID)
-                        self.add_rule(rule)
-                    # getLogger().debug("{} vs {}".format(rule.sign, node.predstr))
-                    applicable_rules.append(rule)
+        getLogger().debug("Searching for applicable rules for {} nodes: {}".format(len(nodes), nodes))
+        entries = self.get_rule_index().find(nodes, limit=limit)
+        getLogger().debug("Found {} rules".format(len(entries)))
+        if entries:
+            known = {id(rule) for rule in applicable_rules}
+            ctx = None
+            try:
+                for entry in entries:
+                    if entry.ID not in self.rule_cache and ctx is None:
+                        ctx = self.rdb.ctx()
+                    rule = self.load_rule(entry, ctx=ctx)
+                    if rule is not None and id(rule) not in known:
+                        known.add(id(rule))
+                        applicable_rules.append(rule)
+            finally:
+                if ctx is not None:
+                    ctx.close()
         getLogger().debug("Found {} rules in total".format(len(applicable_rules)))
         return applicable_rules
 
@@ -296,28 +412,49 @@ class Transformer(object):
         if isinstance(target, Reading) or isinstance(target, DMRS):
             return self.process(target.edit())
         else:
-            # target is a DMRSEditor
-            # collapse named compound
-            for node in target.nodes:
-                if node.predstr == "compound":
-                    arg1 = node['ARG1']
-                    if arg1 and Integral.is_named(arg1):
-                        # collapse compound
-                        Integral.collapse(arg1)
-            getLogger().debug("locating rules for nodes {}".format(target.nodes))
-            applicable_rules = self.find_rules(target.nodes)
-            # apply MWE rules
-            getLogger().debug("There are {} applicable rules for {}".format(len(applicable_rules), target.nodes))
-            for rule in applicable_rules:
-                rule.apply(target)
+            self.rewrite(target)
             return target
 
+    def rewrite(self, layout):
+        """ Collapse named compounds and apply MWE rules to a DMRSLayout in place.
+        Return True if the layout has been changed.
+        """
+        size = len(layout.nodes)
+        # collapse named compound
+        for node in layout.nodes:
+            if node.nodeid not in layout:
+                # deleted while collapsing a previous compound
+                continue
+            if node.predstr == "compound":
+                arg1 = node['ARG1']
+                if arg1 and Integral.is_named(arg1):
+                    # collapse compound
+                    Integral.collapse(arg1)
+        changed = len(layout.nodes) != size
+        getLogger().debug("locating rules for nodes {}".format(layout.nodes))
+        applicable_rules = self.find_rules(layout.nodes)
+        # apply MWE rules
+        getLogger().debug("There are {} applicable rules for {}".format(len(applicable_rules), layout.nodes))
+        for rule in applicable_rules:
+            matches = rule.match(layout)
+            if matches:
+                rule.apply(layout, matches=matches)
+                changed = True
+        return changed
+
     def apply(self, target):
         if isinstance(target, Sentence):
             for parse in target:
                 self.apply(parse)
             return target
+        elif isinstance(target, Reading) or isinstance(target, DMRS):
+            # edit the DMRS XML directly and only write it back when a rule has changed something
+            dmrs = target.dmrs() if isinstance(target, Reading) else target
+            layout = dmrs.edit()
+            if self.rewrite(layout):
+                layout.save()
+            return target
         else:
-            result = self.process(target)
-            result.save()
+            self.rewrite(target)
+            target.save()
             return target
@@ -18,6 +18,7 @@ from texttaglib.chirptext import ttl
 import coolisf
 from coolisf import GrammarHub
 from coolisf.model import Reading
+from coolisf.util import JSON_FORMATS
 
 # ---------------------------------------------------------------------
 # CONFIGURATION
@@ -81,6 +82,8 @@ def parse(request):
     parse_count = request.GET['parse_count']
     tagger = request.GET['tagger']
     grammar = request.GET['grammar']
+    # optional, comma-separated list of renderings (e.g. dmrs,latex)
+    formats = request.GET['formats'].split(',') if request.GET.get('formats') else None
 
     # validation
     if not sentence_text:
@@ -91,10 +94,13 @@ def parse(request):
         raise Http404('Unknown tagger: ' + tagger)
     elif grammar not in ghub.names:
         raise Http404('Unknown grammar')
+    elif formats and not set(formats).issubset(JSON_FORMATS):
+        raise Http404('Unknown format(s): ' + ','.join(set(formats).difference(JSON_FORMATS)))
 
     # Parse sentence
     logging.getLogger(__name__).info("Parsing sentence: ... " + sentence_text)
-    sent = ghub.parse_json(sentence_text, grammar, parse_count, tagger)
+    # run on the hub's event loop so that concurrent requests share the async ACE workers
+    sent = ghub.run(ghub.aparse_json(sentence_text, grammar, parse_count, tagger, formats=formats))
     logging.getLogger(__name__).debug("Shallow: {}".format(sent['shallow']))
     logging.getLogger(__name__).debug("Parses: {}".format(len(sent)))
     logging.getLogger(__name__).info("Done parsing")
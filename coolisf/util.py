@@ -22,6 +22,9 @@ from coolisf.model import Sentence, Document
 # ----------------------------------------------------------------------
 
 MY_DIR = os.path.dirname(os.path.abspath(__file__))
+SENT_FORMATS = ('xml', 'latex')
+PARSE_FORMATS = ('mrs', 'dmrs', 'mrs_raw', 'dmrs_raw')
+JSON_FORMATS = SENT_FORMATS + PARSE_FORMATS  # renderings which sent2json can produce
 
 
 def getLogger():
@@ -83,16 +86,22 @@ def read_ace_output(ace_output_file, top1dmrs=False):
     return doc
 
 
-def sent2json(sent, sentence_text=None, parse_count=-1, tagger='N/A', grammar='N/A'):
-    xml_str = sent.to_xml_str()
+def sent2json(sent, sentence_text=None, parse_count=-1, tagger='N/A', grammar='N/A', formats=None):
+    """ Convert a sentence into a JSON-ready dict.
+    formats: renderings to include (see JSON_FORMATS), all of them by default
+    """
+    if formats is None:
+        formats = JSON_FORMATS
     sent_json = {'sent': sentence_text if sentence_text else sent.text,
                  'parse_count': parse_count,
                  'tagger': tagger,
                  'grammar': grammar,
-                 'parses': [parse2json(x) for x in sent],
-                 'xml': xml_str,
-                 'latex': sent.to_latex(),
+                 'parses': [parse2json(x, formats) for x in sent],
                  'shallow': sent.shallow.to_json() if sent.shallow else {}}
+    if 'xml' in formats:
+        sent_json['xml'] = sent.to_xml_str()
+    if 'latex' in formats:
+        sent_json['latex'] = sent.to_latex()
     if sent.flag is not None:
         sent_json['flag'] = sent.flag
     if sent.comment is not None:
@@ -100,13 +109,19 @@ def sent2json(sent, sentence_text=None, parse_count=-1, tagger='N/A', grammar='N
     return sent_json
 
 
-def parse2json(parse):
-    return {'pid': parse.ID,
-            'ident': parse.rid,
-            'mrs': parse.mrs().json(),
-            'dmrs': parse.dmrs().json(),
-            'mrs_raw': parse.mrs().tostring(),
-            'dmrs_raw': parse.dmrs().tostring()}
+def parse2json(parse, formats=None):
+    if formats is None:
+        formats = PARSE_FORMATS
+    parse_json = {'pid': parse.ID, 'ident': parse.rid}
+    if 'mrs' in formats:
+        parse_json['mrs'] = parse.mrs().json()
+    if 'dmrs' in formats:
+        parse_json['dmrs'] = parse.dmrs().json()
+    if 'mrs_raw' in formats:
+        parse_json['mrs_raw'] = parse.mrs().tostring()
+    if 'dmrs_raw' in formats:
+        parse_json['dmrs_raw'] = parse.dmrs().tostring()
+    return parse_json
 
 
 # only alphanumeric characters are accepted in names
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""
+Shared word-sense disambiguation resources
+"""
+
+# This code is a part of coolisf library: https://github.com/letuananh/intsem.fx
+# :copyright: (c) 2014 Le Tuan Anh <tuananh.ke@gmail.com>
+# :license: MIT, see LICENSE for more details.
+
+import atexit
+import logging
+import weakref
+import threading
+
+from lelesk import LeLeskWSD
+from lelesk import LeskCache
+
+from coolisf.mappings import PredSense
+
+
+# ----------------------------------------------------------------------
+# Configuration
+# ----------------------------------------------------------------------
+
+def getLogger():
+    return logging.getLogger(__name__)
+
+
+# ----------------------------------------------------------------------
+
+def _release(wsd, ctx):
+    try:
+        wsd.disconnect()
+        ctx.close()
+    except Exception:
+        # e.g. collected in a thread which does not own the connections
+        getLogger().debug("Could not close WSD resources", exc_info=True)
+
+
+class _ThreadResources(object):
+    """ WSD resources of one thread, released when the thread's local data is collected """
+
+    __slots__ = ('wsd', 'ctx', 'finalizer', '__weakref__')
+
+    def __init__(self, wsd, ctx):
+        self.wsd = wsd
+        self.ctx = ctx
+        self.finalizer = weakref.finalize(self, _release, wsd, ctx)
+
+
+class WSDResources(object):
+    """ Process-wide owner of LeLeskWSD objects and WordNet connections.
+    SQLite connections cannot be shared between threads, so every thread gets its own
+    connected LeLeskWSD and WordNet context which are reused until close() is called.
+    """
+
+    __singleton = None
+    __singleton_lock = threading.Lock()
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get():
+        """ Get the shared resource manager of this process """
+        if WSDResources.__singleton is None:
+            with WSDResources.__singleton_lock:
+                if WSDResources.__singleton is None:
+                    WSDResources.__singleton = WSDResources()
+                    atexit.register(WSDResources.__singleton.close)
+        return WSDResources.__singleton
+
+    @staticmethod
+    def reset():
+        """ Forget the shared resource manager without closing its connections.
+        Used in forked worker processes, which must not reuse the connections of their parent.
+        """
+        # the lock may have been held by another thread of the parent at fork time
+        WSDResources.__singleton_lock = threading.Lock()
+        WSDResources.__singleton = None
+
+    def _resources(self):
+        res = getattr(self._local, 'resources', None)
+        if res is None:
+            getLogger().debug("Creating WSD resources for thread {}".format(threading.current_thread().name))
+            wsd = LeLeskWSD(dbcache=LeskCache())
+            wsd.connect()
+            res = _ThreadResources(wsd, PredSense.wn.ctx())
+            self._local.resources = res
+        return res
+
+    @property
+    def wsd(self):
+        """ A connected LeLeskWSD object for the current thread """
+        return self._resources().wsd
+
+    @property
+    def ctx(self):
+        """ A WordNet (PredSense.wn) context for the current thread """
+        return self._resources().ctx
+
+    def close(self):
+        """ Release all connections. Resources will be recreated on demand.
+        Only the resources of the current thread can be closed right away, resources of
+        other threads are released when they are collected (e.g. when their threads end).
+        """
+        with self._lock:
+            res = getattr(self._local, 'resources', None)
+            self._local = threading.local()
+        if res is not None:
+            res.finalizer()
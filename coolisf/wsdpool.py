@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""
+Process-parallel word-sense disambiguation
+"""
+
+# This code is a part of coolisf library: https://github.com/letuananh/intsem.fx
+# :copyright: (c) 2014 Le Tuan Anh <tuananh.ke@gmail.com>
+# :license: MIT, see LICENSE for more details.
+
+import logging
+import multiprocessing
+
+from lxml import etree
+
+from coolisf.model import Sentence
+from coolisf.wsd import WSDResources
+
+
+# ----------------------------------------------------------------------
+# Configuration
+# ----------------------------------------------------------------------
+
+CHUNK_SIZE = 8  # number of sentences sent to a worker at once
+
+
+def getLogger():
+    return logging.getLogger(__name__)
+
+
+# ----------------------------------------------------------------------
+
+def _init_worker():
+    # every worker opens its own LeLeskWSD and WordNet connections on demand
+    WSDResources.reset()
+
+
+def _tag_sent(task):
+    """ Tag a serialised sentence, return (DMRS XML strings, error message) """
+    sent_xml, method = task
+    try:
+        sent = Sentence.from_xml_str(sent_xml)
+        sent.tag_xml(method=method)
+        return [etree.tostring(reading.dmrs().xml(), encoding='unicode') for reading in sent], None
+    except Exception as e:
+        getLogger().exception("Could not tag sentence")
+        return None, "{}: {}".format(type(e).__name__, e)
+
+
+def update_readings(sent, dmrs_xmls, method):
+    """ Replace the DMRS of each reading of sent with tagged DMRS XML strings """
+    if len(dmrs_xmls) != len(sent):
+        raise Exception("Tagged sentence has {} readings (expected: {})".format(len(dmrs_xmls), len(sent)))
+    for reading, dmrs_xml in zip(sent, dmrs_xmls):
+        dmrs = reading.dmrs()
+        dmrs.reset(node=etree.XML(dmrs_xml))
+        dmrs.find_tags()
+        if method:
+            dmrs.tagged.add(method)
+
+
+class WSDPool(object):
+    """ Spread sentences across `jobs` worker processes for sense tagging.
+    Each worker holds its own LeLeskWSD and WordNet connections (see WSDResources).
+    Results are written back to the original Sentence objects in the original order.
+    """
+
+    def __init__(self, jobs, chunksize=CHUNK_SIZE):
+        if jobs < 1:
+            raise ValueError("Number of jobs must be a positive number (provided: {})".format(jobs))
+        self.jobs = jobs
+        self.chunksize = chunksize
+        self._pool = multiprocessing.Pool(jobs, initializer=_init_worker)
+
+    def tag(self, sents, method):
+        """ Tag sentences with method, yield (sentence, error message) in the original order """
+        sents = list(sents)
+        tasks = ((sent.to_xml_str(pretty_print=False), method) for sent in sents)
+        for sent, (dmrs_xmls, error) in zip(sents, self._pool.imap(_tag_sent, tasks, chunksize=self.chunksize)):
+            if error is None:
+                try:
+                    update_readings(sent, dmrs_xmls, method)
+                except Exception as e:
+                    error = "{}: {}".format(type(e).__name__, e)
+            yield sent, error
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._pool.terminate()
+            self._pool.join()
+        return False
@@ -42,7 +42,7 @@ from chirptext import chio
 
 from coolisf.lexsem import Lexsem, import_shallow, sort_eps
 from coolisf.gold_extract import read_gold_mrs
-from coolisf.model import Document
+from coolisf.model import Document, iter_sentences
 from coolisf.mappings import PredSense
 
 # ------------------------------------------------------------------------------
@@ -338,7 +338,6 @@ def find_lesk_candidates(cli, args):
 
 def isf_to_ukb(cli, args):
     ''' ISF to UKB '''
-    doc = Document.from_file(args.input)
     output = TextReport(args.output)
     tokenfile = TextReport(args.output + '.tokens.txt')
     report = TextReport(args.report)
@@ -346,7 +345,7 @@ def isf_to_ukb(cli, args):
     processed = 0
     if not args.ident:
         report.print("No ident was provided")
-    for idx, sent in enumerate(doc):
+    for idx, sent in enumerate(iter_sentences(args.input)):
         # sent = doc.by_ident(ident, default=None)
         if args.topk and idx > args.topk:
             break
@@ -36,7 +36,7 @@ import logging
 from chirptext import TextReport, Counter
 from chirptext.cli import CLIApp, setup_logging
 from chirptext import texttaglib as ttl
-from coolisf.model import Document
+from coolisf.model import Document, iter_sentences
 
 # ------------------------------------------------------------------------------
 # Configuration
@@ -67,7 +67,6 @@ def list_preds(cli, args):
 
 def doc_stats(cli, args):
     ''' Show document statistics '''
-    doc = Document.from_file(args.path)  # input
     output = TextReport(args.output)  # output
     stats = Counter()
     pred_counter = Counter()
@@ -75,10 +74,10 @@ def doc_stats(cli, args):
     unknown_preds = Counter()
     all_pos = Counter()
     not_found = None
-    if args.ttl:
-        ttl_doc = ttl.Document.read_ttl(args.ttl)
-        not_found = set(s.ID for s in ttl_doc).difference(s.ident for s in doc)
-    for sent in doc:
+    idents = set()
+    # sentences are streamed from the input file
+    for sent in iter_sentences(args.path):
+        idents.add(sent.ident)
         stats.count("Sentences")
         if not len(sent):
             stats.count("Sentences-empty")
@@ -103,6 +102,9 @@ def doc_stats(cli, args):
                 else:
                     stats.count("Known predicates")
                     pred_counter.count(n.predstr)
+    if args.ttl:
+        ttl_doc = ttl.Document.read_ttl(args.ttl)
+        not_found = set(s.ID for s in ttl_doc).difference(idents)
     output.header("Summary", level="h0")
     stats.summarise(output)
     output.header("Empty sentences")
@@ -24,7 +24,7 @@ from coolisf import GrammarHub
 from coolisf.gold_extract import export_to_visko, read_gold_mrs
 from coolisf.util import read_ace_output
 from coolisf.morph import Compound, Integral, Transformer, SimpleHeadedCompound as HCMP
-from coolisf.model import Sentence, MRS, Reading
+from coolisf.model import Sentence, MRS, Reading, Link
 
 # ------------------------------------------------------------------------------
 # CONFIGURATION
@@ -238,6 +238,25 @@ class TestTransformer(unittest.TestCase):
             comp.transform(se, m)
         self.assertEqual(se.top['ARG2'].predstr, "_guard+dog_n_1")
 
+    def test_signature(self):
+        comp = self.data.get_comp_rule()
+        se = self.data.get_sent().edit(0)
+        dog = next(n for n in se.nodes if n.predstr == comp.sign)
+        found = se.subgraph_nodes(dog, constraints=comp.constraints)
+        self.assertEqual(se.signature(found[0]), comp.signature)
+        self.assertEqual(se.subgraph(dog, found=found).signature(), comp.signature)
+        # to_graph() ignores out-links of the head, so must the signature
+        guard = next(n for n in se.nodes if n.predstr == '_guard_n_1')
+        se.add_link(Link(dog.nodeid, guard.nodeid, 'ARG1', 'NEQ'))
+        self.assertEqual(se.signature(se.subgraph_nodes(dog, constraints=comp.constraints)[0]), comp.signature)
+        self.assertEqual(len(comp.match(se)), 1)
+        # candidates which are too big are rejected without being copied
+        self.assertIsNone(se.subgraph_nodes(dog, max_size=3))
+        # green tea does not match guard dog
+        gt = self.data.get_green_tea().edit(0)
+        self.assertNotEqual(gt.signature(), comp.signature)
+        self.assertFalse(comp.match(gt))
+
     def test_green_tea(self):
         sent = Sentence("I like green tea.")
         sent.add("""[ TOP: h0 RELS: < [ pron<0:1> LBL: h1 ARG0: x6 [ x IND: + NUM: sg PERS: 1 PT: std ] ] [ pronoun_q<0:1> LBL: h2 ARG0: x6 RSTR: h10 ] [ _like_v_1<2:6> LBL: h3 ARG0: e7 [ e MOOD: indicative PERF: - PROG: - SF: prop TENSE: pres ] ARG1: x6 ARG2: x9 [ x NUM: sg PERS: 3 ] ] [ udef_q<7:17> LBL: h4 ARG0: x9 RSTR: h11 ] [ _green_a_2<7:12> LBL: h5 ARG0: e8 [ e MOOD: indicative PERF: - PROG: bool SF: prop TENSE: untensed ] ARG1: x9 ] [ _tea_n_1<13:17> LBL: h5 ARG0: x9 ] > HCONS: < h0 qeq h3 h10 qeq h1 h11 qeq h5 > ]""")
@@ -248,6 +267,23 @@ class TestTransformer(unittest.TestCase):
         self.assertEqual(preds, expected)
         # with a compound
 
+    def test_skip_untouched(self):
+        trans = Transformer(ruledb_path=None)
+        sent = Sentence("It rains.")
+        sent.add("""[ TOP: h0 INDEX: e2 [ e SF: prop TENSE: pres MOOD: indicative PROG: - PERF: - ] RELS: < [ _rain_v_1<3:9> LBL: h1 ARG0: e2 ] > HCONS: < h0 qeq h1 > ]""")
+        dmrs = sent[0].dmrs()
+        xml_node = dmrs.xml()
+        mrs = sent[0].mrs()
+        trans.apply(sent)
+        # no rule was applied, nothing should be converted
+        self.assertIs(sent[0].dmrs().xml(), xml_node)
+        self.assertIs(sent[0].mrs(), mrs)
+        # an edited DMRS is written back as XML directly
+        gt = self.data.get_green_tea()
+        trans.apply(gt)
+        self.assertEqual(gt[0].dmrs().xml().find('node/realpred').get('lemma'), 'green+tea')
+        self.assertIn('_green+tea_n_1', gt[0].mrs().tostring(False))
+
     def test_all(self):
         parse = Reading("""[ TOP: h0
   INDEX: e2 [ e SF: prop TENSE: pres MOOD: indicative PROG: - PERF: - ]
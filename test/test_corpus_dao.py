@@ -12,6 +12,7 @@ Test Corpus DAO
 import os
 import logging
 import unittest
+import threading
 
 from texttaglib.chirptext import ttl
 from coolisf.util import sent2json
@@ -25,6 +26,8 @@ from coolisf.model import Document, Sentence
 
 from test import TEST_DATA
 DB_FILE = os.path.join(TEST_DATA, 'test_corpus.db')
+POOL_DB_FILE = os.path.join(TEST_DATA, 'test_pool.db')
+OLD_DB_FILE = os.path.join(TEST_DATA, 'test_old_schema.db')
 
 
 def getLogger():
@@ -228,6 +231,150 @@ class TestDMRSSQLite(TestDAOBase):
             self.assertEqual(len(page2), 20)
             self.assertEqual(page2[0].ID, 31)
             self.assertEqual(page2[-1].ID, 50)
+            # keyset pagination
+            page2 = self.db.get_sents(sent.docID, after_id=30, pagesize=30, ctx=ctx)
+            self.assertEqual([s.ID for s in page2], list(range(31, 51)))
+            page1 = self.db.get_sents(sent.docID, before_id=31, pagesize=30, ctx=ctx)
+            self.assertEqual([s.ID for s in page1], list(range(1, 31)))
+            self.assertEqual(len(page1[0]), 2)
+            self.assertEqual(len(page1[1]), 1)
+            # cursor
+            sents = list(self.db.iter_sents(sent.docID, batch_size=7, ctx=ctx))
+            self.assertEqual([s.ID for s in sents], list(range(1, 51)))
+            self.assertEqual(sents[0][1].dmrs().preds(), sent[1].dmrs().preds())
+            self.assertEqual(sents[49][0].dmrs().preds(), sent[0].dmrs().preds())
+
+    def test_get_readings(self):
+        db = CorpusDAOSQLite(":memory:", "readingdb")
+        with db.ctx() as ctx:
+            sent = self.ensure_sent(db, ctx)
+            for idx in range(9):
+                new_sent = Sentence(sent.text)
+                for reading in sent[:idx % 2 + 1]:
+                    new_sent.add(reading.mrs().tostring())
+                new_sent.docID = sent.docID
+                db.save_sent(new_sent, ctx=ctx)
+            sents = db.get_sents(sent.docID, ctx=ctx)
+            self.assertEqual([len(s) for s in sents], [2] + [1, 2] * 4 + [1])
+            # readings of many sentences are loaded with a few queries
+            readings = [r for s in sents for r in db.get_sent(s.ID, skip_details=True, ctx=ctx)]
+            queries = []
+            ctx.conn.set_trace_callback(queries.append)
+            db.get_readings(readings, ctx=ctx)
+            ctx.conn.set_trace_callback(None)
+            self.assertLessEqual(len(queries), 6)
+            for r in readings:
+                expected = db.get_sent(r.sentID, readingIDs=[r.ID], ctx=ctx)[0]
+                self.assertEqual(r.dmrs().preds(), expected.dmrs().preds())
+                self.assertEqual(r.dmrs().tags.keys(), expected.dmrs().tags.keys())
+                self.assertEqual(len(r.dmrs().layout.links), len(expected.dmrs().layout.links))
+                self.assertEqual(r.dmrs().layout.nodes[0].sortinfo.to_json(), expected.dmrs().layout.nodes[0].sortinfo.to_json())
+
+    def test_search(self):
+        db = CorpusDAOSQLite(":memory:", "searchdb")
+        with db.ctx() as ctx:
+            sent = self.ensure_sent(db, ctx)
+            cats = Sentence("I love cats.", docID=sent.docID)
+            db.save_sent(cats, ctx=ctx)
+            doc = self.ensure_corpus(db, ctx).new('bulkdoc')
+            bulk_sent = Sentence(sent.text)
+            bulk_sent.add(sent[1].mrs().tostring())
+            doc.add(bulk_sent)
+            db.save_doc_bulk(doc, ctx=ctx)
+            # full-text search
+            self.assertEqual([s.ID for s in db.search_sents(text='love', ctx=ctx)], [sent.ID, cats.ID, bulk_sent.ID])
+            self.assertEqual([s.ID for s in db.search_sents(text='cats', ctx=ctx)], [cats.ID])
+            self.assertEqual([s.ID for s in db.search_sents(text='love', docID=doc.ID, ctx=ctx)], [bulk_sent.ID])
+            # predicate search
+            found = db.search_sents(pred='_love_v_1', ctx=ctx)
+            self.assertEqual([s.ID for s in found], [sent.ID, bulk_sent.ID])
+            self.assertEqual([r.ID for r in found[0]], [r.ID for r in sent])
+            self.assertEqual(found[1].doc.name, 'bulkdoc')
+            found = db.search_sents(pred='_love_v_1', synsetid='01775164-v', ctx=ctx)
+            self.assertEqual([(s.ID, [r.ID for r in s]) for s in found], [(sent.ID, [sent[0].ID])])
+            self.assertEqual(db.search_sents(lemma='love', text='cats', ctx=ctx), [])
+            # comments and readings
+            db.note_sentence(sent.ID, 'a comment', ctx=ctx)
+            found = db.search_sents(synsetid='01775164-v', with_comment=True, with_readings=True, ctx=ctx)
+            self.assertEqual(found[0].comment, 'a comment')
+            self.assertEqual(found[0][0].dmrs().preds(), sent[0].dmrs().preds())
+            # hand-built rows only need sentID and readingID
+            rows = [{'sentID': cats.ID, 'readingID': None}, {'sentID': sent.ID, 'readingID': sent[1].ID}]
+            found = db.build_search_result(rows, ctx=ctx)
+            self.assertEqual([(s.ID, s.text, s.doc.name, s.comment) for s in found],
+                             [(cats.ID, cats.text, self.doc_name, None), (sent.ID, sent.text, self.doc_name, 'a comment')])
+            self.assertEqual([r.ID for r in found[1]], [sent[1].ID])
+            # index is updated with readings
+            r = sent[1]
+            r.dmrs().layout.delete(10002)
+            db.update_reading(r, ctx=ctx)
+            found = db.search_sents(pred='_love_v_1', ctx=ctx)
+            self.assertEqual([r.ID for r in found[0]], [sent[0].ID])
+            db.delete_sent(bulk_sent.ID, ctx=ctx)
+            self.assertEqual([s.ID for s in db.search_sents(lemma='love', ctx=ctx)], [sent.ID])
+            self.assertEqual([s.ID for s in db.search_sents(text='love', ctx=ctx)], [sent.ID, cats.ID])
+            # rebuild
+            db.rebuild_search_index(ctx=ctx)
+            found = db.search_sents(pred='_love_v_1', ctx=ctx)
+            self.assertEqual([(s.ID, [r.ID for r in s]) for s in found], [(sent.ID, [sent[0].ID])])
+
+    def test_upgrade_schema(self):
+        if os.path.isfile(OLD_DB_FILE):
+            os.unlink(OLD_DB_FILE)
+        db = CorpusDAOSQLite(OLD_DB_FILE, "olddb")
+        with db.ctx() as ctx:
+            sent = self.ensure_sent(db, ctx)
+            # remove everything that was added after the first schema version
+            ctx.cur.executescript("""DROP TABLE pred_index;
+                                     DROP TABLE IF EXISTS sentence_fts;
+                                     DROP TRIGGER IF EXISTS "sentence_fts_|_insert";
+                                     DROP TRIGGER IF EXISTS "sentence_fts_|_delete";
+                                     DROP TRIGGER IF EXISTS "sentence_fts_|_update";
+                                     DROP INDEX "sentence_|_docID_flag_ID";""")
+        # the missing tables and indexes are created on first use
+        db = CorpusDAOSQLite(OLD_DB_FILE, "olddb")
+        cats = db.save_sent(Sentence("I love cats.", docID=sent.docID))
+        with db.ctx() as ctx:
+            names = {row['name'] for row in ctx.execute("SELECT name FROM sqlite_master")}
+            self.assertIn('pred_index', names)
+            self.assertIn('sentence_|_docID_flag_ID', names)
+        self.assertEqual([s.ID for s in db.search_sents(pred='_love_v_1')], [sent.ID])
+        self.assertEqual([s.ID for s in db.search_sents(text='love')], [sent.ID, cats.ID])
+        db.delete_sent(sent.ID)
+        self.assertEqual(db.search_sents(lemma='love'), [])
+        os.unlink(OLD_DB_FILE)
+
+    def test_save_doc_bulk(self):
+        db = CorpusDAOSQLite(":memory:", "bulkdb")
+        with db.ctx() as ctx:
+            db.save_sent(self.ensure_sent(db, ctx), ctx=ctx)
+            sent = db.get_sent(1, ctx=ctx)
+            corpus = self.ensure_corpus(db, ctx)
+            doc = corpus.new('bulkdoc')
+            for idx in range(20):
+                new_sent = Sentence(sent.text)
+                for reading in sent:
+                    new_sent.add(reading.mrs().tostring())
+                new_sent[0].dmrs().tag_node(10002, '01775164-v', 'love', ttl.Tag.GOLD)
+                doc.add(new_sent)
+            db.save_doc_bulk(doc, fast=True, ctx=ctx)
+            self.assertTrue(ctx.auto_commit)
+            self.assertEqual(ctx.select_scalar('PRAGMA synchronous'), 2)
+            sents = db.get_sents(doc.ID, ctx=ctx)
+            self.assertEqual([s.ID for s in sents], [s.ID for s in doc])
+            self.assertEqual(sents[0].ident, str(sents[0].ID))
+            for new_sent in doc:
+                s2 = db.get_sent(new_sent.ID, ctx=ctx)
+                self.assertEqual(len(s2), len(sent))
+                for r1, r2 in zip(sent, s2):
+                    self.assertEqual(r2.dmrs().preds(), r1.dmrs().preds())
+                    self.assertEqual(len(r2.dmrs().layout.links), len(r1.dmrs().layout.links))
+                self.assertEqual(s2[0].dmrs().tags[10002][0].synset.ID.to_canonical(), '01775164-v')
+            # values are shared with the sentence that was saved before
+            self.assertEqual(ctx.select_scalar('SELECT COUNT(*) FROM dmrs_node_realpred_lemma WHERE lemma = ?', ('love',)), 1)
+            # a second call does not duplicate saved sentences
+            db.save_doc_bulk(doc, ctx=ctx)
+            self.assertEqual(len(db.get_sents(doc.ID, ctx=ctx)), 20)
 
 
 class TestCorpusManagement(TestDAOBase):
@@ -355,6 +502,66 @@ class TestHumanAnnotation(TestDAOBase):
             self.assertEqual(dao.next_sentid(5, Sentence.WARNING, ctx=ctx), None)
             self.assertEqual(dao.prev_sentid(5, Sentence.WARNING, ctx=ctx), 2)
             self.assertEqual(dao.prev_sentid(2, Sentence.WARNING, ctx=ctx), None)
+            self.assertEqual(dao.get_sent_neighbours(4, ctx=ctx), (2, 5))
+            self.assertEqual(dao.get_sent_neighbours(4, Sentence.WARNING, ctx=ctx), (2, 5))
+            self.assertEqual(dao.get_sent_neighbours(100, ctx=ctx), (None, None))
+
+
+class TestConnectionPool(TestDAOBase):
+
+    def test_pooled_dao(self):
+        if os.path.isfile(POOL_DB_FILE):
+            os.unlink(POOL_DB_FILE)
+        db = CorpusDAOSQLite(POOL_DB_FILE, "pooldb").use_pool(timeout=10)
+        self.assertTrue(db.pooled)
+        self.assertRaises(ValueError, CorpusDAOSQLite(":memory:").use_pool)
+        # one connection per thread
+        with db.ctx() as ctx:
+            self.assertEqual(ctx.select_scalar('PRAGMA journal_mode'), 'wal')
+            self.assertEqual(ctx.select_scalar('PRAGMA busy_timeout'), 10000)
+            self.assertIs(db.ctx(), ctx)
+            doc = self.ensure_doc(db, ctx)
+        conns = []
+
+        def work(idx):
+            conns.append(db.ctx().conn)
+            db.save_sent(Sentence("Sentence #{}".format(idx), docID=doc.ID))
+            db.close_pool()
+        workers = [threading.Thread(target=work, args=(idx,)) for idx in range(4)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        self.assertEqual(len({id(c) for c in conns}), 4)
+        self.assertNotIn(db.ctx().conn, conns)
+        self.assertEqual(len(db.get_sents(doc.ID)), 4)
+        # concurrent bulk imports never pick the same IDs
+        docs = [Document('bulk{}'.format(idx), corpusID=doc.corpusID) for idx in range(4)]
+        for idx, bulk_doc in enumerate(docs):
+            db.save_doc(bulk_doc)
+            for sidx in range(5):
+                bulk_doc.new("Bulk sentence #{}.{}".format(idx, sidx))
+
+        def bulk_work(bulk_doc):
+            db.save_doc_bulk(bulk_doc)
+            db.close_pool()
+        workers = [threading.Thread(target=bulk_work, args=(bulk_doc,)) for bulk_doc in docs]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        for bulk_doc in docs:
+            self.assertEqual([s.ID for s in db.get_sents(bulk_doc.ID)], [s.ID for s in bulk_doc])
+        # a failed transaction is rolled back
+        with self.assertRaises(ZeroDivisionError):
+            with db.ctx() as ctx:
+                ctx.auto_commit = False
+                db.save_sent(Sentence("Lost", docID=doc.ID), ctx=ctx)
+                1 / 0
+        self.assertTrue(db.ctx().auto_commit)
+        self.assertEqual(len(db.get_sents(doc.ID)), 4)
+        db.close_pool()
+        os.unlink(POOL_DB_FILE)
 
 
 ########################################################################
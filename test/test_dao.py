@@ -11,13 +11,19 @@ Test DAO
 
 import os
 import logging
+import sqlite3
+import tempfile
 import unittest
 
 from coolisf import GrammarHub
 from coolisf.dao import read_tsdb
 from coolisf.dao.ruledb import LexRuleDB, parse_lexunit, PredInfo, RulePred
-from coolisf.model import LexUnit, RuleInfo
+from coolisf.model import LexUnit, RuleInfo, MRS, Sentence, Node
+from coolisf.morph import RuleIndex
 from coolisf.dao.textcorpus import RawCollection
+from coolisf.common import LRUCache
+from coolisf.dao.cache import AceCache, ISFCache, cache_key, AC_INIT_SCRIPT
+from coolisf.util import sent2json
 
 # -----------------------------------------------------------------------
 # CONFIGURATION
@@ -105,6 +111,148 @@ class TestRawData(unittest.TestCase):
         self.assertEqual(sent_texts, expected)
 
 
+class TestCacheDAO(unittest.TestCase):
+
+    def test_cache_key(self):
+        self.assertEqual(cache_key('It rains.', 'ERG', 5, None), cache_key('It rains.', 'ERG', '5', None))
+        self.assertNotEqual(cache_key('It rains.', 'ERG', None, None), cache_key('It rains.', 'ERG', 'None', None))
+        self.assertNotEqual(cache_key('It rains.', 'ERG', 5, None), cache_key('It rains.', 'JACY', 5, None))
+
+    def test_upgrade_ace_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_path = os.path.join(tmpdir, 'ace_cache.db')
+            # create a cache DB without key column
+            with open(AC_INIT_SCRIPT) as script:
+                old_script = script.read().replace('CREATE UNIQUE INDEX sent_key ON sent(key);', '')
+            old_script = '\n'.join(l for l in old_script.splitlines() if not l.strip().startswith('key '))
+            conn = sqlite3.connect(db_path)
+            conn.executescript(old_script)
+            for mrs in ('first', 'second'):
+                sid = conn.execute("INSERT INTO sent (text, grm, pc) VALUES ('It rains.', 'ERG', 5)").lastrowid
+                conn.execute("INSERT INTO mrs (sid, mrs) VALUES (?, ?)", (sid, mrs))
+            conn.commit()
+            conn.close()
+            cache = AceCache(db_path)
+            self.assertFalse(cache.upgrade())
+            with cache.ctx() as ctx:
+                rows = ctx.sent.select()
+                self.assertEqual(len(rows), 1)
+                self.assertEqual(rows[0].key, cache.build_key('It rains.', 'ERG', 5, None))
+                self.assertEqual([m.mrs for m in ctx.mrs.select()], ['second'])
+                plan = ctx.select('EXPLAIN QUERY PLAN SELECT * FROM sent WHERE key = ?', ('x',))
+                self.assertIn('sent_key', ' '.join(str(r[-1]) for r in plan))
+
+    def test_isf_cache_key(self):
+        cache = ISFCache(':memory:')
+        with cache.ctx() as ctx:
+            cache.clear_key(cache.build_key('It rains.', 'ERG', 5, None), ctx=ctx)
+            self.assertIsNone(cache.load('It rains.', 'ERG', 5, None, ctx=ctx))
+
+    def test_lru(self):
+        lru = LRUCache(max_entries=2, max_size=10)
+        lru.put('a', 1, size=4)
+        lru.put('b', 2, size=4)
+        self.assertEqual(lru.get('a'), 1)
+        lru.put('c', 3, size=4)  # evict b (least recently used)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('c'), 3)
+        self.assertFalse(lru.put('d', 4, size=11))
+        stats = lru.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (2, 1, 1))
+        self.assertEqual((stats['entries'], stats['size']), (2, 8))
+
+    def test_isf_memcache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = ISFCache(os.path.join(tmpdir, 'isf_cache.db'))
+            lru = LRUCache(max_entries=10)
+            cache.set_memcache(lru, 'ERG')
+            sent = Sentence('It rains.')
+            sent.add('[ LTOP: h0 INDEX: e2 RELS: < [ _rain_v_1<3:9> LBL: h1 ARG0: e2 ] > HCONS: < h0 qeq h1 > ]')
+            cache.save('It rains.', 'ERG', 1, None, sent)
+            s1 = cache.load('It rains.', 'ERG', 1, None)
+            s2 = cache.load('It rains.', 'ERG', 1, None)
+            self.assertEqual(s1, s2)
+            self.assertEqual(lru.stats()['hits'], 1)
+            # other grammars are not cached in memory
+            self.assertIsNone(cache.get_memcache('JACY'))
+
+    def test_isf_cache_formats(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = ISFCache(os.path.join(tmpdir, 'isf_cache.db'))
+            sent = Sentence('It rains.')
+            sent.add('[ LTOP: h0 INDEX: e2 RELS: < [ _rain_v_1<3:9> LBL: h1 ARG0: e2 ] > HCONS: < h0 qeq h1 > ]')
+            expected = sent2json(sent, 'It rains.', 1, None, 'ERG')
+            cache.save('It rains.', 'ERG', 1, None, sent, renderings=sent2json(sent, 'It rains.', 1, None, 'ERG', formats=['dmrs']))
+            with cache.ctx() as ctx:
+                self.assertEqual([r.format for r in ctx.rendering.select()], ['dmrs'])
+            j = cache.load('It rains.', 'ERG', 1, None, formats=['dmrs'])
+            self.assertNotIn('latex', j)
+            self.assertEqual(j['parses'][0]['dmrs'], expected['parses'][0]['dmrs'])
+            # other formats are derived from the stored XML and memoized
+            j = cache.load('It rains.', 'ERG', 1, None)
+            for fmt in ('xml', 'latex'):
+                self.assertEqual(j[fmt], expected[fmt])
+            self.assertEqual(j['parses'][0]['mrs_raw'], expected['parses'][0]['mrs_raw'])
+            with cache.ctx() as ctx:
+                self.assertEqual(len(ctx.rendering.select()), 5)
+
+    def test_ace_cache_bulk(self):
+        mrs = '[ LTOP: h0 INDEX: e2 RELS: < [ _rain_v_1<3:9> LBL: h1 ARG0: e2 ] > HCONS: < h0 qeq h1 > ]'
+        texts = ['It rains.', 'It pours.', 'It drizzles.']
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = AceCache(os.path.join(tmpdir, 'ace_cache.db'))
+            with cache.ctx() as ctx:
+                cache.save_many([(t, [MRS(mrs)] * (i + 1)) for i, t in enumerate(texts[:2])], 'ERG', 5, None, ctx=ctx)
+                # overwrite an existing entry
+                cache.save_many([(texts[0], [MRS(mrs)])], 'ERG', 5, None, ctx=ctx)
+                found = cache.load_many(texts, 'ERG', 5, None, ctx=ctx)
+                self.assertEqual(set(found.keys()), set(texts[:2]))
+                self.assertEqual(len(found['It rains.']), 1)
+                self.assertEqual(len(found['It pours.']), 2)
+                self.assertEqual(found['It pours.'][0].mrs().raw, mrs)
+                self.assertEqual(ctx.select_scalar('SELECT COUNT(*) FROM mrs'), 3)
+
+    def test_isf_cache_eviction(self):
+        mrs = '[ LTOP: h0 INDEX: e2 RELS: < [ _rain_v_1<3:9> LBL: h1 ARG0: e2 ] > HCONS: < h0 qeq h1 > ]'
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = ISFCache(os.path.join(tmpdir, 'isf_cache.db'), compress=True)
+            for i in range(10):
+                s = Sentence('It rains {}.'.format(i))
+                s.add(mrs)
+                cache.save(s.text, 'ERG', 1, None, s)
+            j = cache.load('It rains 3.', 'ERG', 1, None)
+            self.assertTrue(j['xml'].startswith('<sentence'))
+            self.assertEqual(len(j['parses']), 1)
+            # keep half of the cache, recently accessed entries survive
+            cache.max_size = cache.total_size() // 2
+            cache.load('It rains 0.', 'ERG', 1, None)
+            self.assertGreater(cache.evict(), 0)
+            self.assertLessEqual(cache.total_size(), cache.max_size)
+            self.assertIsNotNone(cache.load('It rains 0.', 'ERG', 1, None))
+            self.assertIsNone(cache.load('It rains 1.', 'ERG', 1, None))
+            size_before, size_after = cache.compact()
+            self.assertLessEqual(size_after, size_before)
+
+    def test_isf_cache_last_access(self):
+        mrs = '[ LTOP: h0 INDEX: e2 RELS: < [ _rain_v_1<3:9> LBL: h1 ARG0: e2 ] > HCONS: < h0 qeq h1 > ]'
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # access times are tracked without max_size, including memory hits
+            cache = ISFCache(os.path.join(tmpdir, 'isf_cache.db'))
+            cache.set_memcache(LRUCache(max_entries=10), 'ERG')
+            for i in range(10):
+                s = Sentence('It rains {}.'.format(i))
+                s.add(mrs)
+                cache.save(s.text, 'ERG', 1, None, s)
+            cache.load('It rains 0.', 'ERG', 1, None)
+            cache.load('It rains 1.', 'ERG', 1, None)
+            cache.load('It rains 0.', 'ERG', 1, None)  # from memory
+            self.assertEqual(cache.get_memcache('ERG').stats()['hits'], 1)
+            with cache.ctx() as ctx:
+                # only one entry fits
+                cache.evict(max_size=ctx.select_scalar("SELECT size FROM sent WHERE raw = 'It rains 0.'"), ctx=ctx)
+                self.assertEqual([r.raw for r in ctx.sent.select()], ['It rains 0.'])
+
+
 class TestRuleDB(unittest.TestCase):
 
     ghub = GrammarHub()
@@ -175,6 +323,33 @@ class TestRuleDB(unittest.TestCase):
                 lu = self.rdb.get_lexunit(lu, ctx=ctx)
                 print("Potential: {} -> {}".format(ri, lu))
 
+    def test_rule_index(self):
+        rdb = LexRuleDB(':memory:')
+        rules = [('_tea_n_1', [('_green_a_2', None), ('_tea_n_1', None)]),
+                 ('_tea_n_1', [('udef_q', None), ('compound', None), ('_herb_n_1', None), ('_tea_n_1', None)]),
+                 ('named', [('named', 'Sherlock'), ('named', 'Holmes'), ('compound', None), ('proper_q', None)]),
+                 ('named', [('named', 'Robin'), ('named', 'Hood'), ('compound', None), ('proper_q', None)]),
+                 ('_look_v_up', [('_look_v_up', None)])]
+        with rdb.ctx() as ctx:
+            lid = ctx.lexunit.save(LexUnit(lemma='test', pos='n', flag=LexUnit.MWE))
+            for idx, (head, preds) in enumerate(rules):
+                ruleid = ctx.ruleinfo.save(RuleInfo(lid=lid, rid=idx + 1, head=head, flag=RuleInfo.COMPOUND))
+                for pred_str, carg in preds:
+                    predinfo = ctx.predinfo.select_single('pred = ?', (pred_str,))
+                    predid = predinfo.ID if predinfo else ctx.predinfo.save(PredInfo(pred=pred_str))
+                    ctx.rulepred.save(RulePred(ruleid=ruleid, predid=predid, carg=carg))
+            index = RuleIndex.build(rdb, ctx=ctx)
+            self.assertEqual(len(index), len(rules))
+            sents = [[('udef_q', None), ('_green_a_2', None), ('_tea_n_1', None), ('_drink_v_1', None)],
+                     [('named', 'Sherlock'), ('named', 'Holmes'), ('compound', None), ('proper_q', None), ('_tea_n_1', None)],
+                     [('named', 'Robin'), ('named', 'Holmes'), ('compound', None), ('proper_q', None)],
+                     [('_look_v_1', None)]]
+            for preds in sents:
+                nodes = [Node(10000 + idx, pred_str, carg=carg) for idx, (pred_str, carg) in enumerate(preds)]
+                expected = sorted(r.ID for r in rdb.find_ruleinfo(nodes, ctx=ctx))
+                self.assertEqual([e.ID for e in index.find(nodes)], expected)
+            self.assertEqual([e.rid for e in index.find([Node(10000, '_green_a_2'), Node(10001, '_tea_n_1')])], [1])
+
     def test_get_rule(self):
         rdb = LexRuleDB(':memory:')
         with rdb.ctx() as ctx:
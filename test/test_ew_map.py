@@ -12,10 +12,13 @@ Test ERG-Wordnet mapping
 import os
 import unittest
 import logging
+import tempfile
 
 from coolisf.ergex import read_erg_lex, find_mwe
 from coolisf.mappings import PredSense
+from coolisf.mappings.predindex import PredSenseIndex
 from coolisf.model import Reading, Predicate
+from coolisf.common import LRUCache
 from coolisf import GrammarHub
 
 # ------------------------------------------------------------------------------
@@ -219,6 +222,54 @@ class TestMain(unittest.TestCase):
         self.assertTrue(PredSense.search_ep(_car_n_1))
         # TODO: Fix card mapping
 
+    def test_pred_index(self):
+        preds = ['_bark_v_1', '_quick_a_1', '_green+tea_n_1', 'neg_rel', 'named_rel']
+        index = PredSense.build_index(preds=preds)
+        self.assertIn('_bark_v_1_rel', index)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'predsense_index.json.gz')
+            index.save(path)
+            index = PredSenseIndex.load(path)
+        for pred in preds:
+            expected = PredSense.search_pred_string(pred, use_index=False)
+            actual = index.get_pred(pred)
+            self.assertEqual([(s.ID, s.lemma, s.tagcount) for s in actual], [(s.ID, s.lemma, s.tagcount) for s in expected])
+        self.assertIsNone(index.get_pred('_not+indexed_n_1'))
+        self.assertIsNotNone(index.get_adjective('_quick_a_1', 'r'))
+
+    def test_search_cache(self):
+        hits = PredSense.cache_info()['hits']
+        ss = PredSense.search_sense(('dog',), 'n')
+        self.assertTrue(ss)
+        # the same frozen collection is shared instead of being copied
+        self.assertIs(PredSense.search_sense(('dog',), 'n'), ss)
+        self.assertEqual(PredSense.cache_info()['hits'], hits + 1)
+        self.assertRaises(TypeError, lambda: ss.merge(PredSense.search_sense(('cat',), 'n')))
+
+    def test_prefetch(self):
+        r = Reading("""[ TOP: h0 RELS: < [ _the_q<0:3> LBL: h4 ARG0: x3 RSTR: h5 ] [ _quick_a_1<4:9> LBL: h7 ARG0: e8 ARG1: x3 ] [ _dog_n_1<10:13> LBL: h7 ARG0: x3 ] [ _bark_v_1<14:20> LBL: h1 ARG0: e2 ARG1: x3 ] > HCONS: < h0 qeq h1 h5 qeq h7 > ]""")
+        eps = r.dmrs().get_lexical_preds()
+        PredSense.set_search_cache(LRUCache())
+        expected = [[(s.ID, s.lemma, s.tagcount) for s in PredSense.search_ep(ep, use_index=False)] for ep in eps]
+        PredSense.set_search_cache(LRUCache())
+        PredSense.lemma_cache.clear()
+        self.assertTrue(PredSense.prefetch(eps, use_index=False))
+        self.assertIn('dog', PredSense.lemma_cache)
+        actual = [[(s.ID, s.lemma, s.tagcount) for s in PredSense.search_ep(ep, use_index=False)] for ep in eps]
+        self.assertEqual(actual, expected)
+        # already fetched
+        self.assertEqual(PredSense.prefetch(eps, use_index=False), 0)
+
+    def test_prefetch_order(self):
+        # prefetched senses must come in the same order as wn.search() (first sense wins MFS ties)
+        lemmas = ('dog', 'bark', 'quick', 'Dog', 'nosuchword')
+        PredSense.lemma_cache.clear()
+        expected = [[ss.ID for ss in PredSense.wn.search(x)] for x in lemmas]
+        PredSense.prefetch_lemmas(lemmas)
+        self.assertIn('nosuchword', PredSense.lemma_cache)
+        actual = [[ss.ID for ss in PredSense.search_lemma(x)] for x in lemmas]
+        self.assertEqual(actual, expected)
+
 
 ########################################################################
 
@@ -9,6 +9,7 @@ Test script for ghub
 # :copyright: (c) 2014 Le Tuan Anh <tuananh.ke@gmail.com>
 # :license: MIT, see LICENSE for more details.
 
+import asyncio
 import unittest
 import logging
 
@@ -139,6 +140,32 @@ class TestGrammarHub(unittest.TestCase):
             self.assertEqual(text, sent.text)
             self.assertGreater(len(sent), 0)
 
+    def test_parse_pool(self):
+        texts = ['I eat.', 'I drink.', 'I study.', 'I sleep.', 'I run.']
+        ERG = self.ghub.ERG
+        sents = ERG.parse_many(texts, ignore_cache=True, pool_size=3)
+        self.assertEqual([s.text for s in sents], texts)
+        for sent in sents:
+            self.assertGreater(len(sent), 0)
+        # workers are kept alive for the next batch
+        self.assertTrue(ERG.pools)
+        sents = ERG.parse_many(texts[::-1], ignore_cache=True, pool_size=3)
+        self.assertEqual([s.text for s in sents], texts[::-1])
+        ERG.close()
+        self.assertFalse(ERG.pools)
+
+    def test_aparse(self):
+        texts = ['I eat.', 'I drink.', 'I study.']
+
+        async def parse_all():
+            return await asyncio.gather(*[self.ghub.aparse(t, "ERG", pc=1, ignore_cache=True) for t in texts])
+        sents = self.ghub.run(parse_all())
+        self.assertEqual([s.text for s in sents], texts)
+        for sent in sents:
+            self.assertEqual(len(sent), 1)
+        j = self.ghub.run(self.ghub.aparse_json("I sleep.", "ERG", 1, ignore_cache=True))
+        self.assertEqual(len(j['parses']), 1)
+
     def test_isf_cache(self):
         txt = "I saw a girl with a telescope."
         grm = "ERG"
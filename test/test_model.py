@@ -9,15 +9,23 @@ Script for testing coolisf models
 # :copyright: (c) 2014 Le Tuan Anh <tuananh.ke@gmail.com>
 # :license: MIT, see LICENSE for more details.
 
+import os
+import gc
+import gzip
+import tempfile
 import unittest
 import logging
+import weakref
+import threading
 
 from texttaglib.chirptext import header
 from texttaglib.chirptext import texttaglib as ttl
 
 from coolisf import GrammarHub
 from coolisf.util import is_valid_name, sent2json
-from coolisf.model import Corpus, Document, Sentence, Reading
+from coolisf.wsd import WSDResources
+from coolisf.wsdpool import WSDPool
+from coolisf.model import Corpus, Document, Sentence, Reading, DocumentWriter, iter_sentences
 from coolisf.model import DMRSLayout, Node, Link, Predicate, Pred, Triplet, Synset, SenseTag
 
 
@@ -67,6 +75,44 @@ class TestSentenceModel(unittest.TestCase):
         lts = s.to_latex()  # LaTeX scripts
         self.assertTrue(lts)
 
+    def test_iter_sentences(self):
+        doc = Document("test")
+        for idx, (text, pred) in enumerate((("It rains.", "_rain_v_1"), ("It snows.", "_snow_v_1"), ("It rains.", "_rain_v_1"))):
+            sent = doc.new(text)
+            sent.ident = str(idx + 1)
+            sent.add("[ TOP: h0 RELS: < [ {}<3:9> LBL: h1 ARG0: e2 ] > HCONS: < h0 qeq h1 > ]".format(pred))
+        xml_str = doc.to_xml_str()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'test.xml.gz')
+            with gzip.open(path, 'wt') as outfile:
+                outfile.write(xml_str)
+            sents = list(iter_sentences(path))
+            self.assertEqual([s.text for s in sents], [s.text for s in doc])
+            self.assertEqual([s[0].dmrs().layout.nodes[0].predstr for s in sents], ['_rain_v_1', '_snow_v_1', '_rain_v_1'])
+            self.assertEqual([s.ident for s in iter_sentences(path, idents=['2', '3'])], ['2', '3'])
+            # Document.from_file reads sentences incrementally too
+            self.assertEqual(Document.from_file(path).to_xml_str(), Document.from_xml_str(xml_str).to_xml_str())
+
+    def test_document_writer(self):
+        doc = Document("test")
+        doc.new("It rains.").add("[ TOP: h0 RELS: < [ _rain_v_1<3:9> LBL: h1 ARG0: e2 ] > HCONS: < h0 qeq h1 > ]")
+        doc.new("It snows.").add("[ TOP: h0 RELS: < [ _snow_v_1<3:9> LBL: h1 ARG0: e2 ] > HCONS: < h0 qeq h1 > ]")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for filename in ('test.xml', 'test.xml.gz'):
+                path = os.path.join(tmpdir, filename)
+                with DocumentWriter(path, doc=doc, pretty_print=False) as writer:
+                    writer.write(doc[0])
+                    writer.write(doc[1])
+                self.assertEqual(writer.sent_count, 2)
+                sents = list(iter_sentences(path))
+                self.assertEqual([s.text for s in sents], ["It rains.", "It snows."])
+                self.assertEqual([s[0].dmrs().layout.nodes[0].predstr for s in sents], ['_rain_v_1', '_snow_v_1'])
+            # empty document
+            path = os.path.join(tmpdir, 'empty.xml')
+            with DocumentWriter(path):
+                pass
+            self.assertEqual(len(Document.from_file(path)), 0)
+
     def test_convert(self):
         print("Test convert DMRSLayout to and from XML")
         dmrs = Reading("""[ TOP: h0
@@ -160,6 +206,43 @@ class TestDMRSModel(unittest.TestCase):
         expected = ['the', 'adventure', 'of', 'the', 'speckled', 'band']
         self.assertEqual(expected, context)
 
+    def test_wsd_resources(self):
+        res = WSDResources.get()
+        self.assertIs(res, WSDResources.get())
+        self.assertIs(res.wsd, res.wsd)
+        self.assertIs(res.ctx, res.ctx)
+        # each thread has its own connections
+        others = []
+        t = threading.Thread(target=lambda: others.append((res.wsd, res.ctx)))
+        t.start()
+        t.join()
+        self.assertIsNot(others[0][0], res.wsd)
+        self.assertIsNot(others[0][1], res.ctx)
+        # resources of finished threads are not kept alive
+        holders = []
+        t = threading.Thread(target=lambda: holders.append(weakref.ref(res._resources())))
+        t.start()
+        t.join()
+        gc.collect()
+        self.assertIsNone(holders[0]())
+
+    def test_wsd_pool(self):
+        def make_doc():
+            doc = Document("test")
+            doc.new("It rains.").add("[ TOP: h0 RELS: < [ _rain_v_1<3:9> LBL: h1 ARG0: e2 ] > HCONS: < h0 qeq h1 > ]")
+            doc.new("Dogs bark.").add("[ TOP: h0 RELS: < [ udef_q<0:4> LBL: h4 ARG0: x3 RSTR: h5 BODY: h6 ] [ _dog_n_1<0:4> LBL: h7 ARG0: x3 ] [ _bark_v_1<5:10> LBL: h1 ARG0: e2 ARG1: x3 ] > HCONS: < h0 qeq h1 h5 qeq h7 > ]")
+            doc.new("Cats sleep.").add("[ TOP: h0 RELS: < [ udef_q<0:4> LBL: h4 ARG0: x3 RSTR: h5 BODY: h6 ] [ _cat_n_1<0:4> LBL: h7 ARG0: x3 ] [ _sleep_v_1<5:11> LBL: h1 ARG0: e2 ARG1: x3 ] > HCONS: < h0 qeq h1 h5 qeq h7 > ]")
+            return doc
+        serial = make_doc()
+        for sent in serial:
+            sent.tag_xml(method=ttl.Tag.MFS)
+        parallel = make_doc()
+        with WSDPool(2, chunksize=1) as pool:
+            errors = [error for sent, error in pool.tag(parallel, method=ttl.Tag.MFS)]
+        self.assertEqual(errors, [None] * len(parallel))
+        self.assertEqual(parallel.to_xml_str(), serial.to_xml_str())
+        self.assertEqual(parallel[1][0].dmrs().tags.keys(), serial[1][0].dmrs().tags.keys())
+
 
 class TestDMRSLayout(unittest.TestCase):
 
@@ -217,6 +300,20 @@ class TestDMRSLayout(unittest.TestCase):
         preds = r.dmrs().preds()
         self.assertEqual(preds, ['_guard_n_1_rel', '_dog_n_1_rel'])
 
+    def test_compact_layout(self):
+        l = Reading(self.guard_dog).dmrs().layout
+        for obj in (l.nodes[0], l.links[0], l.nodes[0].pred):
+            self.assertFalse(hasattr(obj, '__dict__'))
+        self.assertEqual(l.nodes[0].sortinfo.num, '')
+        comp = l[10000]
+        arg1 = comp['ARG1']
+        l.delete(comp)
+        self.assertEqual([n.nodeid for n in l.nodes], [10001, 10002, 10003])
+        self.assertNotIn(10000, l)
+        self.assertFalse([lnk for lnk in l.links if 10000 in (lnk.from_nodeid, lnk.to_nodeid)])
+        self.assertEqual([lnk.from_nodeid for lnk in arg1.in_links], [0])  # only the top link is left
+        self.assertIsNone(comp['ARG1'])
+
     def test_edit_partial_dmrs(self):
         r = Reading("""[ TOP: h0 RELS: < [ unknown<0:3> LBL: h1 ARG0: e2 [ e SF: prop-or-ques ] ] [ _yet_a_rel<0:3> LBL: h1 ARG0: e3 [ e MOOD: indicative SF: prop TENSE: untensed ] ARG1: e2 ] > HCONS: < h0 qeq h1 > ]""")
         l = r.dmrs().layout
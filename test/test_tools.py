@@ -9,13 +9,19 @@ Script for testing ISF tools
 # :copyright: (c) 2014 Le Tuan Anh <tuananh.ke@gmail.com>
 # :license: MIT, see LICENSE for more details.
 
+import os
+import tempfile
 import unittest
 import logging
+from argparse import Namespace
 
 from texttaglib.chirptext import texttaglib as ttl
 from coolisf import read_config
 from coolisf import GrammarHub
 from coolisf.common import overlap, tags_to_concepts
+from coolisf.model import Sentence, DocumentWriter, iter_sentences
+from coolisf.checkpoint import Checkpoint, recover_document, CHECKPOINT_SUFFIX
+from coolisf.main import parse_isf
 
 
 # -------------------------------------------------------------------------------
@@ -88,6 +94,70 @@ class TestTools(unittest.TestCase):
         doc_ttl.write_ttl()
 
 
+class TestCheckpoint(unittest.TestCase):
+
+    def make_sent(self, idx):
+        sent = Sentence("It rains {} times.".format(idx), ID=idx)
+        sent.add("[ TOP: h0 RELS: < [ _rain_v_1<3:9> LBL: h1 ARG0: e2 ] > HCONS: < h0 qeq h1 > ]")
+        return sent
+
+    def test_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'checkpoint.json')
+            cp = Checkpoint(path)
+            cp.update('corpus', 'doc1', sentences=10, done=True)
+            cp.update('corpus', 'doc2', sentences=3)
+            # a new run starts from scratch unless it is resumed
+            self.assertEqual(Checkpoint(path).completed('corpus', 'doc2'), 0)
+            cp = Checkpoint(path, resume=True)
+            self.assertTrue(cp.is_done('corpus', 'doc1'))
+            self.assertFalse(cp.is_done('corpus', 'doc2'))
+            self.assertEqual(cp.completed('corpus', 'doc2'), 3)
+            self.assertEqual(cp.completed('corpus', 'doc3'), 0)
+
+    def test_recover_document(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for filename in ('doc.xml', 'doc.xml.gz'):
+                path = os.path.join(tmpdir, filename)
+                # simulate a job that died after 5 sentences
+                writer = DocumentWriter(path)
+                for idx in range(5):
+                    writer.write(self.make_sent(idx + 1))
+                # resume from the 4th sentence
+                with DocumentWriter(path) as writer:
+                    done = recover_document(path, writer, 3)
+                    self.assertEqual(done, 3)
+                    for idx in range(done, 6):
+                        writer.write(self.make_sent(idx + 1))
+                self.assertEqual([s.ID for s in iter_sentences(path)], ['1', '2', '3', '4', '5', '6'])
+                self.assertFalse(os.path.exists(path + '.partial'))
+
+    def test_resume_parse_isf(self):
+        lines = ['It rains.', 'It rained.', 'Some dog barks.', 'Some dog barked.']
+        with tempfile.TemporaryDirectory() as tmpdir:
+            infile = os.path.join(tmpdir, 'input.txt')
+            with open(infile, 'wt') as outfile:
+                outfile.write('\n'.join(lines))
+            output = os.path.join(tmpdir, 'output.xml')
+            cli = Namespace(logger=getLogger())
+            args = Namespace(infile=infile, output=output, resume=False, max=1, topk=1, nocache=True, pool=None,
+                             wsd=ttl.Tag.MFS, compact=False, nodmrs=False)
+            # stopped by --max
+            parse_isf(cli, args)
+            cp = Checkpoint(output + CHECKPOINT_SUFFIX, resume=True)
+            key = os.path.abspath(infile)
+            self.assertFalse(cp.is_done(key))
+            done = cp.completed(key)
+            self.assertLess(done, len(lines))
+            self.assertEqual(len(list(iter_sentences(output))), done)
+            # the rest is parsed when resumed
+            args.resume = True
+            args.max = None
+            parse_isf(cli, args)
+            self.assertTrue(Checkpoint(output + CHECKPOINT_SUFFIX, resume=True).is_done(key))
+            self.assertEqual([s.text for s in iter_sentences(output)], lines)
+
+
 ########################################################################
 
 if __name__ == "__main__":